@@ -22,4 +22,5 @@ def login_required(request: Request, api: bool = False):
             root_path = request.scope.get("prefix", "")
             return RedirectResponse(url=f"{root_path}/login", status_code=302)
 
-    return None
\ No newline at end of file
+    return None
+
@@ -0,0 +1,74 @@
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.config import ADMIN_EMAILS
+from app.users.identity_cache import Principal, identity_cache
+from app.users.repo import get_user_by_email_async
+
+
+class AuthError(Exception):
+    """Lỗi xác thực trong dependency; trả JSON {"success": False, "error": ...}"""
+
+    def __init__(self, status_code: int, error: str):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+
+
+async def auth_error_handler(request: Request, exc: AuthError) -> JSONResponse:
+    return JSONResponse({"success": False, "error": exc.error}, status_code=exc.status_code)
+
+
+async def resolve_principal(email: str) -> Optional[Principal]:
+    """Principal theo email: identity cache trước, miss thì đọc M_User"""
+    principal = identity_cache.get(email)
+    if principal is not None:
+        return principal
+
+    row = await get_user_by_email_async(email)
+    if not row:
+        return None
+
+    principal = Principal(
+        user_cd=row.UserCD,
+        email=email,
+        display_name=getattr(row, "DisplayName", None),
+    )
+    identity_cache.put(principal)
+    return principal
+
+
+async def current_principal(request: Request) -> Principal:
+    """
+    Dependency cho API routes (thay cho login_required(request, api=True))
+
+    Dựng Principal một lần cho mỗi request (request.state.principal).
+
+    Raises:
+        AuthError 401 khi chưa login, 404 khi user không còn trong M_User
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+
+    user = request.session.get("user") if "session" in request.scope else None
+    email = (user or {}).get("email")
+    if not email:
+        raise AuthError(401, "Unauthorized")
+
+    principal = await resolve_principal(email)
+    if principal is None:
+        raise AuthError(404, "User not found")
+
+    request.state.principal = principal
+    return principal
+
+
+async def admin_principal(request: Request) -> Principal:
+    """Dependency cho admin API: như current_principal + email thuộc ADMIN_EMAILS"""
+    principal = await current_principal(request)
+    if principal.email.lower() not in ADMIN_EMAILS:
+        raise AuthError(403, "Forbidden")
+    return principal
@@ -8,7 +8,7 @@ from app.auth.oauth import oauth
 from app.auth.guard import login_required
 from app.config import LOGIN_MODE, inject_globals
 from app.chat.service import ChatService
-from app.users.repo import get_user_by_email, upsert_user
+from app.users.repo import get_user_by_email_async, upsert_user, upsert_user_async
 from app.logger import setup_logger
 
 logger = setup_logger("ai_chatbot")
@@ -18,25 +18,40 @@ templates.env.globals.update(inject_globals())
 # PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")
 
 
+# MODE 1: mọi request dùng chung system user
+SYSTEM_USER = {
+    "email": "system@local.com",
+    "microsoft_id": "microsoft_id_DUMMY",
+    "display_name": "System User",
+    "provider": "microsoft",
+}
+_system_user = None
+
+
+async def resolve_system_user():
+    """Đảm bảo có system user trong M_User và cache lại (gọi một lần lúc startup)"""
+    global _system_user
+    _system_user = await upsert_user_async(**SYSTEM_USER)
+    logger.info("System user resolved: user_cd=%s", _system_user["UserCD"])
+
+
+def get_system_user():
+    """System user đã cache; chưa resolve được lúc startup thì upsert tại đây"""
+    global _system_user
+    if _system_user is None:
+        _system_user = upsert_user(**SYSTEM_USER)
+    return _system_user
+
+
 def check_login_mode(request: Request):
     # MODE 1: không cần login → cấm vào trang login
     if LOGIN_MODE == 1:
-        # đảm bảo có system user
-        email = "system@local.com"
-        microsoft_id = "microsoft_id_DUMMY"
-        name = "System User"
-
-        user_db = upsert_user(
-            email=email,
-            microsoft_id=microsoft_id,
-            display_name=name,
-            provider="microsoft",
-        )
+        user_db = get_system_user()
 
         request.session["user"] = {
-            "email": email,
-            "name": name,
-            "oid": microsoft_id,
+            "email": SYSTEM_USER["email"],
+            "name": SYSTEM_USER["display_name"],
+            "oid": SYSTEM_USER["microsoft_id"],
             "user_cd": user_db["UserCD"],
         }
         root_path = request.scope.get("prefix", "")
@@ -150,7 +165,7 @@ async def auth_callback(request: Request):
     logger.info("User logged in: %s (%s)", email, microsoft_id)
 
     if LOGIN_MODE == 3:
-        user = get_user_by_email(email)
+        user = await get_user_by_email_async(email)
         if not user:
             # return templates.TemplateResponse(
             #     "loginerr.html", {"request": request, "login_mode": LOGIN_MODE}
@@ -163,7 +178,7 @@ async def auth_callback(request: Request):
             return RedirectResponse(url=f"{root_path}/loginerr", status_code=302)
             # return HTMLResponse("Access denied", status_code=403)
 
-    user_db = upsert_user(
+    user_db = await upsert_user_async(
         email=email, microsoft_id=microsoft_id, display_name=name, provider="microsoft"
     )
 
@@ -0,0 +1,101 @@
+import os
+import threading
+from typing import Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+from app.azure.blob_storage import AzureBlobStorage
+
+# Giới hạn một lần append_block (4 MiB cho mọi service version)
+MAX_APPEND_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+class AzureAppendBlobStore:
+    """
+    Append blob trong container AZURE_BLOB_CONTAINER (segment archive T_QA_Log)
+
+    Client được tạo lazy ở lần dùng đầu, nên app không cần config Azure
+    nếu không bật archive.
+    """
+
+    def __init__(self, storage: Optional[AzureBlobStorage] = None):
+        self._storage = storage
+        self._lock = threading.Lock()
+
+    def _blob(self, blob_name: str):
+        with self._lock:
+            if self._storage is None:
+                self._storage = AzureBlobStorage()
+        return self._storage.blob_service_client.get_blob_client(
+            container=self._storage.container_name,
+            blob=blob_name,
+        )
+
+    def size(self, blob_name: str) -> int:
+        try:
+            return self._blob(blob_name).get_blob_properties().size
+        except ResourceNotFoundError:
+            return 0
+
+    def append(self, blob_name: str, data: bytes) -> int:
+        """Append `data` liền một khối vào cuối blob (tạo nếu chưa có), trả về offset bắt đầu"""
+        blob = self._blob(blob_name)
+        try:
+            blob.create_append_blob(match_condition=MatchConditions.IfMissing)
+        except (ResourceExistsError, ResourceModifiedError):
+            pass
+
+        offset = None
+        for i in range(0, len(data), MAX_APPEND_BLOCK_BYTES):
+            chunk = data[i:i + MAX_APPEND_BLOCK_BYTES]
+            if offset is None:
+                result = blob.append_block(chunk)
+                offset = int(result["blob_append_offset"])
+            else:
+                # Các block sau phải nối ngay sau block trước (không xen với writer khác)
+                blob.append_block(chunk, appendpos_condition=offset + i)
+        return offset
+
+    def read(self, blob_name: str, offset: int, length: int) -> bytes:
+        return self._blob(blob_name).download_blob(offset=offset, length=length).readall()
+
+
+class LocalAppendBlobStore:
+    """
+    Stand-in local cho AzureAppendBlobStore: mỗi blob là một file dưới `root`
+
+    Dùng cho dev / test (ARCHIVE_LOCAL_DIR), cùng interface với Azure.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, blob_name: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, blob_name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid blob name: {blob_name!r}")
+        return path
+
+    def size(self, blob_name: str) -> int:
+        try:
+            return os.path.getsize(self._path(blob_name))
+        except FileNotFoundError:
+            return 0
+
+    def append(self, blob_name: str, data: bytes) -> int:
+        path = self._path(blob_name)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        return offset
+
+    def read(self, blob_name: str, offset: int, length: int) -> bytes:
+        with open(self._path(blob_name), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
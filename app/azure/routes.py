@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import Response
-from app.auth.guard import login_required
+from app.auth.principal import Principal, current_principal
 from app.azure.blob_storage import AzureBlobStorage
 from fastapi.responses import StreamingResponse
 from azure.core.exceptions import ResourceNotFoundError
@@ -22,11 +22,7 @@ from fastapi.responses import StreamingResponse
 
 
 @router.get("/view/{blob_name:path}")
-def view_pdf(request: Request, blob_name: str):
-    guard = login_required(request, api=True)
-    if guard:
-        return guard
-
+def view_pdf(request: Request, blob_name: str, principal: Principal = Depends(current_principal)):
     blob_client = blob_service.blob_service_client.get_blob_client(
         container=blob_service.container_name,
         blob=blob_name,
@@ -70,19 +66,19 @@ def view_pdf(request: Request, blob_name: str):
 
 
 @router.get("/file/{blob_name:path}")
-def download_file(request: Request, blob_name: str):
+def download_file(request: Request, blob_name: str, principal: Principal = Depends(current_principal)):
     try:
         # blob_name = "/FolderA/FolderA3/Tailieu.ngoaingu24h.vn.pdf"
         # http://localhost:8086/download/file/FolderA/FolderA3/Tailieu.ngoaingu24h.vn.pdf
         print("Downloading blob:", blob_name)
-        guard = login_required(request, api=True)
-        if guard:
-            return guard
         file_bytes = blob_service.download_blob(blob_name)
 
+        # Content-Type thật để compression middleware bỏ qua file đã nén (PDF...)
+        mime_type, _ = mimetypes.guess_type(blob_name)
+
         return Response(
             content=file_bytes,
-            media_type="application/octet-stream",
+            media_type=mime_type or "application/octet-stream",
             headers={
                 "Content-Disposition": f'attachment; filename="{blob_name.split("/")[-1]}"'
             },
@@ -93,14 +89,13 @@ def download_file(request: Request, blob_name: str):
 
 
 @router.get("/stream/{blob_name:path}")
-def download_files_stream(request: Request, blob_name: str):
+def download_files_stream(
+    request: Request, blob_name: str, principal: Principal = Depends(current_principal)
+):
     try:
         # blob_name = "/FolderA/FolderA3/Tailieu.ngoaingu24h.vn.pdf"
         # http://localhost:8086/download/stream/FolderA/FolderA3/Tailieu.ngoaingu24h.vn.pdf
         print("Streaming blob stream: ", blob_name)
-        guard = login_required(request, api=True)
-        if guard:
-            return guard
         blob_client = blob_service.blob_service_client.get_blob_client(
             blob=blob_name, container=blob_service.container_name
         )
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from app.config import (
+    CHAT_MAX_CONCURRENT_STREAMS,
+    CHAT_QUEUE_LIMIT,
+    CHAT_MAX_QUEUE_WAIT,
+    CHAT_USER_RATE_PER_MIN,
+    CHAT_USER_BURST,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối; route trả 429 kèm Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: int):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Lấy 1 token; trả 0 nếu thành công, ngược lại số giây cần chờ"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        if self.rate <= 0:
+            return CHAT_MAX_QUEUE_WAIT
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class AdmissionSlot:
+    """Slot upstream đã được cấp; release() idempotent"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    Giới hạn số upstream stream đồng thời cho /api/chat
+
+    - Global cap `max_concurrent` upstream streams.
+    - Token bucket theo user_cd (rate/phút + burst) -> 429 ngay khi hết token.
+      Request dùng chung upstream stream đang chạy (single-flight) chỉ tốn
+      token (take_token), không chiếm slot.
+    - Khi hết slot, request chờ trong queue công bằng: round-robin theo user_cd,
+      tổng số chờ tối đa `queue_limit`, chờ quá `max_wait` giây -> 429.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = CHAT_MAX_CONCURRENT_STREAMS,
+        queue_limit: int = CHAT_QUEUE_LIMIT,
+        max_wait: float = CHAT_MAX_QUEUE_WAIT,
+        rate_per_min: float = CHAT_USER_RATE_PER_MIN,
+        burst: int = CHAT_USER_BURST,
+    ):
+        self.max_concurrent = max_concurrent
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.rate_per_sec = rate_per_min / 60
+        self.burst = burst
+
+        self._active = 0
+        self._queued = 0
+        # user_cd -> deque[Future]; thứ tự key = thứ tự round-robin
+        self._waiters: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+        self._buckets: Dict[Any, TokenBucket] = {}
+
+        self._stats = {
+            "admitted": 0,
+            "queued_total": 0,
+            "rejected_rate_limit": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    def take_token(self, user_cd):
+        """
+        Lấy một token rate limit của user (không xin slot upstream)
+
+        Raises:
+            AdmissionRejected khi vượt rate limit
+        """
+        if self.rate_per_sec > 0 or self.burst > 0:
+            wait = self._bucket(user_cd).take()
+            if wait > 0:
+                self._stats["rejected_rate_limit"] += 1
+                raise AdmissionRejected("rate_limited", wait)
+
+    async def acquire(self, user_cd, charge: bool = True) -> AdmissionSlot:
+        """
+        Xin một upstream slot cho user
+
+        Args:
+            charge: False khi request đã lấy token qua take_token
+
+        Raises:
+            AdmissionRejected khi vượt rate limit, queue đầy hoặc chờ quá lâu
+        """
+        if charge:
+            self.take_token(user_cd)
+
+        if self._active < self.max_concurrent and self._queued == 0:
+            return self._admit(0)
+
+        if self._queued >= self.queue_limit:
+            self._stats["rejected_queue_full"] += 1
+            raise AdmissionRejected("queue_full", self._estimate_retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_cd, deque()).append(future)
+        self._queued += 1
+        self._stats["queued_total"] += 1
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Slot đã được cấp đúng lúc timeout/cancel -> trả lại
+                self._release()
+            else:
+                future.cancel()
+                self._remove_waiter(user_cd, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._stats["rejected_timeout"] += 1
+            raise AdmissionRejected("queue_timeout", self._estimate_retry_after())
+
+        return self._admit((time.monotonic() - started) * 1000, counted=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        admitted = self._stats["admitted"]
+        return {
+            **self._stats,
+            "active": self._active,
+            "queued": self._queued,
+            "waiting_users": len(self._waiters),
+            "wait_ms_avg": round(self._stats["wait_ms_total"] / admitted, 1) if admitted else 0.0,
+        }
+
+    # ------------------------------------------------------------------ #
+
+    def _admit(self, wait_ms: float, counted: bool = False) -> AdmissionSlot:
+        if not counted:
+            self._active += 1
+        self._stats["admitted"] += 1
+        self._stats["wait_ms_total"] += wait_ms
+        self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], round(wait_ms, 1))
+        return AdmissionSlot(self)
+
+    def _release(self):
+        self._active -= 1
+        # Chuyển slot cho waiter kế tiếp theo round-robin user
+        while self._waiters and self._active < self.max_concurrent:
+            user_cd, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(user_cd)
+            else:
+                del self._waiters[user_cd]
+            if not future.done():
+                self._active += 1
+                future.set_result(True)
+
+    def _remove_waiter(self, user_cd, future: asyncio.Future):
+        queue = self._waiters.get(user_cd)
+        if queue and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[user_cd]
+
+    def _bucket(self, user_cd) -> TokenBucket:
+        bucket = self._buckets.get(user_cd)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Bỏ các bucket đã đầy (user không hoạt động)
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[user_cd] = TokenBucket(self.rate_per_sec, self.burst)
+        return bucket
+
+    def _estimate_retry_after(self) -> float:
+        admitted = self._stats["admitted"]
+        avg_wait = (self._stats["wait_ms_total"] / admitted / 1000) if admitted else 1
+        return max(avg_wait, 1)
+
+
+# Create singleton instance
+admission_controller = AdmissionController()
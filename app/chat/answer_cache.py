@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.config import ANSWER_CACHE_ENABLED, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Chuẩn hóa câu hỏi để so khớp exact-match
+
+    NFKC (gộp full-width / half-width, ví dụ "ＰＤＦ" -> "PDF", "ｶﾞ" -> "ガ"),
+    lowercase, bỏ dấu câu / ký hiệu (。、？！「」...) và gộp khoảng trắng.
+    """
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = "".join(
+        " " if unicodedata.category(ch)[0] in ("P", "S") else ch for ch in text
+    )
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def history_fingerprint(chat_history: Optional[List[Dict[str, Any]]]) -> str:
+    """Hash của chat_history (question/answer đã normalize) gửi lên upstream"""
+    if not chat_history:
+        return ""
+    turns = [
+        [normalize_question(h.get("question", "")), normalize_question(h.get("answer", ""))]
+        for h in chat_history
+        if isinstance(h, dict)
+    ]
+    payload = json.dumps(turns, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(question: str, chat_history: Optional[List[Dict[str, Any]]]) -> str:
+    return f"{normalize_question(question)}\x00{history_fingerprint(chat_history)}"
+
+
+class AnswerCache:
+    """
+    TTL + LRU cache cho câu trả lời đã stream xong
+
+    Value là list event (text/metadata) theo đúng thứ tự upstream đã gửi,
+    để hit được replay qua cùng NDJSON stream như một câu trả lời thật.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = ANSWER_CACHE_ENABLED,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+
+        expires_at, events = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return events
+
+    def put(self, key: str, events: List[Dict[str, Any]]):
+        if not self.enabled or not events:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, events)
+        self._entries.move_to_end(key)
+        self._stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, question: Optional[str] = None) -> int:
+        """
+        Xóa cache: toàn bộ, hoặc chỉ các entry của một câu hỏi (mọi history)
+
+        Returns:
+            Số entry đã xóa
+        """
+        if question is None:
+            removed = len(self._entries)
+            self._entries.clear()
+        else:
+            prefix = normalize_question(question) + "\x00"
+            keys = [k for k in self._entries if k.startswith(prefix)]
+            for k in keys:
+                del self._entries[k]
+            removed = len(keys)
+
+        self._stats["invalidations"] += 1
+        logger.info(f"Answer cache invalidated: question={question!r}, removed={removed}")
+        return removed
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled, "size": len(self._entries)}
+
+
+# Create singleton instance
+answer_cache = AnswerCache()
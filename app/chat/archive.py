@@ -0,0 +1,347 @@
+"""
+Hot / cold tiering cho T_QA_Log
+
+Session không có hoạt động quá N ngày (T_QA_Session.LastMessageAt) được
+chuyển khỏi T_QA_Log sang segment gzip append-only theo user trên Azure Blob
+(container AZURE_BLOB_CONTAINER):
+
+    {ARCHIVE_BLOB_PREFIX}/{UserCD}/{SegmentNo:06d}.gz
+
+Mỗi lần archive một session append một gzip member (JSON list các turn) vào
+segment hiện tại của user; bảng manifest T_QA_Archive ghi (blob, offset,
+length, khoảng TurnNo) để đọc lại đúng đoạn đó bằng range read. T_QA_Session
+giữ nguyên nên sidebar không đổi; các reader (get_session_history, history
+builder, stream / turn endpoint, search index) tự lấy các turn đã archive
+(xem QALogArchive.load_turns).
+
+Tạo bảng manifest + chạy archive:
+
+    python -m app.chat.archive --create-table
+    python -m app.chat.archive [--days 180] [--limit 500]
+
+ARCHIVE_LOCAL_DIR=<dir> dùng thư mục local thay cho Azure (dev / test).
+"""
+
+import argparse
+import gzip
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from app import codec
+from app.azure.append_blob import AzureAppendBlobStore, LocalAppendBlobStore
+from app.config import (
+    ARCHIVE_ENABLED,
+    ARCHIVE_INACTIVE_DAYS,
+    ARCHIVE_BATCH_SESSIONS,
+    ARCHIVE_BLOB_PREFIX,
+    ARCHIVE_SEGMENT_MAX_BYTES,
+    ARCHIVE_LOCAL_DIR,
+)
+from app.db.connection import READ, conversation_key, db_connection, db_router, user_key
+from app.db.executor import db_executor
+
+logger = logging.getLogger(__name__)
+
+CREATE_ARCHIVE_TABLE_SQL = """
+    IF OBJECT_ID(N'dbo.T_QA_Archive', N'U') IS NULL
+    BEGIN
+        CREATE TABLE dbo.T_QA_Archive (
+            ArchiveCD    BIGINT         IDENTITY(1,1) NOT NULL PRIMARY KEY,
+            SessionId    VARCHAR(36)    NOT NULL,
+            UserCD       BIGINT         NOT NULL,
+            SegmentNo    INT            NOT NULL,
+            BlobName     NVARCHAR(400)  NOT NULL,
+            BlobOffset   BIGINT         NOT NULL,
+            BlobLength   INT            NOT NULL,
+            FirstTurnNo  INT            NOT NULL,
+            LastTurnNo   INT            NOT NULL,
+            TurnCount    INT            NOT NULL,
+            ArchivedAt   DATETIME       NOT NULL DEFAULT GETDATE()
+        );
+
+        CREATE INDEX IX_T_QA_Archive_SessionId
+            ON dbo.T_QA_Archive (SessionId, FirstTurnNo)
+            INCLUDE (LastTurnNo, BlobName, BlobOffset, BlobLength);
+
+        CREATE INDEX IX_T_QA_Archive_UserCD_SegmentNo
+            ON dbo.T_QA_Archive (UserCD, SegmentNo)
+            INCLUDE (BlobName);
+    END
+"""
+
+ARCHIVE_CANDIDATES_SQL = """
+    SELECT TOP (?) s.SessionId, s.UserCD
+    FROM dbo.T_QA_Session s
+    WHERE s.LastMessageAt < DATEADD(DAY, -?, GETDATE())
+      AND EXISTS (SELECT 1 FROM dbo.T_QA_Log l WHERE l.SessionId = s.SessionId)
+    ORDER BY s.LastMessageAt ASC
+"""
+
+# UPDLOCK + HOLDLOCK giữ range của session tới hết transaction: Register_QA_Log
+# (cũng lấy UPDLOCK trên range này) phải chờ, nên không có turn mới chen vào
+# giữa lúc đọc, append blob và xóa khỏi hot table
+SESSION_LOGS_SQL = """
+    SET NOCOUNT ON;
+
+    SELECT
+        QALogCD,
+        SessionId,
+        TurnNo,
+        UserCD,
+        QuestionText,
+        AnswerText,
+        ResolvedTurnNo,
+        RegisteredAt
+    FROM dbo.T_QA_Log WITH (UPDLOCK, HOLDLOCK)
+    WHERE SessionId = ?
+    ORDER BY TurnNo ASC
+"""
+
+USER_SEGMENT_SQL = """
+    SELECT TOP 1 SegmentNo, BlobName
+    FROM dbo.T_QA_Archive
+    WHERE UserCD = ?
+    ORDER BY SegmentNo DESC
+"""
+
+# Ghi manifest + xóa khỏi hot table, cùng transaction với SESSION_LOGS_SQL.
+# Blob chỉ được append sau khi đã giữ lock (session chắc chắn không có turn
+# mới); đoạn append chỉ thành rác (không có manifest trỏ tới) khi statement
+# này / commit lỗi.
+ARCHIVE_COMMIT_SQL = """
+    SET NOCOUNT ON;
+
+    DECLARE @SessionId VARCHAR(36) = ?;
+    DECLARE @UserCD BIGINT = ?;
+    DECLARE @MaxQALogCD BIGINT = ?;
+
+    INSERT INTO dbo.T_QA_Archive (
+        SessionId, UserCD, SegmentNo, BlobName, BlobOffset, BlobLength,
+        FirstTurnNo, LastTurnNo, TurnCount
+    )
+    VALUES (@SessionId, @UserCD, ?, ?, ?, ?, ?, ?, ?);
+
+    DELETE FROM dbo.T_QA_Log
+    WHERE SessionId = @SessionId AND QALogCD <= @MaxQALogCD;
+"""
+
+SESSION_PARTS_SQL = """
+    SELECT BlobName, BlobOffset, BlobLength
+    FROM dbo.T_QA_Archive
+    WHERE SessionId = ? AND LastTurnNo > ? AND FirstTurnNo < ?
+    ORDER BY FirstTurnNo ASC
+"""
+
+USER_PARTS_SQL = """
+    SELECT BlobName, BlobOffset, BlobLength
+    FROM dbo.T_QA_Archive
+    WHERE UserCD = ?
+    ORDER BY ArchiveCD ASC
+"""
+
+
+def encode_part(logs: List[Dict[str, Any]]) -> bytes:
+    """Các turn của session -> một gzip member (JSON list)"""
+    rows = [
+        {**log, "RegisteredAt": log["RegisteredAt"].isoformat() if log["RegisteredAt"] else None}
+        for log in logs
+    ]
+    return gzip.compress(codec.dumps(rows))
+
+
+def decode_part(data: bytes) -> List[Dict[str, Any]]:
+    logs = codec.loads(gzip.decompress(data))
+    for log in logs:
+        if log["RegisteredAt"]:
+            log["RegisteredAt"] = datetime.fromisoformat(log["RegisteredAt"])
+    return logs
+
+
+class QALogArchive:
+    """
+    Archive / đọc lại T_QA_Log từ segment trên blob
+
+    Các method đều blocking (DB + blob I/O) - trong app gọi qua db_executor.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        enabled: bool = ARCHIVE_ENABLED,
+        prefix: str = ARCHIVE_BLOB_PREFIX,
+        segment_max_bytes: int = ARCHIVE_SEGMENT_MAX_BYTES,
+    ):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.segment_max_bytes = segment_max_bytes
+        self._store = store
+        self._lock = threading.Lock()
+        self._stats = {"archived_sessions": 0, "archived_turns": 0, "loads": 0, "loaded_turns": 0}
+
+    @property
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                self._store = LocalAppendBlobStore(ARCHIVE_LOCAL_DIR) if ARCHIVE_LOCAL_DIR else AzureAppendBlobStore()
+            return self._store
+
+    def _blob_name(self, user_cd: int, segment_no: int) -> str:
+        return f"{self.prefix}/{user_cd}/{segment_no:06d}.gz"
+
+    def _segment_for(self, cursor, user_cd: int, size: int):
+        """Segment hiện tại của user; sang segment mới khi segment hiện tại sẽ vượt segment_max_bytes"""
+        row = cursor.execute(USER_SEGMENT_SQL, (user_cd,)).fetchone()
+        if row is None:
+            return 1, self._blob_name(user_cd, 1)
+        current = self.store.size(row.BlobName)
+        if current and current + size > self.segment_max_bytes:
+            return row.SegmentNo + 1, self._blob_name(user_cd, row.SegmentNo + 1)
+        return row.SegmentNo, row.BlobName
+
+    def archive_session(self, session_id: str, user_cd: int) -> int:
+        """
+        Chuyển toàn bộ turn hiện có của session sang blob
+
+        Returns:
+            Số turn đã archive (0 nếu bỏ qua)
+        """
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SESSION_LOGS_SQL, (session_id,))
+            columns = [col[0] for col in cursor.description]
+            logs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            if not logs:
+                return 0
+
+            data = encode_part(logs)
+            segment_no, blob_name = self._segment_for(cursor, user_cd, len(data))
+            offset = self.store.append(blob_name, data)
+
+            cursor.execute(ARCHIVE_COMMIT_SQL, (
+                session_id, user_cd, max(log["QALogCD"] for log in logs),
+                segment_no, blob_name, offset, len(data),
+                logs[0]["TurnNo"], logs[-1]["TurnNo"], len(logs),
+            ))
+            conn.commit()
+
+        db_router.mark_write(conversation_key(session_id), user_key(user_cd))
+        self._stats["archived_sessions"] += 1
+        self._stats["archived_turns"] += len(logs)
+        logger.info(
+            f"Archived session: session_id={session_id}, turns={len(logs)}, "
+            f"blob={blob_name}, offset={offset}, bytes={len(data)}"
+        )
+        return len(logs)
+
+    def run(self, days: int = ARCHIVE_INACTIVE_DAYS, limit: int = ARCHIVE_BATCH_SESSIONS) -> Dict[str, int]:
+        """Archive tối đa `limit` session không hoạt động quá `days` ngày (cũ nhất trước)"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            candidates = cursor.execute(ARCHIVE_CANDIDATES_SQL, (limit, days)).fetchall()
+
+        sessions = turns = 0
+        for candidate in candidates:
+            try:
+                archived = self.archive_session(candidate.SessionId, candidate.UserCD)
+            except Exception as e:
+                logger.error(f"Failed to archive session {candidate.SessionId}: {str(e)}")
+                continue
+            if archived:
+                sessions += 1
+                turns += archived
+        return {"candidates": len(candidates), "sessions": sessions, "turns": turns}
+
+    def load_turns(
+        self,
+        session_id: str,
+        after_turn: Optional[int] = None,
+        before_turn: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Các turn đã archive của session có after_turn < TurnNo < before_turn (TurnNo tăng dần)
+
+        Chỉ đọc blob khi manifest có đoạn giao với khoảng cần lấy.
+        """
+        if not self.enabled:
+            return []
+        low = after_turn if after_turn is not None else 0
+        high = before_turn if before_turn is not None else 2 ** 31 - 1
+        if high - low <= 1:
+            return []
+
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            cursor = conn.cursor()
+            parts = cursor.execute(SESSION_PARTS_SQL, (session_id, low, high)).fetchall()
+
+        logs = []
+        for part in parts:
+            data = self.store.read(part.BlobName, part.BlobOffset, part.BlobLength)
+            logs.extend(log for log in decode_part(data) if low < log["TurnNo"] < high)
+        if parts:
+            self._stats["loads"] += 1
+            self._stats["loaded_turns"] += len(logs)
+        logs.sort(key=lambda log: log["TurnNo"])
+        return logs
+
+    def iter_user_turns(self, user_cd: int) -> Iterator[List[Dict[str, Any]]]:
+        """Mọi turn đã archive của user, mỗi part (session) một list - dùng khi build search index"""
+        if not self.enabled:
+            return
+        with db_connection(READ, user_key(user_cd)) as conn:
+            cursor = conn.cursor()
+            parts = cursor.execute(USER_PARTS_SQL, (user_cd,)).fetchall()
+
+        for part in parts:
+            logs = decode_part(self.store.read(part.BlobName, part.BlobOffset, part.BlobLength))
+            self._stats["loads"] += 1
+            self._stats["loaded_turns"] += len(logs)
+            yield logs
+
+    async def load_turns_async(
+        self,
+        session_id: str,
+        after_turn: Optional[int] = None,
+        before_turn: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """load_turns trên DB executor; [] ngay khi không bật archive / không có khoảng nào để đọc"""
+        if not self.enabled or before_turn == 1:
+            return []
+        return await db_executor.run(self.load_turns, session_id, after_turn, before_turn)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled}
+
+
+# Create singleton instance
+qa_log_archive = QALogArchive()
+
+
+def create_table():
+    with db_connection() as conn:
+        conn.cursor().execute(CREATE_ARCHIVE_TABLE_SQL)
+        conn.commit()
+    logger.info("T_QA_Archive is ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive inactive sessions of T_QA_Log to blob segments")
+    parser.add_argument("--create-table", action="store_true", help="create T_QA_Archive if missing")
+    parser.add_argument("--days", type=int, default=ARCHIVE_INACTIVE_DAYS, help="archive sessions inactive for N days")
+    parser.add_argument("--limit", type=int, default=ARCHIVE_BATCH_SESSIONS, help="max sessions per run")
+    parser.add_argument("--skip-archive", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    if args.create_table:
+        create_table()
+    if not args.skip_archive:
+        result = qa_log_archive.run(args.days, args.limit)
+        logger.info(
+            f"Archive done: candidates={result['candidates']}, sessions={result['sessions']}, turns={result['turns']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,161 @@
 import logging
-from typing import Dict, Any, List
-from app.db.connection import get_conn
+import pyodbc
+from datetime import datetime
+from typing import AsyncIterator, Dict, Any, Iterator, List, Optional, Tuple
+from app.db.connection import READ, conversation_key, db_connection, db_router, user_key
+from app.db.executor import db_executor
+from app.config import HISTORY_FETCH_BATCH_SIZE, HISTORY_PREVIEW_CHARS, SEARCH_INDEX_FETCH_BATCH_SIZE
+from app.chat.session_summary import (
+    SESSION_ON_REGISTER_SQL,
+    SESSION_ON_BULK_REGISTER_SQL,
+    SESSION_ON_RESOLVED_SQL,
+    USER_SESSIONS_SQL,
+    USER_SESSIONS_BEFORE_SQL,
+    USER_SESSIONS_SINCE_SQL,
+    USER_SESSIONS_VERSION_SQL,
+    SESSION_VERSION_SQL,
+    SESSION_RESOLVED_TURN_SQL,
+)
 
 logger = logging.getLogger(__name__)
 
+# TurnNo truyền vào là đề xuất (NULL = tự cấp). Nếu đã có turn >= đề xuất
+# (worker khác ghi trước) thì cấp lại MAX(TurnNo) + 1; UPDLOCK + HOLDLOCK giữ
+# range của session tới hết transaction nên hai writer không thể trùng TurnNo.
+REGISTER_QA_LOG_SQL = """
+    DECLARE @SessionId VARCHAR(36) = ?;
+    DECLARE @TurnNo INT = ?;
+    DECLARE @MaxTurnNo INT;
+    DECLARE @OUT_QALogCD BIGINT;
+    DECLARE @OUT_ERR_CD INT;
+    DECLARE @OUT_ERR_MSG NVARCHAR(MAX);
+
+    SELECT @MaxTurnNo = ISNULL(MAX(TurnNo), 0)
+    FROM T_QA_Log WITH (UPDLOCK, HOLDLOCK)
+    WHERE SessionId = @SessionId;
+
+    IF @TurnNo IS NULL OR @TurnNo <= @MaxTurnNo
+        SET @TurnNo = @MaxTurnNo + 1;
+
+    EXEC [dbo].[Register_QA_Log]
+        @IN_SessionId = @SessionId,
+        @IN_TurnNo = @TurnNo,
+        @IN_UserCD = ?,
+        @IN_QuestionText = ?,
+        @IN_AnswerText = ?,
+        @OUT_QALogCD = @OUT_QALogCD OUTPUT,
+        @OUT_ERR_CD = @OUT_ERR_CD OUTPUT,
+        @OUT_ERR_MSG = @OUT_ERR_MSG OUTPUT;
+
+    SELECT @OUT_QALogCD AS QALogCD, @TurnNo AS TurnNo, @OUT_ERR_CD AS ErrCD, @OUT_ERR_MSG AS ErrMsg;
+"""
+
+
+# Bulk ingestion (register_qa_log_bulk): nạp rows vào temp table bằng
+# fast_executemany, rồi một batch phía server gọi Register_QA_Log cho từng
+# dòng (cùng logic cấp TurnNo như REGISTER_QA_LOG_SQL) và trả kết quả theo RowNo.
+BULK_CREATE_SQL = """
+    IF OBJECT_ID(N'tempdb..#QA_Log_Bulk') IS NOT NULL
+        DROP TABLE #QA_Log_Bulk;
+
+    CREATE TABLE #QA_Log_Bulk (
+        RowNo         INT            NOT NULL PRIMARY KEY,
+        SessionId     VARCHAR(36)    NOT NULL,
+        TurnNo        INT            NULL,
+        UserCD        BIGINT         NOT NULL,
+        QuestionText  NVARCHAR(MAX)  NULL,
+        AnswerText    NVARCHAR(MAX)  NULL,
+        QALogCD       BIGINT         NULL,
+        ErrCD         INT            NULL,
+        ErrMsg        NVARCHAR(MAX)  NULL
+    );
+"""
+
+BULK_INSERT_SQL = """
+    INSERT INTO #QA_Log_Bulk (RowNo, SessionId, TurnNo, UserCD, QuestionText, AnswerText)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+BULK_INSERT_SIZES = [
+    (pyodbc.SQL_INTEGER, 0, 0),
+    (pyodbc.SQL_VARCHAR, 36, 0),
+    (pyodbc.SQL_INTEGER, 0, 0),
+    (pyodbc.SQL_BIGINT, 0, 0),
+    (pyodbc.SQL_WVARCHAR, 0, 0),  # 0 = nvarchar(max)
+    (pyodbc.SQL_WVARCHAR, 0, 0),
+]
+
+BULK_REGISTER_SQL = """
+    SET NOCOUNT ON;
+
+    DECLARE @RowNo INT = 1;
+    DECLARE @RowCount INT = (SELECT COUNT(*) FROM #QA_Log_Bulk);
+    DECLARE @SessionId VARCHAR(36);
+    DECLARE @TurnNo INT;
+    DECLARE @MaxTurnNo INT;
+    DECLARE @UserCD BIGINT;
+    DECLARE @QuestionText NVARCHAR(MAX);
+    DECLARE @AnswerText NVARCHAR(MAX);
+    DECLARE @OUT_QALogCD BIGINT;
+    DECLARE @OUT_ERR_CD INT;
+    DECLARE @OUT_ERR_MSG NVARCHAR(MAX);
+
+    WHILE @RowNo <= @RowCount
+    BEGIN
+        SELECT @SessionId = NULL, @TurnNo = NULL, @UserCD = NULL, @QuestionText = NULL, @AnswerText = NULL;
+
+        SELECT
+            @SessionId = SessionId, @TurnNo = TurnNo, @UserCD = UserCD,
+            @QuestionText = QuestionText, @AnswerText = AnswerText
+        FROM #QA_Log_Bulk
+        WHERE RowNo = @RowNo;
+
+        SELECT @MaxTurnNo = ISNULL(MAX(TurnNo), 0)
+        FROM T_QA_Log WITH (UPDLOCK, HOLDLOCK)
+        WHERE SessionId = @SessionId;
+
+        IF @TurnNo IS NULL OR @TurnNo <= @MaxTurnNo
+            SET @TurnNo = @MaxTurnNo + 1;
+
+        SELECT @OUT_QALogCD = NULL, @OUT_ERR_CD = NULL, @OUT_ERR_MSG = NULL;
+
+        EXEC [dbo].[Register_QA_Log]
+            @IN_SessionId = @SessionId,
+            @IN_TurnNo = @TurnNo,
+            @IN_UserCD = @UserCD,
+            @IN_QuestionText = @QuestionText,
+            @IN_AnswerText = @AnswerText,
+            @OUT_QALogCD = @OUT_QALogCD OUTPUT,
+            @OUT_ERR_CD = @OUT_ERR_CD OUTPUT,
+            @OUT_ERR_MSG = @OUT_ERR_MSG OUTPUT;
+
+        -- SP không trả QALogCD cũng là lỗi (không được coi là đã ghi)
+        UPDATE #QA_Log_Bulk
+        SET TurnNo = @TurnNo,
+            QALogCD = @OUT_QALogCD,
+            ErrCD = CASE
+                WHEN ISNULL(@OUT_ERR_CD, 0) <> 0 THEN @OUT_ERR_CD
+                WHEN @OUT_QALogCD IS NULL THEN -1
+                ELSE 0
+            END,
+            ErrMsg = CASE
+                WHEN ISNULL(@OUT_ERR_CD, 0) = 0 AND @OUT_QALogCD IS NULL THEN N'No QALogCD returned from stored procedure'
+                ELSE @OUT_ERR_MSG
+            END
+        WHERE RowNo = @RowNo;
+
+        SET @RowNo = @RowNo + 1;
+    END
+
+    {session_summary_sql}
+
+    SELECT RowNo, QALogCD, TurnNo, ErrCD, ErrMsg
+    FROM #QA_Log_Bulk
+    ORDER BY RowNo;
+
+    DROP TABLE #QA_Log_Bulk;
+""".replace("{session_summary_sql}", SESSION_ON_BULK_REGISTER_SQL)
+
 
 class ChatDBService:
     """Service layer cho chat database operations sử dụng Stored Procedures"""
@@ -11,7 +163,7 @@ class ChatDBService:
     @staticmethod
     def register_qa_log(
         session_id: str,
-        turn_no: int,
+        turn_no: Optional[int],
         user_cd: int,  # IDENTITY - bigint từ M_User
         question_text: str,
         answer_text: str
@@ -21,79 +173,180 @@ class ChatDBService:
         
         Args:
             session_id: UUID của session chat (varchar(36))
-            turn_no: Số thứ tự lượt chat trong session (int)
+            turn_no: TurnNo đề xuất (None = để DB cấp); DB cấp lại nếu đã bị dùng
             user_cd: UserCD từ M_User (IDENTITY bigint)
             question_text: Câu hỏi của user (nvarchar(max))
             answer_text: Câu trả lời của AI (nvarchar(max))
             
         Returns:
-            Dict chứa qa_log_cd (IDENTITY bigint) và error info
+            Dict chứa qa_log_cd (IDENTITY bigint), turn_no thực tế và error info
         """
-        conn = None
         try:
-            conn = get_conn()
-            cursor = conn.cursor()
+            with db_connection() as conn:
+                cursor = conn.cursor()
             
-            # Execute stored procedure với OUTPUT parameters
-            result = cursor.execute("""
-                DECLARE @OUT_QALogCD BIGINT;
-                DECLARE @OUT_ERR_CD INT;
-                DECLARE @OUT_ERR_MSG NVARCHAR(MAX);
-                
-                EXEC [dbo].[Register_QA_Log]
-                    @IN_SessionId = ?,
-                    @IN_TurnNo = ?,
-                    @IN_UserCD = ?,
-                    @IN_QuestionText = ?,
-                    @IN_AnswerText = ?,
-                    @OUT_QALogCD = @OUT_QALogCD OUTPUT,
-                    @OUT_ERR_CD = @OUT_ERR_CD OUTPUT,
-                    @OUT_ERR_MSG = @OUT_ERR_MSG OUTPUT;
-                
-                SELECT @OUT_QALogCD AS QALogCD, @OUT_ERR_CD AS ErrCD, @OUT_ERR_MSG AS ErrMsg;
-            """, (session_id, turn_no, user_cd, question_text, answer_text))
-            
-            row = result.fetchone()
-            conn.commit()
+                # Execute stored procedure với OUTPUT parameters
+                result = cursor.execute(REGISTER_QA_LOG_SQL, (session_id, turn_no, user_cd, question_text, answer_text))
             
-            if row:
-                qa_log_cd = row.QALogCD if row.QALogCD is not None else None
-                err_cd = row.ErrCD if row.ErrCD is not None else 0
-                err_msg = row.ErrMsg
-                
-                if err_cd and err_cd != 0:
+                row = result.fetchone()
+                # Thành công chỉ khi SP trả QALogCD (cùng quy tắc với bulk)
+                ok = row is not None and not row.ErrCD and row.QALogCD is not None
+                if ok:
+                    # Cập nhật T_QA_Session trong cùng transaction
+                    cursor.execute(SESSION_ON_REGISTER_SQL, (session_id, user_cd, row.TurnNo, question_text))
+                conn.commit()
+
+                if not ok:
+                    err_cd = row.ErrCD if row and row.ErrCD else -1
+                    err_msg = (row.ErrMsg if row else None) or "No result returned from stored procedure"
                     logger.error(f"Register_QA_Log error: {err_cd} - {err_msg}")
                     return {
                         "success": False,
                         "error_code": err_cd,
                         "error_message": err_msg
                     }
-                
-                logger.info(f"Registered QA log: QALogCD={qa_log_cd}, Session={session_id}, Turn={turn_no}, UserCD={user_cd}")
-                
+
+                db_router.mark_write(conversation_key(session_id), user_key(user_cd))
+                logger.info(f"Registered QA log: QALogCD={row.QALogCD}, Session={session_id}, Turn={row.TurnNo}, UserCD={user_cd}")
+
                 return {
                     "success": True,
-                    "qa_log_cd": qa_log_cd, 
+                    "qa_log_cd": row.QALogCD,
                     "session_id": session_id,
-                    "turn_no": turn_no
-                }
-            else:
-                return {
-                    "success": False,
-                    "error_message": "No result returned from stored procedure"
+                    "turn_no": row.TurnNo
                 }
-                
+
         except Exception as e:
             logger.error(f"Failed to register QA log: {str(e)}")
-            if conn:
-                conn.rollback()
             return {
                 "success": False,
                 "error_message": str(e)
             }
-        finally:
-            if conn:
-                conn.close()
+    
+    @staticmethod
+    def register_qa_log_batch(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Lưu nhiều Q&A log trên cùng một connection, commit một lần cho cả batch
+        
+        Args:
+            rows: List dict với keys session_id, turn_no (đề xuất, có thể None),
+                  user_cd, question_text, answer_text
+            
+        Returns:
+            List kết quả theo đúng thứ tự rows (cùng format với register_qa_log)
+            
+        Raises:
+            Exception khi lỗi connection / execute; batch đã được rollback
+            nên caller có thể retry toàn bộ batch
+        """
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            results = []
+        
+            for r in rows:
+                row = cursor.execute(REGISTER_QA_LOG_SQL, (
+                    r["session_id"], r["turn_no"], r["user_cd"],
+                    r["question_text"], r["answer_text"]
+                )).fetchone()
+            
+                # Thành công chỉ khi SP trả QALogCD (cùng quy tắc với bulk)
+                if row is None or row.ErrCD or row.QALogCD is None:
+                    err_cd = row.ErrCD if row and row.ErrCD else -1
+                    err_msg = (row.ErrMsg if row else None) or "No result returned from stored procedure"
+                    logger.error(f"Register_QA_Log error: {err_cd} - {err_msg}")
+                    results.append({
+                        "success": False,
+                        "error_code": err_cd,
+                        "error_message": err_msg
+                    })
+                else:
+                    cursor.execute(SESSION_ON_REGISTER_SQL, (
+                        r["session_id"], r["user_cd"], row.TurnNo, r["question_text"]
+                    ))
+                    results.append({
+                        "success": True,
+                        "qa_log_cd": row.QALogCD,
+                        "session_id": r["session_id"],
+                        "turn_no": row.TurnNo
+                    })
+        
+            conn.commit()
+            db_router.mark_write(*(
+                key for r, result in zip(rows, results) if result["success"]
+                for key in (conversation_key(r["session_id"]), user_key(r["user_cd"]))
+            ))
+            logger.info(f"Registered QA log batch: {len(rows)} rows")
+            return results
+    
+    @staticmethod
+    def register_qa_log_bulk(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Bulk ingestion: nhiều Q&A log trong một transaction, ít round trip
+
+        Rows được nạp vào temp table bằng một lệnh fast_executemany, sau đó
+        một batch phía server gọi Register_QA_Log cho từng dòng và cập nhật
+        T_QA_Session set-based. Dùng cho import / replay / flush batch lớn.
+        
+        Args:
+            rows: List dict với keys session_id, turn_no (đề xuất, có thể None),
+                  user_cd, question_text, answer_text
+            
+        Returns:
+            List kết quả theo đúng thứ tự rows (cùng format với register_qa_log)
+            
+        Raises:
+            Exception khi lỗi connection / execute; cả batch đã được rollback
+        """
+        if not rows:
+            return []
+
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(BULK_CREATE_SQL)
+
+            cursor.fast_executemany = True
+            cursor.setinputsizes(BULK_INSERT_SIZES)
+            cursor.executemany(BULK_INSERT_SQL, [
+                (i, r["session_id"], r.get("turn_no"), r["user_cd"], r["question_text"], r["answer_text"])
+                for i, r in enumerate(rows, 1)
+            ])
+            cursor.fast_executemany = False
+
+            cursor.execute(BULK_REGISTER_SQL)
+            out = cursor.fetchall()
+            if len(out) != len(rows) or any(row.RowNo != i for i, row in enumerate(out, 1)):
+                raise RuntimeError(f"Bulk register returned {len(out)} results for {len(rows)} rows")
+            conn.commit()
+
+        def _ok(row) -> bool:
+            return row.ErrCD == 0 and row.QALogCD is not None
+
+        db_router.mark_write(*(
+            key for r, row in zip(rows, out) if _ok(row)
+            for key in (conversation_key(r["session_id"]), user_key(r["user_cd"]))
+        ))
+
+        results = []
+        for r, row in zip(rows, out):
+            if not _ok(row):
+                err_cd = row.ErrCD if row.ErrCD else -1
+                err_msg = row.ErrMsg or "No result returned from stored procedure"
+                logger.error(f"Register_QA_Log error: {err_cd} - {err_msg}")
+                results.append({
+                    "success": False,
+                    "error_code": err_cd,
+                    "error_message": err_msg
+                })
+            else:
+                results.append({
+                    "success": True,
+                    "qa_log_cd": row.QALogCD,
+                    "session_id": r["session_id"],
+                    "turn_no": row.TurnNo
+                })
+
+        logger.info(f"Registered QA log bulk: {len(rows)} rows")
+        return results
     
     @staticmethod
     def mark_resolved_qa(qa_log_cd: int) -> Dict[str, Any]:
@@ -107,164 +360,503 @@ class ChatDBService:
         Returns:
             Dict chứa success status và error info
         """
-        conn = None
         try:
-            conn = get_conn()
-            cursor = conn.cursor()
+            with db_connection() as conn:
+                cursor = conn.cursor()
             
-            result = cursor.execute("""
-                DECLARE @OUT_ERR_CD INT;
-                DECLARE @OUT_ERR_MSG NVARCHAR(MAX);
+                result = cursor.execute("""
+                    DECLARE @OUT_ERR_CD INT;
+                    DECLARE @OUT_ERR_MSG NVARCHAR(MAX);
                 
-                EXEC [dbo].[Mark_Resolved_QA]
-                    @IN_QALogCD = ?,
-                    @OUT_ERR_CD = @OUT_ERR_CD OUTPUT,
-                    @OUT_ERR_MSG = @OUT_ERR_MSG OUTPUT;
+                    EXEC [dbo].[Mark_Resolved_QA]
+                        @IN_QALogCD = ?,
+                        @OUT_ERR_CD = @OUT_ERR_CD OUTPUT,
+                        @OUT_ERR_MSG = @OUT_ERR_MSG OUTPUT;
                 
-                SELECT @OUT_ERR_CD AS ErrCD, @OUT_ERR_MSG AS ErrMsg;
-            """, (qa_log_cd,))
+                    SELECT @OUT_ERR_CD AS ErrCD, @OUT_ERR_MSG AS ErrMsg;
+                """, (qa_log_cd,))
             
-            row = result.fetchone()
-            conn.commit()
+                row = result.fetchone()
+                session = None
+                if row and not row.ErrCD:
+                    session = cursor.execute(SESSION_ON_RESOLVED_SQL, (qa_log_cd,)).fetchone()
+                conn.commit()
+                if session:
+                    db_router.mark_write(conversation_key(session.SessionId), user_key(session.UserCD))
             
-            if row:
-                err_cd = row.ErrCD if row.ErrCD is not None else 0
-                err_msg = row.ErrMsg
+                if row:
+                    err_cd = row.ErrCD if row.ErrCD is not None else 0
+                    err_msg = row.ErrMsg
+                
+                    if err_cd and err_cd != 0:
+                        logger.error(f"Mark_Resolved_QA error: {err_cd} - {err_msg}")
+                        return {
+                            "success": False,
+                            "error_code": err_cd,
+                            "error_message": err_msg
+                        }
                 
-                if err_cd and err_cd != 0:
-                    logger.error(f"Mark_Resolved_QA error: {err_cd} - {err_msg}")
+                    logger.info(f"Marked QA as resolved: QALogCD={qa_log_cd}")
+                
+                    return {
+                        "success": True,
+                        "qa_log_cd": qa_log_cd
+                    }
+                else:
                     return {
                         "success": False,
-                        "error_code": err_cd,
-                        "error_message": err_msg
+                        "error_message": "No result returned from stored procedure"
                     }
                 
-                logger.info(f"Marked QA as resolved: QALogCD={qa_log_cd}")
-                
-                return {
-                    "success": True,
-                    "qa_log_cd": qa_log_cd
-                }
-            else:
-                return {
-                    "success": False,
-                    "error_message": "No result returned from stored procedure"
-                }
-                
         except Exception as e:
             logger.error(f"Failed to mark QA as resolved: {str(e)}")
-            if conn:
-                conn.rollback()
             return {
                 "success": False,
                 "error_message": str(e)
             }
-        finally:
-            if conn:
-                conn.close()
     
     @staticmethod
-    def get_session_logs(session_id: str) -> List[Dict[str, Any]]:
+    def get_session_logs(session_id: str, user_cd: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Lấy toàn bộ chat logs của một session
         
         Args:
             session_id: UUID của session (varchar(36))
+            user_cd: Chỉ lấy log của user này (None = không lọc)
             
         Returns:
             List of QA logs
+
+        Raises:
+            Lỗi DB được raise lại (không trả [] - caller sẽ cache / ETag kết quả rỗng)
         """
-        conn = None
         try:
-            conn = get_conn()
-            cursor = conn.cursor()
+            with db_connection(READ, conversation_key(session_id)) as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT 
-                    QALogCD,        -- IDENTITY bigint
-                    SessionId,      -- varchar(36)
-                    TurnNo,         -- int
-                    UserCD,         -- bigint
-                    QuestionText,   -- nvarchar(max)
-                    AnswerText,     -- nvarchar(max)
-                    ResolvedTurnNo, -- int (nullable)
-                    RegisteredAt    -- datetime
-                FROM T_QA_Log
-                WHERE SessionId = ?
-                ORDER BY TurnNo ASC
-            """, (session_id,))
+                cursor.execute("""
+                    SELECT 
+                        QALogCD,        -- IDENTITY bigint
+                        SessionId,      -- varchar(36)
+                        TurnNo,         -- int
+                        UserCD,         -- bigint
+                        QuestionText,   -- nvarchar(max)
+                        AnswerText,     -- nvarchar(max)
+                        ResolvedTurnNo, -- int (nullable)
+                        RegisteredAt    -- datetime
+                    FROM T_QA_Log
+                    WHERE SessionId = ? AND (? IS NULL OR UserCD = ?)
+                    ORDER BY TurnNo ASC
+                """, (session_id, user_cd, user_cd))
             
-            columns = [col[0] for col in cursor.description]
-            rows = cursor.fetchall()
+                columns = [col[0] for col in cursor.description]
+                rows = cursor.fetchall()
             
-            logs = []
-            for row in rows:
-                log = dict(zip(columns, row))
-                logs.append(log)
+                logs = []
+                for row in rows:
+                    log = dict(zip(columns, row))
+                    logs.append(log)
             
-            return logs
+                return logs
             
         except Exception as e:
             logger.error(f"Failed to get session logs: {str(e)}")
-            return []
-        finally:
-            if conn:
-                conn.close()
+            raise
     
     @staticmethod
-    def get_user_sessions(user_cd: int, limit: int = 50) -> List[Dict[str, Any]]:
+    def iter_session_logs(
+        session_id: str,
+        user_cd: int,
+        summary: bool = False,
+        batch_size: int = HISTORY_FETCH_BATCH_SIZE,
+    ) -> Iterator[List[Dict[str, Any]]]:
         """
-        Lấy danh sách sessions của user (grouped by SessionId)
-        
+        Đọc logs của session theo từng chunk (fetchmany), TurnNo tăng dần
+
+        Generator giữ connection tới khi đọc xong; dùng qua db_executor.stream
+        để không materialize cả session trong memory.
+
         Args:
-            user_cd: UserCD từ M_User (IDENTITY bigint)
-            limit: Số lượng sessions tối đa
-            
+            session_id: UUID của session (varchar(36))
+            user_cd: Chỉ đọc log của user này (session của user khác -> không có dòng nào)
+            summary: True = projection nhẹ (QALogCD, TurnNo, QuestionPreview,
+                     RegisteredAt, ResolvedTurnNo), không đọc AnswerText
+            batch_size: Số dòng mỗi fetchmany
+
+        Yields:
+            List of QA logs (tối đa batch_size dòng)
+        """
+        if summary:
+            sql = """
+                SELECT
+                    QALogCD,
+                    TurnNo,
+                    LEFT(QuestionText, ?) AS QuestionPreview,
+                    RegisteredAt,
+                    ResolvedTurnNo
+                FROM T_QA_Log
+                WHERE SessionId = ? AND UserCD = ?
+                ORDER BY TurnNo ASC
+            """
+            params = (HISTORY_PREVIEW_CHARS, session_id, user_cd)
+        else:
+            sql = """
+                SELECT
+                    QALogCD,
+                    TurnNo,
+                    QuestionText,
+                    AnswerText,
+                    RegisteredAt,
+                    ResolvedTurnNo
+                FROM T_QA_Log
+                WHERE SessionId = ? AND UserCD = ?
+                ORDER BY TurnNo ASC
+            """
+            params = (session_id, user_cd)
+
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            columns = [col[0] for col in cursor.description]
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+
+    @staticmethod
+    def iter_user_logs_since(
+        user_cd: int,
+        after_qa_log_cd: int = 0,
+        batch_size: int = SEARCH_INDEX_FETCH_BATCH_SIZE,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Đọc các Q&A log của user có QALogCD > after_qa_log_cd (QALogCD tăng dần)
+
+        Dùng để build / cập nhật incremental search index (xem search_index).
+
+        Yields:
+            List of QA logs (tối đa batch_size dòng)
+        """
+        with db_connection(READ, user_key(user_cd)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT
+                    QALogCD,
+                    SessionId,
+                    TurnNo,
+                    QuestionText,
+                    AnswerText,
+                    RegisteredAt
+                FROM T_QA_Log
+                WHERE UserCD = ? AND QALogCD > ?
+                ORDER BY QALogCD ASC
+            """, (user_cd, after_qa_log_cd))
+            columns = [col[0] for col in cursor.description]
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+
+    @staticmethod
+    def get_logs_by_ids(user_cd: int, qa_log_cds: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Lấy các Q&A log (của user) theo QALogCD - dựng snippet cho kết quả search
+
         Returns:
-            List of session summaries
+            Dict QALogCD -> QA log (bỏ qua id không tồn tại / không thuộc user)
         """
-        conn = None
-        try:
-            conn = get_conn()
+        if not qa_log_cds:
+            return {}
+        placeholders = ",".join("?" * len(qa_log_cds))
+        with db_connection(READ, user_key(user_cd)) as conn:
             cursor = conn.cursor()
-            
+            cursor.execute(f"""
+                SELECT
+                    QALogCD,
+                    SessionId,
+                    TurnNo,
+                    QuestionText,
+                    AnswerText,
+                    RegisteredAt
+                FROM T_QA_Log
+                WHERE UserCD = ? AND QALogCD IN ({placeholders})
+            """, (user_cd, *qa_log_cds))
+            columns = [col[0] for col in cursor.description]
+            return {row.QALogCD: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    @staticmethod
+    def get_turn(session_id: str, turn_no: int, user_cd: int) -> Optional[Dict[str, Any]]:
+        """
+        Lấy một turn (kèm AnswerText) - lazy load cho history dạng summary
+
+        Returns:
+            QA log hoặc None nếu không có / không thuộc user_cd
+        """
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            cursor = conn.cursor()
+
             cursor.execute("""
+                SELECT
+                    QALogCD,
+                    TurnNo,
+                    QuestionText,
+                    AnswerText,
+                    RegisteredAt,
+                    ResolvedTurnNo
+                FROM T_QA_Log
+                WHERE SessionId = ? AND TurnNo = ? AND UserCD = ?
+            """, (session_id, turn_no, user_cd))
+
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([col[0] for col in cursor.description], row))
+    
+    @staticmethod
+    def get_session_turns(
+        session_id: str,
+        limit: int,
+        before_turn: Optional[int] = None,
+        after_turn: Optional[int] = None,
+        user_cd: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Lấy một trang turns của session theo keyset TurnNo
+
+        Args:
+            session_id: UUID của session (varchar(36))
+            limit: Số turns tối đa
+            before_turn: Trang cũ hơn: TurnNo < before_turn, mới nhất trước
+                         (None + after_turn None = các turn mới nhất)
+            after_turn: Delta: TurnNo > after_turn, cũ nhất trước
+            user_cd: Chỉ lấy log của user này (None = không lọc)
+
+        Returns:
+            List of QA logs theo thứ tự đọc (xem before_turn / after_turn)
+        """
+        if after_turn is not None:
+            where, order, params = "AND TurnNo > ?", "ASC", (limit, session_id, after_turn)
+        elif before_turn is not None:
+            where, order, params = "AND TurnNo < ?", "DESC", (limit, session_id, before_turn)
+        else:
+            where, order, params = "", "DESC", (limit, session_id)
+        if user_cd is not None:
+            where += " AND UserCD = ?"
+            params += (user_cd,)
+
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
                 SELECT TOP (?)
+                    QALogCD,
                     SessionId,
-                    MIN(RegisteredAt) as FirstMessageAt,
-                    MAX(RegisteredAt) as LastMessageAt,
-                    COUNT(*) as MessageCount,
-                    MAX(TurnNo) as LastTurnNo,
-                    MAX(ResolvedTurnNo) as ResolvedTurnNo,
-                    (
-                        SELECT TOP 1 QuestionText 
-                        FROM T_QA_Log sub 
-                        WHERE sub.SessionId = T_QA_Log.SessionId 
-                        ORDER BY TurnNo ASC
-                    ) as FirstQuestion
+                    TurnNo,
+                    UserCD,
+                    QuestionText,
+                    AnswerText,
+                    ResolvedTurnNo,
+                    RegisteredAt
                 FROM T_QA_Log
-                WHERE UserCD = ?
-                GROUP BY SessionId
-                ORDER BY MAX(RegisteredAt) DESC
-            """, (limit, user_cd))
-            
+                WHERE SessionId = ? {where}
+                ORDER BY TurnNo {order}
+            """, params)
+
             columns = [col[0] for col in cursor.description]
-            rows = cursor.fetchall()
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_user_sessions(
+        user_cd: int,
+        limit: int = 50,
+        before: Optional[Tuple[datetime, str]] = None,
+        since: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Lấy danh sách sessions của user từ bảng summary T_QA_Session
+        
+        Args:
+            user_cd: UserCD từ M_User (IDENTITY bigint)
+            limit: Số lượng sessions tối đa
+            before: Keyset (LastMessageAt, SessionId) của session cuối trang trước
+            since: RowVer (SyncVersion) lần sync trước; chỉ trả session thay đổi sau đó
+            
+        Returns:
+            List of session summaries (kèm RowVer, SyncVersion)
+
+        Raises:
+            Lỗi DB được raise lại (không trả [] - caller sẽ cache / ETag kết quả rỗng)
+        """
+        try:
+            with db_connection(READ, user_key(user_cd)) as conn:
+                cursor = conn.cursor()
+
+                if since is not None:
+                    cursor.execute(USER_SESSIONS_SINCE_SQL, (limit, user_cd, since))
+                elif before is not None:
+                    cursor.execute(USER_SESSIONS_BEFORE_SQL, (limit, user_cd, before[0], before[1]))
+                else:
+                    cursor.execute(USER_SESSIONS_SQL, (limit, user_cd))
             
-            sessions = []
-            for row in rows:
-                session = dict(zip(columns, row))
-                sessions.append(session)
+                columns = [col[0] for col in cursor.description]
+                rows = cursor.fetchall()
             
-            return sessions
+                sessions = []
+                for row in rows:
+                    session = dict(zip(columns, row))
+                    sessions.append(session)
+            
+                return sessions
             
         except Exception as e:
             logger.error(f"Failed to get user sessions: {str(e)}")
-            return []
-        finally:
-            if conn:
-                conn.close()
+            raise
+    
+    @staticmethod
+    def get_user_sessions_version(user_cd: int) -> Optional[int]:
+        """
+        Version stamp danh sách session của user
+
+        None khi user chưa có dòng nào trong T_QA_Session (chưa backfill):
+        không có gì bảo đảm version đổi theo dữ liệu -> không dùng ETag / cache.
+        """
+        with db_connection(READ, user_key(user_cd)) as conn:
+            row = conn.cursor().execute(USER_SESSIONS_VERSION_SQL, (user_cd,)).fetchone()
+            return row.Version if row else None
+
+    @staticmethod
+    def get_session_version(session_id: str, user_cd: int) -> Optional[int]:
+        """
+        Version stamp của một session của user
+
+        None khi session chưa có trong T_QA_Session (chưa backfill) hoặc không
+        thuộc user: history đọc từ T_QA_Log thay đổi mà không bump RowVer ->
+        không dùng ETag / cache.
+        """
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            row = conn.cursor().execute(SESSION_VERSION_SQL, (session_id, user_cd)).fetchone()
+            return row.Version if row else None
+
+    @staticmethod
+    def has_session_logs(session_id: str, user_cd: int) -> bool:
+        """Session có log của user trong T_QA_Log (session chưa backfill vào T_QA_Session)"""
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            row = conn.cursor().execute(
+                "SELECT TOP 1 1 AS Found FROM T_QA_Log WHERE SessionId = ? AND UserCD = ?",
+                (session_id, user_cd),
+            ).fetchone()
+            return row is not None
+
+    @staticmethod
+    def get_session_resolved_turn(session_id: str) -> Optional[int]:
+        """ResolvedTurnNo hiện tại của session (None = chưa resolve)"""
+        with db_connection(READ, conversation_key(session_id)) as conn:
+            row = conn.cursor().execute(SESSION_RESOLVED_TURN_SQL, (session_id,)).fetchone()
+            return row.ResolvedTurnNo if row else None
+
+
+# Create singleton instance
+chat_db_service = ChatDBService()
+
+
+class AsyncChatDBService:
+    """
+    Async facade của ChatDBService cho async routes
+
+    Mỗi method chạy trên DB executor (app.db.executor) nên không block event
+    loop; `timeout` = query timeout (None = DB_QUERY_TIMEOUT), bị cancel khi
+    request bị hủy.
+    """
+
+    async def register_qa_log(
+        self,
+        session_id: str,
+        turn_no: Optional[int],
+        user_cd: int,
+        question_text: str,
+        answer_text: str,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        return await db_executor.run(
+            chat_db_service.register_qa_log,
+            session_id, turn_no, user_cd, question_text, answer_text,
+            timeout=timeout,
+        )
+
+    async def register_qa_log_batch(
+        self, rows: List[Dict[str, Any]], timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        return await db_executor.run(chat_db_service.register_qa_log_batch, rows, timeout=timeout)
+
+    async def register_qa_log_bulk(
+        self, rows: List[Dict[str, Any]], timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        return await db_executor.run(chat_db_service.register_qa_log_bulk, rows, timeout=timeout)
+
+    async def mark_resolved_qa(self, qa_log_cd: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await db_executor.run(chat_db_service.mark_resolved_qa, qa_log_cd, timeout=timeout)
+
+    async def get_session_logs(
+        self, session_id: str, user_cd: Optional[int] = None, timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        return await db_executor.run(chat_db_service.get_session_logs, session_id, user_cd, timeout=timeout)
+
+    async def stream_session_logs(
+        self, session_id: str, user_cd: int, summary: bool = False, timeout: Optional[float] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        async for chunk in db_executor.stream(
+            chat_db_service.iter_session_logs, session_id, user_cd, summary, timeout=timeout
+        ):
+            yield chunk
+
+    async def get_turn(
+        self, session_id: str, turn_no: int, user_cd: int, timeout: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        return await db_executor.run(chat_db_service.get_turn, session_id, turn_no, user_cd, timeout=timeout)
+
+    async def get_user_sessions_version(self, user_cd: int, timeout: Optional[float] = None) -> Optional[int]:
+        return await db_executor.run(chat_db_service.get_user_sessions_version, user_cd, timeout=timeout)
+
+    async def get_session_version(
+        self, session_id: str, user_cd: int, timeout: Optional[float] = None
+    ) -> Optional[int]:
+        return await db_executor.run(chat_db_service.get_session_version, session_id, user_cd, timeout=timeout)
+
+    async def has_session_logs(self, session_id: str, user_cd: int, timeout: Optional[float] = None) -> bool:
+        return await db_executor.run(chat_db_service.has_session_logs, session_id, user_cd, timeout=timeout)
+
+    async def get_session_resolved_turn(self, session_id: str, timeout: Optional[float] = None) -> Optional[int]:
+        return await db_executor.run(chat_db_service.get_session_resolved_turn, session_id, timeout=timeout)
+
+    async def get_session_turns(
+        self,
+        session_id: str,
+        limit: int,
+        before_turn: Optional[int] = None,
+        after_turn: Optional[int] = None,
+        user_cd: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        return await db_executor.run(
+            chat_db_service.get_session_turns, session_id, limit, before_turn, after_turn, user_cd, timeout=timeout
+        )
+
+    async def get_user_sessions(
+        self,
+        user_cd: int,
+        limit: int = 50,
+        before: Optional[Tuple[datetime, str]] = None,
+        since: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        return await db_executor.run(
+            chat_db_service.get_user_sessions, user_cd, limit, before, since, timeout=timeout
+        )
 
 
 # Create singleton instance
-chat_db_service = ChatDBService()   
\ No newline at end of file
+async_chat_db_service = AsyncChatDBService()   
\ No newline at end of file
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List
+
+from app.config import CHAT_FLUSH_WINDOW_MS, CHAT_FLUSH_MAX_BYTES, CHAT_HEARTBEAT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_EVENT = {"type": "heartbeat"}
+_END = object()
+
+
+class TokenCoalescer:
+    """
+    Gộp các text token từ upstream thành frame lớn hơn trước khi gửi cho client
+
+    - Text token được gom trong `window_ms` (tính từ token đầu tiên của batch)
+      hoặc tới khi đủ `max_bytes` (UTF-8) thì flush.
+    - Event khác text (metadata, error) flush batch hiện tại rồi đi qua ngay.
+    - Khi upstream im lặng quá `heartbeat_seconds` thì phát HEARTBEAT_EVENT để
+      proxy / browser không đóng connection.
+    """
+
+    def __init__(
+        self,
+        window_ms: int = CHAT_FLUSH_WINDOW_MS,
+        max_bytes: int = CHAT_FLUSH_MAX_BYTES,
+        heartbeat_seconds: float = CHAT_HEARTBEAT_SECONDS,
+    ):
+        self.window = max(window_ms, 0) / 1000
+        self.max_bytes = max_bytes
+        self.heartbeat_seconds = heartbeat_seconds
+
+    async def coalesce(
+        self, events: AsyncIterator[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Wrap một async iterator event và yield các event đã gộp"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def _pump():
+            try:
+                async for event in events:
+                    await queue.put(event)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                await queue.put(_END)
+
+        producer = asyncio.create_task(_pump())
+
+        parts: List[str] = []
+        size = 0
+        deadline = None
+
+        def _flush() -> Dict[str, Any]:
+            nonlocal parts, size, deadline
+            frame = {"type": "text", "data": "".join(parts)}
+            parts, size, deadline = [], 0, None
+            return frame
+
+        try:
+            while True:
+                if parts:
+                    timeout = max(deadline - loop.time(), 0)
+                else:
+                    timeout = self.heartbeat_seconds if self.heartbeat_seconds > 0 else None
+
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield _flush() if parts else HEARTBEAT_EVENT
+                    continue
+
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    if parts:
+                        yield _flush()
+                    raise item
+
+                if item.get("type") == "text":
+                    token = item.get("data", "")
+                    if not token:
+                        continue
+                    if not parts:
+                        deadline = loop.time() + self.window
+                    parts.append(token)
+                    size += len(token.encode("utf-8"))
+                    if size >= self.max_bytes or self.window == 0:
+                        yield _flush()
+                    continue
+
+                if parts:
+                    yield _flush()
+                yield item
+
+            if parts:
+                yield _flush()
+        finally:
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
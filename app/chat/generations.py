@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app import codec
+from app.chat.answer_cache import answer_cache
+from app.chat.qa_log_writer import qa_log_writer
+from app.chat.replay import ReplayBuffer
+from app.chat.single_flight import Subscription
+from app.config import (
+    CHAT_PARTIAL_PERSIST_ON_STOP,
+    CHAT_PARTIAL_PERSIST_ON_DISCONNECT,
+    CHAT_PARTIAL_PERSIST_ON_ERROR,
+    CHAT_REPLAY_MAX_EVENTS,
+    CHAT_REPLAY_TTL_SECONDS,
+    CHAT_RESUME_GRACE_SECONDS,
+    CHAT_HEARTBEAT_SECONDS,
+    QA_LOG_ACK_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+STOP_REASON_USER = "stopped"
+STOP_REASON_DISCONNECT = "disconnected"
+# Không phải stop: upstream lỗi sau khi đã có một phần câu trả lời
+STOP_REASON_ERROR = "error"
+
+# Heartbeat = dòng trống, client bỏ qua và không tính vào offset
+HEARTBEAT_FRAME = b"\n"
+
+_PARTIAL_RULES = {
+    STOP_REASON_USER: CHAT_PARTIAL_PERSIST_ON_STOP,
+    STOP_REASON_DISCONNECT: CHAT_PARTIAL_PERSIST_ON_DISCONNECT,
+    STOP_REASON_ERROR: CHAT_PARTIAL_PERSIST_ON_ERROR,
+}
+
+
+def should_persist_partial(reason: str, answer: str) -> bool:
+    """
+    Quyết định có lưu câu trả lời dở dang vào T_QA_Log hay không
+
+    Rule (theo reason): "never", "always" hoặc "min_chars:<N>"
+    """
+    if not answer:
+        return False
+
+    rule = (_PARTIAL_RULES.get(reason) or "never").strip().lower()
+    if rule == "always":
+        return True
+    if rule.startswith("min_chars:"):
+        try:
+            return len(answer) >= int(rule.split(":", 1)[1])
+        except ValueError:
+            logger.warning(f"Invalid partial persist rule: {rule}")
+    return False
+
+
+def encode_frame(event: Dict[str, Any]) -> bytes:
+    """
+    Encode event thành đúng một dòng NDJSON gửi browser
+
+    Metadata được gửi trực tiếp {"type": "metadata", "data": ...} thay vì
+    double-encode trong dòng [[META]] như trước; error cũng vậy
+    ({"type": "error", "data": {"message": ...}}).
+    """
+    t = event.get("type")
+    if t in ("text", "metadata"):
+        return codec.ndjson_line(event)
+    if t == "error":
+        msg = event["data"].get("message", "Stream error")
+        return codec.ndjson_line({"type": "error", "data": {"message": msg}})
+    if t == "qa_log":
+        return f"[[QA_LOG_CD]]{event['data']}\n\n".encode("utf-8")
+    return HEARTBEAT_FRAME
+
+
+class ChatTurn:
+    """
+    Một lượt hỏi-đáp của conversation, độc lập với HTTP connection
+
+    Task riêng đọc event (từ upstream subscription hoặc answer cache), ghi vào
+    replay buffer có offset và lưu QA log khi kết thúc. Connection ban đầu,
+    connection resume và tab observer đều chỉ là reader của buffer này, nên
+    rớt mạng giữa chừng không làm mất câu trả lời.
+
+    Buffer chứa frame đã encode (bytes) của text / metadata / error, cộng thêm
+    frame qa_log sau khi ghi DB; mỗi event chỉ encode một lần dù có bao nhiêu
+    reader.
+    """
+
+    def __init__(
+        self,
+        conversation_id: str,
+        user_cd,
+        question: str,
+        cache_key: str,
+        subscription: Optional[Subscription] = None,
+        cached_events: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.conversation_id = conversation_id
+        self.user_cd = user_cd
+        self.question = question
+        self.cache_key = cache_key
+        self.subscription = subscription
+        self.cached_events = cached_events
+
+        self.buffer = ReplayBuffer(max_events=CHAT_REPLAY_MAX_EVENTS)
+        self.full_answer = ""
+        self.stop_reason: Optional[str] = None
+
+        self._readers = 0
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def done(self) -> bool:
+        return self.buffer.done
+
+    # ------------------------------------------------------------------ #
+    # Producer
+    # ------------------------------------------------------------------ #
+
+    async def _source(self) -> AsyncIterator[Dict[str, Any]]:
+        if self.cached_events is not None:
+            for event in self.cached_events:
+                yield event
+        else:
+            async for event in self.subscription.events():
+                yield event
+
+    async def _run(self):
+        answer_events = []
+        upstream_error = False
+        try:
+            async for event in self._source():
+                t = event.get("type")
+                if t == "text":
+                    self.full_answer += event["data"]
+                    answer_events.append(event)
+                elif t == "metadata":
+                    answer_events.append(event)
+                elif t == "error":
+                    upstream_error = True
+                else:
+                    continue
+                self.buffer.append(encode_frame(event))
+                if upstream_error:
+                    break
+        except Exception as e:
+            # Lỗi giữa stream: đóng bằng frame error như lỗi upstream, không cắt ngang response
+            logger.error(f"Generation failed: session={self.conversation_id}, {str(e)}")
+            self.buffer.append(encode_frame({"type": "error", "data": {"message": "Stream error"}}))
+            upstream_error = True
+        finally:
+            if self.subscription:
+                self.subscription.close()
+
+        if self.stop_reason:
+            logger.info(
+                f"Generation {self.stop_reason}: session={self.conversation_id}, chars={len(self.full_answer)}"
+            )
+            persist = should_persist_partial(self.stop_reason, self.full_answer)
+        elif upstream_error:
+            persist = should_persist_partial(STOP_REASON_ERROR, self.full_answer)
+        else:
+            persist = bool(self.full_answer)
+            if self.cached_events is None and self.full_answer:
+                answer_cache.put(self.cache_key, answer_events)
+
+        if persist:
+            await self._persist()
+
+        self.buffer.close()
+        turn_registry.schedule_eviction(self)
+
+    async def _persist(self):
+        try:
+            # Ghi DB qua write-behind queue, không block event loop
+            pending = qa_log_writer.submit(
+                session_id=self.conversation_id,
+                user_cd=self.user_cd,
+                question_text=self.question,
+                answer_text=self.full_answer,
+            )
+
+            # Chờ ack ngắn để trả QA_LOG_CD cho nút "解決済み";
+            # quá timeout thì record vẫn được ghi ở background
+            result = await asyncio.wait_for(asyncio.shield(pending), QA_LOG_ACK_TIMEOUT)
+
+            if result["success"]:
+                qa_log_cd = result.get("qa_log_cd")
+                logger.info(
+                    f"Saved chat to DB: session={self.conversation_id}, turn={result.get('turn_no')}, qa_log_cd={qa_log_cd}"
+                )
+                self.buffer.append(encode_frame({"type": "qa_log", "data": qa_log_cd}))
+            else:
+                logger.error(f"Failed to save chat to DB: {result.get('error_message')}")
+
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"QA log not acknowledged within {QA_LOG_ACK_TIMEOUT}s: session={self.conversation_id}"
+            )
+        except Exception as e:
+            logger.error(f"Error saving chat to DB: {str(e)}")
+
+    def stop(self, reason: str):
+        if self.done or self.stop_reason:
+            return
+        self.stop_reason = reason
+        if self.subscription:
+            self.subscription.stop(reason)
+
+    # ------------------------------------------------------------------ #
+    # Readers (HTTP connections)
+    # ------------------------------------------------------------------ #
+
+    def read(self, offset: int = 0, stop: Optional[asyncio.Event] = None) -> AsyncIterator[bytes]:
+        return self.buffer.read(
+            offset, heartbeat_seconds=CHAT_HEARTBEAT_SECONDS, stop=stop, heartbeat=HEARTBEAT_FRAME
+        )
+
+    def attach_reader(self):
+        self._readers += 1
+        if self._grace_handle:
+            self._grace_handle.cancel()
+            self._grace_handle = None
+
+    def detach_reader(self):
+        self._readers -= 1
+        if self._readers > 0 or self.done:
+            return
+        # Chờ client reconnect trong grace period trước khi hủy upstream
+        loop = asyncio.get_running_loop()
+        self._grace_handle = loop.call_later(CHAT_RESUME_GRACE_SECONDS, self._grace_expired)
+
+    def _grace_expired(self):
+        self._grace_handle = None
+        if self._readers <= 0 and not self.done:
+            logger.info(f"No reader reconnected: session={self.conversation_id}, turn={self.turn_id}")
+            self.stop(STOP_REASON_DISCONNECT)
+
+
+class TurnRegistry:
+    """ChatTurn đang chạy / vừa xong theo conversation_id (stop, resume, observe)"""
+
+    def __init__(self, ttl_seconds: float = CHAT_REPLAY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._turns: Dict[str, List[ChatTurn]] = {}
+
+    def register(self, turn: ChatTurn):
+        self._turns.setdefault(turn.conversation_id, []).append(turn)
+
+    def get(self, conversation_id: str, turn_id: Optional[str] = None) -> Optional[ChatTurn]:
+        """Trả turn theo turn_id, hoặc turn mới nhất của conversation"""
+        turns = self._turns.get(conversation_id, [])
+        if turn_id is None:
+            return turns[-1] if turns else None
+        for turn in turns:
+            if turn.turn_id == turn_id:
+                return turn
+        return None
+
+    def stop(self, conversation_id: str, user_cd) -> int:
+        """
+        Dừng mọi turn đang chạy của conversation thuộc user
+
+        Returns:
+            Số turn đã dừng
+        """
+        stopped = 0
+        for turn in list(self._turns.get(conversation_id, [])):
+            if turn.user_cd != user_cd or turn.done:
+                continue
+            turn.stop(STOP_REASON_USER)
+            stopped += 1
+
+        logger.info(f"Stop generation: conversation={conversation_id}, stopped={stopped}")
+        return stopped
+
+    def schedule_eviction(self, turn: ChatTurn):
+        asyncio.get_running_loop().call_later(self.ttl_seconds, self._evict, turn)
+
+    def _evict(self, turn: ChatTurn):
+        turns = self._turns.get(turn.conversation_id, [])
+        if turn in turns:
+            turns.remove(turn)
+        if not turns:
+            self._turns.pop(turn.conversation_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        turns = [t for ts in self._turns.values() for t in ts]
+        return {
+            "turns": len(turns),
+            "active": sum(1 for t in turns if not t.done),
+        }
+
+
+# Create singleton instance
+turn_registry = TurnRegistry()
@@ -0,0 +1,183 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from app import codec
+from app.chat.archive import qa_log_archive
+from app.chat.chat_db_service import async_chat_db_service
+from app.chat.qa_log_writer import qa_log_writer
+from app.config import (
+    CHAT_HISTORY_MAX_TURNS,
+    CHAT_HISTORY_BUDGET_CHARS,
+    CHAT_HISTORY_FULL_TURNS,
+    CHAT_HISTORY_COMPACT_CHARS,
+    CHAT_HISTORY_CACHE_SIZE,
+    CHAT_HISTORY_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _answer_text(answer: str) -> str:
+    """AnswerText có thể là JSON {"text", "pdf_details"} (process_chat_message)"""
+    if answer and answer.startswith("{"):
+        try:
+            parsed = codec.loads(answer)
+            if isinstance(parsed, dict) and "text" in parsed:
+                return parsed["text"]
+        except ValueError:
+            pass
+    return answer or ""
+
+
+def _compact(text: str, limit: int) -> str:
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return text[:limit] + "…"
+
+
+def _fit(text: str, limit: int) -> str:
+    """Cắt text để len(kết quả) <= limit (kể cả dấu …)"""
+    if len(text) <= limit:
+        return text
+    if limit <= 0:
+        return ""
+    return text[:limit - 1] + "…"
+
+
+class ConversationHistory:
+    """
+    Dựng chat_history gửi upstream từ T_QA_Log thay vì nhận từ browser
+
+    Turn đã commit được cache (LRU + TTL) theo conversation, kèm version của
+    session (T_QA_Session.RowVer): mỗi lần build đọc version trước, khác version
+    thì đọc lại T_QA_Log - turn do worker / process khác ghi không bị bỏ sót.
+    Turn vừa xong nhưng write-behind chưa commit được lấy từ qa_log_writer.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = CHAT_HISTORY_MAX_TURNS,
+        budget_chars: int = CHAT_HISTORY_BUDGET_CHARS,
+        full_turns: int = CHAT_HISTORY_FULL_TURNS,
+        compact_chars: int = CHAT_HISTORY_COMPACT_CHARS,
+        cache_size: int = CHAT_HISTORY_CACHE_SIZE,
+        ttl_seconds: float = CHAT_HISTORY_CACHE_TTL_SECONDS,
+    ):
+        self.max_turns = max_turns
+        self.budget_chars = budget_chars
+        self.full_turns = full_turns
+        self.compact_chars = compact_chars
+        self.cache_size = cache_size
+        self.ttl_seconds = ttl_seconds
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "loads": 0, "stale": 0, "pending_merged": 0}
+
+    async def _committed_turns(self, conversation_id: str, user_cd) -> List[Dict[str, Any]]:
+        version = await async_chat_db_service.get_session_version(conversation_id, user_cd)
+        entry = self._cache.get(conversation_id)
+        if entry and entry[0] > time.monotonic():
+            if version is not None and entry[1] == version:
+                self._cache.move_to_end(conversation_id)
+                self._stats["hits"] += 1
+                return entry[2]
+            self._stats["stale"] += 1
+
+        logs = await async_chat_db_service.get_session_logs(conversation_id)
+        # Conversation đã archive (một phần / toàn bộ) được tiếp tục
+        logs = await qa_log_archive.load_turns_async(
+            conversation_id, None, logs[0]["TurnNo"] if logs else None
+        ) + logs
+        turns = [
+            {
+                "qa_log_cd": log["QALogCD"],
+                "user_cd": log["UserCD"],
+                "question": log["QuestionText"] or "",
+                "answer": _answer_text(log["AnswerText"]),
+            }
+            for log in logs
+        ]
+        self._stats["loads"] += 1
+        if version is not None:
+            self._store(conversation_id, version, turns)
+        else:
+            # Chưa có dòng summary (chưa backfill) hoặc không thuộc user: không có gì để kiểm tra cache
+            self._cache.pop(conversation_id, None)
+        return turns
+
+    async def _turns(self, conversation_id: str, user_cd) -> List[Dict[str, Any]]:
+        # Lấy record pending TRƯỚC khi đọc DB: record commit trong lúc đọc
+        # vẫn có mặt ở một trong hai phía (lọc trùng theo QALogCD)
+        pending = qa_log_writer.pending_records(conversation_id)
+        turns = await self._committed_turns(conversation_id, user_cd)
+        if not pending:
+            return turns
+
+        committed = {t["qa_log_cd"] for t in turns}
+        merged = list(turns)
+        for record in pending:
+            if record.get("qa_log_cd") in committed:
+                continue
+            merged.append({
+                "qa_log_cd": record.get("qa_log_cd"),
+                "user_cd": record["user_cd"],
+                "question": record["question_text"] or "",
+                "answer": _answer_text(record["answer_text"]),
+            })
+            self._stats["pending_merged"] += 1
+        return merged
+
+    def _store(self, conversation_id: str, version, turns: List[Dict[str, Any]]):
+        self._cache[conversation_id] = (time.monotonic() + self.ttl_seconds, version, turns)
+        self._cache.move_to_end(conversation_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, conversation_id: str):
+        self._cache.pop(conversation_id, None)
+
+    async def build(self, conversation_id: str, user_cd) -> List[Dict[str, str]]:
+        """
+        Dựng chat_history (cũ -> mới) trong giới hạn số turn và số ký tự
+
+        - `full_turns` turn gần nhất giữ nguyên văn
+        - turn cũ hơn được compact (cắt answer còn `compact_chars`)
+        - dừng khi vượt `budget_chars`; turn mới nhất một mình đã vượt thì
+          bị cắt cho vừa budget
+
+        Raises:
+            Lỗi DB khi đọc turns (không cache, không gửi history rỗng lên upstream)
+        """
+        turns = await self._turns(conversation_id, user_cd)
+        if any(t["user_cd"] != user_cd for t in turns):
+            logger.warning(f"Conversation {conversation_id} does not belong to user_cd={user_cd}")
+            return []
+
+        history: List[Dict[str, str]] = []
+        used = 0
+        for i, turn in enumerate(reversed(turns[-self.max_turns:] if self.max_turns > 0 else [])):
+            question = turn["question"]
+            answer = turn["answer"]
+            if i >= self.full_turns:
+                answer = _compact(answer, self.compact_chars)
+            size = len(question) + len(answer)
+            if used + size > self.budget_chars:
+                if history:
+                    break
+                # Turn mới nhất: cắt question (nếu cần) rồi answer còn vừa budget
+                question = _fit(question, self.budget_chars)
+                answer = _fit(answer, self.budget_chars - len(question))
+                size = len(question) + len(answer)
+            history.append({"question": question, "answer": answer})
+            used += size
+
+        history.reverse()
+        return history
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "cached_conversations": len(self._cache)}
+
+
+# Create singleton instance
+conversation_history = ConversationHistory()
@@ -0,0 +1,45 @@
+"""
+Opaque cursor cho keyset pagination / delta sync của conversation APIs
+
+Cursor là base64url của JSON nhỏ (ví dụ {"t": "...", "id": "..."}); client
+chỉ cần gửi lại nguyên giá trị nhận được.
+"""
+
+import base64
+import binascii
+from typing import Any, Dict, Optional
+
+from app import codec
+
+
+class InvalidCursor(ValueError):
+    """Cursor không giải mã được hoặc sai format"""
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(codec.dumps(payload)).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str], *keys: str) -> Optional[Dict[str, Any]]:
+    """
+    Giải mã cursor; None / "" -> None
+
+    Raises:
+        InvalidCursor khi cursor hỏng hoặc thiếu một trong `keys`
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = codec.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(payload, dict) or any(k not in payload for k in keys):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return payload
+
+
+def clamp_limit(limit: Optional[int], default: int, maximum: int) -> int:
+    if limit is None:
+        return default
+    return max(1, min(int(limit), maximum))
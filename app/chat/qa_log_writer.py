@@ -0,0 +1,408 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.chat.chat_db_service import chat_db_service
+from app.chat.turn_allocator import turn_allocator
+from app.chat.search_index import search_index
+from app.db.executor import db_executor
+from app.config import (
+    QA_LOG_QUEUE_SIZE,
+    QA_LOG_BATCH_SIZE,
+    QA_LOG_FLUSH_INTERVAL_MS,
+    QA_LOG_RETRY_SECONDS,
+    QA_LOG_SPOOL_PATH,
+    QA_LOG_SPOOL_FSYNC,
+    QA_LOG_SPOOL_SYNC_INTERVAL_MS,
+    QA_LOG_BULK_MIN_ROWS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Entry đặc biệt trong buffer của SpoolFile: xóa nội dung file tại vị trí này
+_TRUNCATE = object()
+
+
+class SpoolFile:
+    """
+    Spool JSONL append-only, ghi trên thread riêng
+
+    append() / truncate() chỉ đưa entry vào buffer (không block event loop);
+    thread spool gom các entry trong cửa sổ `sync_interval_ms`, ghi theo đúng
+    thứ tự rồi flush + fsync MỘT lần cho cả nhóm (group commit). Entry vì vậy
+    bền vững trễ tối đa khoảng `sync_interval_ms` + thời gian fsync.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fsync: bool = QA_LOG_SPOOL_FSYNC,
+        sync_interval_ms: int = QA_LOG_SPOOL_SYNC_INTERVAL_MS,
+    ):
+        self.path = path
+        self.fsync = fsync
+        self.sync_interval = max(sync_interval_ms, 0) / 1000
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        self._buffer: List[Any] = []
+        self._cond = threading.Condition()
+        self._closing = False
+        self._stats = {"spool_entries": 0, "spool_syncs": 0, "spool_errors": 0}
+
+    def open(self):
+        """Mở file (ghi đè) và khởi động thread spool"""
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="qa-log-spool", daemon=True)
+        self._thread.start()
+
+    def append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._cond:
+            self._buffer.append(line)
+            self._cond.notify()
+
+    def truncate(self):
+        with self._cond:
+            self._buffer.append(_TRUNCATE)
+            self._cond.notify()
+
+    def close(self):
+        """Ghi + fsync nốt buffer rồi đóng file (blocking)"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._file = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                closing = self._closing
+            if self.sync_interval and not closing:
+                # Gom thêm entry đến trong cửa sổ sync_interval
+                time.sleep(self.sync_interval)
+            with self._cond:
+                entries, self._buffer = self._buffer, []
+            try:
+                self._write(entries)
+            except Exception as e:
+                self._stats["spool_errors"] += 1
+                logger.error(f"QA log spool write failed ({len(entries)} entries): {str(e)}")
+
+    def _write(self, entries: List[Any]):
+        # Chỉ phần sau lần truncate cuối cùng còn ý nghĩa
+        last = max((i for i, e in enumerate(entries) if e is _TRUNCATE), default=None)
+        if last is not None:
+            self._file.seek(0)
+            self._file.truncate()
+            entries = entries[last + 1:]
+        if entries:
+            self._file.write("".join(entries))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._stats["spool_entries"] += len(entries)
+        self._stats["spool_syncs"] += 1
+
+
+class QALogWriter:
+    """
+    Write-behind queue cho T_QA_Log
+
+    Stream chat chỉ cần `submit()` record rồi đi tiếp; một worker task gom
+    record thành batch và ghi DB trong thread riêng (register_qa_log_batch),
+    nên DB chậm không chặn event loop.
+
+    Mỗi record được append vào spool file (JSONL) lúc submit, và được đánh dấu
+    `done` sau khi commit. Record chưa `done` sẽ được replay khi start. Spool
+    ghi trên thread riêng với fsync gom nhóm (xem SpoolFile).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = QA_LOG_QUEUE_SIZE,
+        batch_size: int = QA_LOG_BATCH_SIZE,
+        flush_interval_ms: int = QA_LOG_FLUSH_INTERVAL_MS,
+        retry_seconds: float = QA_LOG_RETRY_SECONDS,
+        spool_path: str = QA_LOG_SPOOL_PATH,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval_ms / 1000
+        self.retry_seconds = retry_seconds
+        self.spool_path = spool_path
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._futures: Dict[str, asyncio.Future] = {}
+        # id -> record chưa commit (thứ tự submit); history đọc các record này
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._spool: Optional[SpoolFile] = None
+        self._stopping = False
+
+        self._stats = {
+            "enqueued": 0,
+            "flushed": 0,
+            "failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "replayed": 0,
+            "last_flush_lag_ms": 0.0,
+            "max_flush_lag_ms": 0.0,
+            "last_batch_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------ #
+    # Lifecycle
+    # ------------------------------------------------------------------ #
+
+    async def start(self):
+        """Mở spool, replay record chưa ghi và khởi động worker"""
+        if self._worker is not None:
+            return
+
+        # Queue không giới hạn; maxsize được kiểm tra trong submit() để
+        # record replay từ spool không bao giờ bị từ chối
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        pending = self._load_spool()
+
+        spool_dir = os.path.dirname(self.spool_path)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        # Viết lại spool chỉ với các record còn pending
+        self._spool = SpoolFile(self.spool_path)
+        self._spool.open()
+        for record in pending:
+            self._spool.append(record)
+            self._pending[record["id"]] = record
+            self._queue.put_nowait(record)
+        self._stats["replayed"] = len(pending)
+        if pending:
+            logger.warning(f"Replaying {len(pending)} QA log(s) from spool {self.spool_path}")
+
+        self._worker = asyncio.create_task(self._run())
+        logger.info("QA log writer started")
+
+    async def stop(self):
+        """Drain queue và ghi nốt các batch còn lại trước khi tắt"""
+        if self._worker is None:
+            return
+
+        self._stopping = True
+        await self._queue.put(None)
+        try:
+            await self._worker
+        finally:
+            self._worker = None
+            if self._spool:
+                await asyncio.get_running_loop().run_in_executor(None, self._spool.close)
+                self._spool = None
+        logger.info(f"QA log writer stopped: {self.metrics()}")
+
+    # ------------------------------------------------------------------ #
+    # Producer API
+    # ------------------------------------------------------------------ #
+
+    def submit(
+        self,
+        session_id: str,
+        user_cd: int,
+        question_text: str,
+        answer_text: str,
+    ) -> asyncio.Future:
+        """
+        Đưa một QA log vào queue (không block)
+
+        Returns:
+            Future resolve bằng dict kết quả (cùng format với register_qa_log)
+            sau khi batch chứa record được commit
+
+        Raises:
+            asyncio.QueueFull khi queue đầy (DB đang quá chậm)
+            RuntimeError khi writer chưa start
+        """
+        if self._worker is None or self._stopping:
+            raise RuntimeError("QA log writer is not running")
+
+        if self.maxsize and self._queue.qsize() >= self.maxsize:
+            raise asyncio.QueueFull()
+
+        record = {
+            "id": uuid.uuid4().hex,
+            "session_id": session_id,
+            "user_cd": user_cd,
+            "question_text": question_text,
+            "answer_text": answer_text,
+            "enqueued_at": time.time(),
+        }
+        self._spool.append(record)
+        self._queue.put_nowait(record)
+        self._pending[record["id"]] = record
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[record["id"]] = future
+        self._stats["enqueued"] += 1
+        return future
+
+    def pending_records(self, session_id: str) -> List[Dict[str, Any]]:
+        """Record của session đã submit nhưng chưa được xác nhận commit (thứ tự submit)"""
+        return [r for r in list(self._pending.values()) if r["session_id"] == session_id]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            **(self._spool.metrics() if self._spool else {}),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "pending": len(self._pending),
+        }
+
+    # ------------------------------------------------------------------ #
+    # Worker
+    # ------------------------------------------------------------------ #
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        done = False
+
+        while not done:
+            record = await self._queue.get()
+            if record is None:
+                done = True
+                batch = []
+            else:
+                batch = [record]
+
+            # Gom thêm record trong cửa sổ flush_interval
+            deadline = loop.time() + self.flush_interval
+            while not done and len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    item = self._queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+
+            # Khi stop: ghi hết phần còn lại trong queue
+            if done:
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        batch.append(item)
+
+            for i in range(0, len(batch), self.batch_size):
+                await self._flush(batch[i:i + self.batch_size])
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        while True:
+            started = time.time()
+            try:
+                # timeout=0: batch có commit, không bỏ dở phía async (retry sẽ ghi trùng)
+                results = await db_executor.run(self._write_batch, batch, timeout=0)
+                break
+            except Exception as e:
+                self._stats["retries"] += 1
+                logger.error(f"QA log batch write failed ({len(batch)} rows): {str(e)}")
+                if self._stopping:
+                    # Giữ lại trong spool, sẽ replay ở lần start sau
+                    for record in batch:
+                        self._resolve(record["id"], {"success": False, "error_message": str(e)})
+                    return
+                await asyncio.sleep(self.retry_seconds)
+
+        finished = time.time()
+        for record, result in zip(batch, results):
+            self._spool.append({"done": record["id"]})
+            self._pending.pop(record["id"], None)
+            self._stats["flushed" if result["success"] else "failed"] += 1
+            self._resolve(record["id"], result)
+
+        lag_ms = (finished - min(r["enqueued_at"] for r in batch)) * 1000
+        self._stats["batches"] += 1
+        self._stats["last_flush_lag_ms"] = round(lag_ms, 1)
+        self._stats["max_flush_lag_ms"] = max(self._stats["max_flush_lag_ms"], round(lag_ms, 1))
+        self._stats["last_batch_ms"] = round((finished - started) * 1000, 1)
+        logger.info(
+            f"Flushed QA log batch: rows={len(batch)}, lag_ms={lag_ms:.1f}, "
+            f"queue_depth={self._queue.qsize()}"
+        )
+
+        if not self._pending:
+            self._spool.truncate()
+
+    @staticmethod
+    def _write_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Turn number chỉ đề xuất một lần cho mỗi record (không cấp lại khi retry);
+        # register_qa_log_batch kiểm tra lại trong transaction
+        for record in batch:
+            if record.get("turn_no") is None:
+                record["turn_no"] = turn_allocator.allocate(record["session_id"])
+        if len(batch) >= QA_LOG_BULK_MIN_ROWS:
+            results = chat_db_service.register_qa_log_bulk(batch)
+        else:
+            results = chat_db_service.register_qa_log_batch(batch)
+        for record, result in zip(batch, results):
+            if result["success"]:
+                record["qa_log_cd"] = result["qa_log_cd"]
+                turn_allocator.observe(record["session_id"], record["turn_no"], result["turn_no"])
+                search_index.add(
+                    record["user_cd"], result["qa_log_cd"], record["session_id"],
+                    record["question_text"], record["answer_text"],
+                )
+        return results
+
+    def _resolve(self, record_id: str, result: Dict[str, Any]):
+        future = self._futures.pop(record_id, None)
+        if future and not future.done():
+            future.set_result(result)
+
+    # ------------------------------------------------------------------ #
+    # Spool file
+    # ------------------------------------------------------------------ #
+
+    def _load_spool(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.spool_path):
+            return []
+
+        records: Dict[str, Dict[str, Any]] = {}
+        with open(self.spool_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dòng cuối có thể bị cắt khi process crash
+                    continue
+                if "done" in entry:
+                    records.pop(entry["done"], None)
+                else:
+                    records[entry["id"]] = entry
+        return list(records.values())
+
+
+# Create singleton instance
+qa_log_writer = QALogWriter()
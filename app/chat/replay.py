@@ -0,0 +1,95 @@
+import asyncio
+from typing import Any, AsyncIterator, List, Optional
+
+from app.chat.flush import HEARTBEAT_EVENT
+
+
+class ReplayGone(Exception):
+    """Offset yêu cầu đã bị evict khỏi replay buffer"""
+
+
+class ReplayBuffer:
+    """
+    Buffer event (dict hoặc frame đã encode) đánh index theo offset,
+    cho nhiều reader đọc song song
+
+    Reader đọc từ một offset bất kỳ còn trong buffer rồi chờ event mới tới khi
+    buffer được close. Khi vượt `max_events` thì event cũ nhất bị bỏ và
+    `base_offset` tăng lên.
+    """
+
+    def __init__(self, max_events: Optional[int] = None):
+        self.max_events = max_events
+        self.base_offset = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._events: List[Any] = []
+        self._changed = asyncio.Event()
+
+    @property
+    def next_offset(self) -> int:
+        return self.base_offset + len(self._events)
+
+    def append(self, event: Any):
+        self._events.append(event)
+        if self.max_events and len(self._events) > self.max_events:
+            drop = len(self._events) - self.max_events
+            del self._events[:drop]
+            self.base_offset += drop
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(
+        self,
+        offset: int = 0,
+        heartbeat_seconds: float = 0,
+        stop: Optional[asyncio.Event] = None,
+        heartbeat: Any = HEARTBEAT_EVENT,
+    ) -> AsyncIterator[Any]:
+        """
+        Yield event từ `offset`, chờ event mới tới khi buffer close hoặc `stop` được set
+
+        Raises:
+            ReplayGone khi `offset` đã bị evict
+            Exception của producer nếu buffer bị close kèm error
+        """
+        stop = stop or asyncio.Event()
+        stop_waiter = asyncio.ensure_future(stop.wait())
+        try:
+            while not stop.is_set():
+                if offset < self.base_offset:
+                    raise ReplayGone(f"offset {offset} < {self.base_offset}")
+
+                while offset < self.next_offset and not stop.is_set():
+                    yield self._events[offset - self.base_offset]
+                    offset += 1
+                    if offset < self.base_offset:
+                        raise ReplayGone(f"offset {offset} < {self.base_offset}")
+
+                if stop.is_set():
+                    return
+                if self.done:
+                    if self.error is not None and not isinstance(self.error, asyncio.CancelledError):
+                        raise self.error
+                    return
+
+                changed_waiter = asyncio.ensure_future(self._changed.wait())
+                finished, _ = await asyncio.wait(
+                    {changed_waiter, stop_waiter},
+                    timeout=heartbeat_seconds if heartbeat_seconds > 0 else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not changed_waiter.done():
+                    changed_waiter.cancel()
+                if not finished:
+                    yield heartbeat
+        finally:
+            stop_waiter.cancel()
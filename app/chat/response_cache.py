@@ -0,0 +1,120 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from starlette.responses import Response
+
+from app import codec
+from app.config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_USERS, RESPONSE_CACHE_PER_USER
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def _request_key(request: Request) -> str:
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+class ConversationResponseCache:
+    """
+    ETag / 304 + cache response nhỏ theo user cho /api/conversations và history
+
+    Version stamp lấy từ T_QA_Session.RowVer (bị bump trong cùng transaction
+    với Register_QA_Log / Mark_Resolved_QA), nên đúng cả khi chạy nhiều
+    worker. ETag = hash(user, URL, version):
+    - If-None-Match khớp -> 304, không chạy query chính và không serialize
+    - Không khớp nhưng cache có body cùng ETag -> trả body đã render sẵn
+    Version phải được đọc TRƯỚC query chính (nếu đọc sau, ETag có thể gắn
+    cho nội dung cũ hơn version).
+    Version None (chưa có dòng summary, chưa backfill) -> không ETag, không cache.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        max_users: int = RESPONSE_CACHE_MAX_USERS,
+        per_user: int = RESPONSE_CACHE_PER_USER,
+    ):
+        self.enabled = enabled
+        self.max_users = max_users
+        self.per_user = per_user
+        self._users: "OrderedDict[int, OrderedDict]" = OrderedDict()
+        self._stats = {"not_modified": 0, "hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def etag(request: Request, user_cd: int, version: Any) -> str:
+        digest = hashlib.sha1(f"{user_cd}|{_request_key(request)}|{version}".encode("utf-8")).hexdigest()
+        return f'W/"{digest[:20]}"'
+
+    def lookup(self, request: Request, user_cd: int, version: Any) -> Optional[Response]:
+        """304 / response đã cache cho version hiện tại, None nếu phải dựng lại"""
+        if not self.enabled or version is None:
+            return None
+
+        etag = self.etag(request, user_cd, version)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            self._stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        entries = self._users.get(user_cd)
+        entry = entries.get(_request_key(request)) if entries else None
+        if entry is None or entry[0] != etag:
+            self._stats["misses"] += 1
+            return None
+
+        self._users.move_to_end(user_cd)
+        entries.move_to_end(_request_key(request))
+        self._stats["hits"] += 1
+        return Response(content=entry[1], media_type="application/json", headers=headers)
+
+    def store(self, request: Request, user_cd: int, version: Any, payload: Dict[str, Any]) -> Response:
+        """Render payload một lần, cache body theo ETag và trả response"""
+        body = codec.dumps(payload)
+        if not self.enabled or version is None:
+            return Response(content=body, media_type="application/json")
+
+        etag = self.etag(request, user_cd, version)
+        entries = self._users.get(user_cd)
+        if entries is None:
+            entries = self._users[user_cd] = OrderedDict()
+        entries[_request_key(request)] = (etag, body)
+        entries.move_to_end(_request_key(request))
+        while len(entries) > self.per_user:
+            entries.popitem(last=False)
+        self._users.move_to_end(user_cd)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        self._stats["stores"] += 1
+
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "users": len(self._users),
+            "entries": sum(len(e) for e in self._users.values()),
+        }
+
+
+# Create singleton instance
+response_cache = ConversationResponseCache()
@@ -1,15 +1,41 @@
-import json
-from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import httpx
+from app import codec
+from app.codec import JSONResponse
 from app.auth.guard import login_required
-from app.chat.chat_db_service import chat_db_service
+from app.auth.principal import Principal, current_principal, admin_principal
+from app.users.identity_cache import identity_cache
+from app.users.login_debounce import login_debouncer
+from app.chat.chat_db_service import chat_db_service, async_chat_db_service
+from app.db.connection import db_pool, db_read_pool, db_router
+from app.db.executor import db_executor
 from app.chat.service import chat_service
-from app.config import CHAT_API_KEY, CHAT_API_URL, CHAT_API_FAKE, inject_globals
-from app.users.repo import get_user_by_email
+from app.chat.turn_allocator import turn_allocator
+from app.chat.pagination import InvalidCursor
+from app.chat.response_cache import response_cache
+from app.chat.search_index import QueryTooShort, search_index
+from app.chat.archive import qa_log_archive
+from app.chat.upstream import upstream_pool
+from app.chat.flush import TokenCoalescer
+from app.chat.qa_log_writer import qa_log_writer
+from app.chat.admission import admission_controller, AdmissionRejected
+from app.chat.streaming import ChatStreamingResponse
+from app.chat.answer_cache import answer_cache, make_cache_key
+from app.chat.single_flight import single_flight
+from app.chat.generations import ChatTurn, turn_registry
+from app.chat.replay import ReplayGone
+from app.chat.history import conversation_history
+from app.config import (
+    CHAT_API_KEY,
+    CHAT_API_FAKE,
+    CHAT_DISCONNECT_POLL_SECONDS,
+    HISTORY_PREVIEW_CHARS,
+    inject_globals,
+)
 import logging
-import time
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -29,36 +55,68 @@ def chat_page(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request, "user": user})
 
 
+def stream_turn(req: Request, turn: ChatTurn, offset: int) -> ChatStreamingResponse:
+    """
+    Stream một ChatTurn từ `offset` cho một connection
+
+    Frame đã được encode sẵn (bytes) trong replay buffer của turn.
+    Offset = số dòng không rỗng client đã nhận (mỗi frame đúng một dòng),
+    client dùng nó để resume khi rớt mạng.
+    """
+    stop = asyncio.Event()
+    detached = False
+
+    def detach():
+        nonlocal detached
+        if not detached:
+            detached = True
+            turn.detach_reader()
+
+    async def watch_disconnect():
+        while not await req.is_disconnected():
+            await asyncio.sleep(CHAT_DISCONNECT_POLL_SECONDS)
+        logger.info(f"Client disconnected: session={turn.conversation_id}, turn={turn.turn_id}")
+        stop.set()
+
+    async def stream():
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            async for frame in turn.read(offset, stop):
+                yield frame
+        except ReplayGone as e:
+            logger.warning(f"Replay offset evicted: turn={turn.turn_id}, {str(e)}")
+        finally:
+            watcher.cancel()
+            detach()
+
+    turn.attach_reader()
+    return ChatStreamingResponse(
+        stream(),
+        on_close=[detach],
+        media_type="text/plain; charset=utf-8",
+        headers={
+            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+            "Pragma": "no-cache",
+            "Expires": "0",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",  # nginx / proxy
+            "X-Chat-Turn-Id": turn.turn_id,
+            "X-Chat-Offset": str(offset),
+        },
+    )
+
+
 @router.post("/api/chat")
-async def chat_proxy(req: Request):
+async def chat_proxy(req: Request, principal: Principal = Depends(current_principal)):
     """Stream chat response and auto-save to DB"""
-    guard = login_required(req, api=True)
-    if guard:
-        return guard
-
     try:
-        # Get user info
-        user = req.session.get("user", {})
-        user_email = user.get("email")
-        if not user_email:
-            return JSONResponse(
-                {"success": False, "error": "User not authenticated"}, status_code=401
-            )
-
-        # Get UserCD from database
-        user_row = get_user_by_email(user_email)
-        if not user_row:
-            return JSONResponse(
-                {"success": False, "error": "User not found"}, status_code=404
-            )
-        user_cd = user_row.UserCD
+        user_cd = principal.user_cd
 
         # Parse request body
         body = await req.json()
         conversation_id = body.get("conversation_id")
         question = body.get("question", "")
-        chat_history = body.get("chat_history", [])
-        print("history:", chat_history)
+        chat_history = body.get("chat_history")
         if not conversation_id:
             return JSONResponse(
                 {"success": False, "error": "conversation_id is required"},
@@ -70,6 +128,10 @@ async def chat_proxy(req: Request):
                 {"success": False, "error": "question is required"}, status_code=400
             )
 
+        # History do server dựng từ T_QA_Log (client cũ vẫn có thể gửi chat_history)
+        if chat_history is None:
+            chat_history = await conversation_history.build(conversation_id, user_cd)
+
         build_body = {
             "conversation_id": conversation_id,
             "question": question,
@@ -83,136 +145,129 @@ async def chat_proxy(req: Request):
             "Content-Type": "application/json",
         }
 
-        full_answer = ""
-        pdf_metadata = None
-        has_error = False
-        error_message = ""
-
-        async def stream():
-            nonlocal full_answer, pdf_metadata, has_error, error_message
-
-            async with httpx.AsyncClient(timeout=None, verify=False) as client:
-                async with client.stream(
-                    "POST",
-                    CHAT_API_URL,
-                    json=build_body,
-                    headers=headers,
-                ) as res:
-                    async for line in res.aiter_lines():
-                        # print("LINE:", line)
-                        if not line:
-                            continue
-
-                        try:
-                            event = json.loads(line)
-                        except Exception as e:
-                            print("JSON parse error:", e, line)
-                            continue
-
-                        t = event.get("type")
-
-                        # Handle text token
-                        if t == "text":
-                            token = event.get("data", "")
-                            full_answer += token
-                            # yield f"data: {event.get('data', '')}\n"
-                            yield f"{json.dumps({'type':'text','data': event.get("data", "")}, ensure_ascii=False)}\n"
-                            # yield event.get("data", "")
-                            yield " " * 2048 + "\n"  # empty ARR flush
-                        # ✅ metadata about PDF
-                        elif t == "metadata":
-                            # forward to frontend
-                            yield f"{json.dumps({'type':'text','data': '[[META]]' + json.dumps(event['data'])}, ensure_ascii=False)}\n"
-                            # yield f"data:[[META]]{json.dumps(event['data'])}\n"
-
-                        # ❌ error handling
-                        elif t == "error":
-                            msg = event["data"].get("message", "Stream error")
-                            yield f"data: [ERROR]{msg}\n\n"
-                            break
-                        time.sleep(0.01)
-            if not has_error and full_answer:
-                try:
-                    turn_no = chat_service.get_next_turn_no(conversation_id)
-
-                    # answer_with_metadata = {
-                    #     "text": full_answer,
-                    #     "pdf_details": (
-                    #         pdf_metadata.get("pdf_sources", []) if pdf_metadata else []
-                    #     ),
-                    # }
-
-                    result = chat_db_service.register_qa_log(
-                        session_id=conversation_id,
-                        turn_no=turn_no,
-                        user_cd=user_cd,
-                        question_text=question,
-                        answer_text=full_answer,
-                    )
-
-                    if result["success"]:
-                        qa_log_cd = result.get("qa_log_cd")
-                        logger.info(
-                            f"Saved chat to DB: session={conversation_id}, turn={turn_no}, qa_log_cd={result.get('qa_log_cd')}"
-                        )
-                        yield f"[[QA_LOG_CD]]{qa_log_cd}\n\n"
-                    else:
-                        logger.error(
-                            f"Failed to save chat to DB: {result.get('error_message')}"
-                        )
-
-                except Exception as e:
-                    logger.error(f"Error saving chat to DB: {str(e)}")
-            print("CHAT_API_URL =", CHAT_API_URL)
-
-        return StreamingResponse(
-            stream(),
-            media_type="text/plain; charset=utf-8",
-            headers={
-                "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-                "Pragma": "no-cache",
-                "Expires": "0",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",  # nginx / proxy
-            },
+        # Answer cache: câu hỏi FAQ giống hệt -> replay, không gọi upstream
+        cache_key = make_cache_key(question, chat_history)
+        cached_events = answer_cache.get(cache_key)
+
+        # Admission control trước single-flight: request dùng chung upstream
+        # stream vẫn tốn token rate limit của user, chỉ không chiếm slot
+        inflight = None
+        slot = None
+        if cached_events is None:
+            try:
+                admission_controller.take_token(user_cd)
+                # Single-flight: cùng câu hỏi + cùng history đang chạy -> dùng chung upstream
+                inflight = single_flight.join(cache_key)
+                if inflight is None:
+                    # Global cap upstream streams + fair queue theo user
+                    slot = await admission_controller.acquire(user_cd, charge=False)
+                    # Trong lúc chờ slot, request khác có thể đã bắt đầu cùng câu hỏi
+                    inflight = single_flight.join(cache_key)
+                    if inflight is not None:
+                        slot.release()
+                        slot = None
+            except AdmissionRejected as e:
+                logger.warning(
+                    f"Chat request rejected: user_cd={user_cd}, reason={e.reason}, retry_after={e.retry_after}"
+                )
+                return JSONResponse(
+                    {"success": False, "error": e.reason, "retry_after": e.retry_after},
+                    status_code=429,
+                    headers={"Retry-After": str(e.retry_after)},
+                )
+            if inflight is not None:
+                logger.info(f"Joined in-flight upstream stream: session={conversation_id}")
+        else:
+            logger.info(f"Answer cache hit: session={conversation_id}")
+
+        if slot is not None:
+            inflight = single_flight.start(
+                cache_key,
+                TokenCoalescer().coalesce(upstream_pool.stream_events(build_body, headers)),
+            )
+            # Slot upstream được trả khi upstream stream kết thúc / bị cancel
+            inflight.add_done_callback(slot.release)
+
+        turn = ChatTurn(
+            conversation_id=conversation_id,
+            user_cd=user_cd,
+            question=question,
+            cache_key=cache_key,
+            subscription=inflight.attach() if inflight is not None else None,
+            cached_events=cached_events,
         )
+        turn_registry.register(turn)
+
+        return stream_turn(req, turn, offset=0)
 
     except Exception as e:
         logger.error(f"Chat proxy error: {str(e)}")
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
 
-@router.post("/api/conversation/new")
-async def new_conversation(request: Request):
-    """API to create new conversation (new session)"""
-    guard = login_required(request, api=True)
-    if guard:
-        return guard
-
+@router.post("/api/chat/{conversation_id}/stop")
+async def stop_generation(
+    request: Request, conversation_id: str, principal: Principal = Depends(current_principal)
+):
+    """API to abort the in-flight generation of a conversation"""
     try:
-        import uuid
+        stopped = turn_registry.stop(conversation_id, principal.user_cd)
+        return JSONResponse(
+            {"success": True, "conversation_id": conversation_id, "stopped": stopped}
+        )
+
+    except Exception as e:
+        logger.error(f"Stop generation error: {str(e)}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
-        # Get user info
-        user = request.session.get("user", {})
-        user_email = user.get("email")
 
-        if not user_email:
+@router.get("/api/chat/{conversation_id}/resume")
+async def resume_chat(
+    request: Request,
+    conversation_id: str,
+    turn_id: Optional[str] = None,
+    offset: int = 0,
+    principal: Principal = Depends(current_principal),
+):
+    """API to reconnect to (or observe) an in-flight / recent turn from an offset"""
+    try:
+        turn = turn_registry.get(conversation_id, turn_id)
+        if turn is None or turn.user_cd != principal.user_cd:
             return JSONResponse(
-                {"success": False, "error": "User not authenticated"}, status_code=401
+                {"success": False, "error": "Turn not found"}, status_code=404
             )
 
-        # Get UserCD from database
-        user_row = get_user_by_email(user_email)
-        if not user_row:
+        if offset < turn.buffer.base_offset or offset > turn.buffer.next_offset:
             return JSONResponse(
-                {"success": False, "error": "User not found"}, status_code=404
+                {
+                    "success": False,
+                    "error": "Offset no longer available",
+                    "base_offset": turn.buffer.base_offset,
+                },
+                status_code=410,
             )
 
+        logger.info(
+            f"Resume chat stream: session={conversation_id}, turn={turn.turn_id}, offset={offset}"
+        )
+        return stream_turn(request, turn, offset)
+
+    except Exception as e:
+        logger.error(f"Resume chat error: {str(e)}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.post("/api/conversation/new")
+async def new_conversation(request: Request, principal: Principal = Depends(current_principal)):
+    """API to create new conversation (new session)"""
+    try:
+        import uuid
+
         # Create new session ID
         session_id = str(uuid.uuid4())
 
         logger.info(
-            f"Created new conversation: session_id={session_id}, user_cd={user_row.UserCD}"
+            f"Created new conversation: session_id={session_id}, user_cd={principal.user_cd}"
         )
 
         return JSONResponse(
@@ -230,33 +285,32 @@ async def new_conversation(request: Request):
 
 
 @router.get("/api/conversations")
-async def get_conversations(request: Request):
-    """API to get user's conversations (sessions)"""
-    guard = login_required(request, api=True)
-    if guard:
-        return guard
-
+async def get_conversations(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    principal: Principal = Depends(current_principal),
+):
+    """
+    API to get user's conversations (sessions)
+
+    - cursor: next_cursor của trang trước -> trang tiếp theo (cũ hơn)
+    - since: sync_token của lần gọi trước -> chỉ các session đã thay đổi
+
+    Có ETag; If-None-Match khớp -> 304 (xem response_cache).
+    """
     try:
-        # Lấy user info
-        user = request.session.get("user", {})
-        user_email = user.get("email")
+        user_cd = principal.user_cd
 
-        if not user_email:
-            return JSONResponse(
-                {"success": False, "error": "User not authenticated"}, status_code=401
-            )
-
-        # Lấy UserCD từ database
-        user_row = get_user_by_email(user_email)
-        if not user_row:
-            return JSONResponse(
-                {"success": False, "error": "User not found"}, status_code=404
-            )
-
-        user_cd = user_row.UserCD
+        # Version đọc trước query chính; cache hit / 304 thì không query tiếp
+        version = await async_chat_db_service.get_user_sessions_version(user_cd)
+        cached = response_cache.lookup(request, user_cd, version)
+        if cached is not None:
+            return cached
 
         # Lấy danh sách sessions
-        result = chat_service.get_user_sessions(user_cd, limit=50)
+        result = await chat_service.get_user_sessions(user_cd, limit=limit, cursor=cursor, since=since)
 
         if not result["success"]:
             return JSONResponse(
@@ -298,20 +352,71 @@ async def get_conversations(request: Request):
                 }
             )
 
-        return JSONResponse({"success": True, "conversations": conversations})
+        return response_cache.store(
+            request,
+            user_cd,
+            version,
+            {
+                "success": True,
+                "conversations": conversations,
+                "has_more": result["has_more"],
+                "next_cursor": result["next_cursor"],
+                "sync_token": result["sync_token"],
+            },
+        )
 
+    except InvalidCursor as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
     except Exception as e:
         logger.error(f"Get conversations error: {str(e)}")
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
 
+@router.get("/api/conversations/search")
+async def search_conversations(
+    request: Request,
+    q: str = "",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    principal: Principal = Depends(current_principal),
+):
+    """
+    API to search the user's past questions / answers
+
+    Kết quả xếp hạng theo độ liên quan; mỗi kết quả có snippet của question
+    và answer kèm highlights ([start, end) trong snippet).
+    - limit: số kết quả mỗi trang; cursor = next_cursor -> trang sau
+    """
+    try:
+        if not q.strip():
+            return JSONResponse({"success": False, "error": "Query is required"}, status_code=400)
+
+        result = await chat_service.search_conversations(
+            principal.user_cd, q, limit=limit, cursor=cursor
+        )
+        return JSONResponse(
+            {
+                "success": True,
+                "query": q,
+                "results": result["results"],
+                "total": result["total"],
+                "has_more": result["has_more"],
+                "next_cursor": result["next_cursor"],
+            }
+        )
+
+    except (InvalidCursor, QueryTooShort) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Search conversations error: {str(e)}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
 @router.post("/api/conversation/{qa_log_cd}/resolve")
-async def mark_resolved(request: Request, qa_log_cd: int):
+async def mark_resolved(
+    request: Request, qa_log_cd: int, principal: Principal = Depends(current_principal)
+):
     """API to mark conversation as resolved"""
-    guard = login_required(request, api=True)
-    if guard:
-        return guard
-
     try:
         if not qa_log_cd or qa_log_cd <= 0:
             return JSONResponse(
@@ -320,7 +425,7 @@ async def mark_resolved(request: Request, qa_log_cd: int):
 
         logger.info(f"Marking as resolved: qa_log_cd={qa_log_cd}")
 
-        result = chat_service.mark_session_resolved(qa_log_cd)
+        result = await chat_service.mark_session_resolved(qa_log_cd)
 
         if not result["success"]:
             logger.error(f"Mark resolved failed: {result.get('error')}")
@@ -347,15 +452,67 @@ async def mark_resolved(request: Request, qa_log_cd: int):
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
 
 
-@router.get("/api/conversation/{session_id}/history")
-async def get_conversation_history(request: Request, session_id: str):
-    """API to get conversation history"""
-    guard = login_required(request, api=True)
-    if guard:
-        return guard
+def history_message(log: dict) -> dict:
+    """Một turn của T_QA_Log -> message cho frontend (full hoặc summary projection)"""
+    message = {
+        "turn_no": log["TurnNo"],
+        "timestamp": log["RegisteredAt"].isoformat() if log["RegisteredAt"] else None,
+        "is_resolved": log["ResolvedTurnNo"] is not None,
+    }
+    if "QuestionPreview" in log:
+        message["qa_log_cd"] = log["QALogCD"]
+        message["question_preview"] = log["QuestionPreview"]
+    else:
+        message["question"] = log["QuestionText"]
+        message["answer"] = log["AnswerText"]
+    return message
+
+
+def archived_log(log: dict, summary: bool) -> dict:
+    """Turn đọc từ archive -> cùng projection với iter_session_logs (full / summary)"""
+    if not summary:
+        return log
+    return {
+        "QALogCD": log["QALogCD"],
+        "TurnNo": log["TurnNo"],
+        "QuestionPreview": (log["QuestionText"] or "")[:HISTORY_PREVIEW_CHARS],
+        "RegisteredAt": log["RegisteredAt"],
+        "ResolvedTurnNo": log["ResolvedTurnNo"],
+    }
+
 
+@router.get("/api/conversation/{session_id}/history")
+async def get_conversation_history(
+    request: Request,
+    session_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    principal: Principal = Depends(current_principal),
+):
+    """
+    API to get conversation history
+
+    Không có limit / cursor / since: trả toàn bộ turns (như trước).
+    - limit: các turn mới nhất; cursor = next_cursor -> các turn cũ hơn
+    - since: sync_token -> chỉ các turn mới hơn (mọi turn nếu session đã được
+      resolve lại sau token)
+
+    Có ETag; If-None-Match khớp -> 304 (xem response_cache).
+    """
     try:
-        result = chat_service.get_session_history(session_id)
+        # Version lọc theo UserCD: có version = session của user. Không có
+        # (chưa backfill / của user khác) -> kiểm tra T_QA_Log, không có -> 404
+        version = await async_chat_db_service.get_session_version(session_id, principal.user_cd)
+        if version is None and not await async_chat_db_service.has_session_logs(session_id, principal.user_cd):
+            return JSONResponse({"success": False, "error": "Conversation not found"}, status_code=404)
+        cached = response_cache.lookup(request, principal.user_cd, version)
+        if cached is not None:
+            return cached
+
+        result = await chat_service.get_session_history(
+            session_id, principal.user_cd, limit=limit, cursor=cursor, since=since
+        )
 
         if not result["success"]:
             return JSONResponse(
@@ -367,29 +524,159 @@ async def get_conversation_history(request: Request, session_id: str):
             )
 
         # Format logs for frontend
-        messages = []
-        for log in result["logs"]:
-            messages.append(
-                {
-                    "turn_no": log["TurnNo"],
-                    "question": log["QuestionText"],
-                    "answer": log["AnswerText"],
-                    "timestamp": (
-                        log["RegisteredAt"].isoformat() if log["RegisteredAt"] else None
-                    ),
-                    "is_resolved": log["ResolvedTurnNo"] is not None,
-                }
-            )
+        messages = [history_message(log) for log in result["logs"]]
 
-        return JSONResponse(
+        return response_cache.store(
+            request,
+            principal.user_cd,
+            version,
             {
                 "success": True,
                 "session_id": session_id,
                 "messages": messages,
                 "total_turns": result["total_turns"],
-            }
+                "has_more": result["has_more"],
+                "next_cursor": result["next_cursor"],
+                "sync_token": result["sync_token"],
+            },
         )
 
+    except InvalidCursor as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
     except Exception as e:
         logger.error(f"Get conversation history error: {str(e)}")
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.get("/api/conversation/{session_id}/history/stream")
+async def stream_conversation_history(
+    request: Request,
+    session_id: str,
+    view: str = "full",
+    principal: Principal = Depends(current_principal),
+):
+    """
+    API to stream conversation history as NDJSON
+
+    Đọc T_QA_Log bằng fetchmany và ghi từng chunk ra ngay, không dựng cả
+    session trong memory. Mỗi dòng: {"type": "turn", ...}; kết thúc bằng
+    {"type": "end", "total_turns": N} (hoặc {"type": "error", ...}).
+
+    - view=full: question + answer
+    - view=summary: turn_no, question_preview, timestamp, is_resolved;
+      answer lấy sau qua /api/conversation/{session_id}/turn/{turn_no}
+    """
+    if view not in ("full", "summary"):
+        return JSONResponse({"success": False, "error": "Invalid view"}, status_code=400)
+
+    summary = view == "summary"
+    # Đọc chunk đầu trước khi trả header: session không có / không thuộc user -> 404
+    chunks = async_chat_db_service.stream_session_logs(session_id, principal.user_cd, summary=summary)
+    try:
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = []
+        # Các turn cũ hơn turn đầu trong T_QA_Log có thể đã archive
+        archived = await qa_log_archive.load_turns_async(
+            session_id, None, first[0]["TurnNo"] if first else None
+        )
+        first = [archived_log(log, summary) for log in archived if log["UserCD"] == principal.user_cd] + first
+    except Exception as e:
+        await chunks.aclose()
+        logger.error(f"Stream conversation history error: {str(e)}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    if not first:
+        await chunks.aclose()
+        return JSONResponse({"success": False, "error": "Conversation not found"}, status_code=404)
+
+    async def body():
+        total = len(first)
+        try:
+            yield b"".join(
+                codec.ndjson_line({"type": "turn", **history_message(log)}) for log in first
+            )
+            async for chunk in chunks:
+                total += len(chunk)
+                yield b"".join(
+                    codec.ndjson_line({"type": "turn", **history_message(log)}) for log in chunk
+                )
+        except Exception as e:
+            logger.error(f"Stream conversation history error: {str(e)}")
+            yield codec.ndjson_line({"type": "error", "message": str(e)})
+            return
+        finally:
+            await chunks.aclose()
+        yield codec.ndjson_line({"type": "end", "session_id": session_id, "total_turns": total})
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.get("/api/conversation/{session_id}/turn/{turn_no}")
+async def get_conversation_turn(
+    request: Request, session_id: str, turn_no: int, principal: Principal = Depends(current_principal)
+):
+    """API to get one turn with its answer (lazy load for history view=summary)"""
+    try:
+        log = await async_chat_db_service.get_turn(session_id, turn_no, principal.user_cd)
+        if log is None:
+            archived = await qa_log_archive.load_turns_async(session_id, turn_no - 1, turn_no + 1)
+            log = next((a for a in archived if a["UserCD"] == principal.user_cd), None)
+        if log is None:
+            return JSONResponse({"success": False, "error": "Turn not found"}, status_code=404)
+        return JSONResponse({"success": True, "session_id": session_id, "message": history_message(log)})
+
+    except Exception as e:
+        logger.error(f"Get conversation turn error: {str(e)}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.get("/api/chat/metrics")
+async def chat_metrics(request: Request, principal: Principal = Depends(current_principal)):
+    """API to get runtime metrics of the chat pipeline"""
+    return JSONResponse(
+        {
+            "success": True,
+            "qa_log_writer": qa_log_writer.metrics(),
+            "admission": admission_controller.metrics(),
+            "answer_cache": answer_cache.metrics(),
+            "single_flight": single_flight.metrics(),
+            "upstream": upstream_pool.metrics(),
+            "db_pool": db_pool.stats(),
+            "db_read_pool": db_read_pool.stats() if db_router.split else None,
+            "db_router": db_router.stats(),
+            "db_executor": db_executor.metrics(),
+            "turns": turn_registry.metrics(),
+            "history": conversation_history.metrics(),
+            "identity_cache": identity_cache.metrics(),
+            "login_debounce": login_debouncer.metrics(),
+            "turn_allocator": turn_allocator.metrics(),
+            "response_cache": response_cache.metrics(),
+            "search_index": search_index.metrics(),
+            "archive": qa_log_archive.metrics(),
+        }
+    )
+
+
+@router.post("/api/admin/answer-cache/invalidate")
+async def invalidate_answer_cache(request: Request, principal: Principal = Depends(admin_principal)):
+    """API (admin) to invalidate the answer cache, all entries or one question"""
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+
+    removed = answer_cache.invalidate(body.get("question"))
+    return JSONResponse({"success": True, "removed": removed})
+
+
+@router.post("/api/admin/answer-cache/toggle")
+async def toggle_answer_cache(request: Request, principal: Principal = Depends(admin_principal)):
+    """API (admin) to enable / disable the answer cache at runtime"""
+    body = await request.json()
+    answer_cache.enabled = bool(body.get("enabled"))
+    if not answer_cache.enabled:
+        answer_cache.invalidate()
+
+    logger.info(f"Answer cache enabled={answer_cache.enabled}")
+    return JSONResponse({"success": True, "enabled": answer_cache.enabled})
@@ -0,0 +1,339 @@
+import logging
+import math
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.chat.archive import qa_log_archive
+from app.chat.chat_db_service import chat_db_service
+from app.config import SEARCH_INDEX_MAX_USERS, SEARCH_INDEX_SYNC_SECONDS, SEARCH_SNIPPET_CHARS
+
+logger = logging.getLogger(__name__)
+
+# BM25
+K1 = 1.2
+B = 0.75
+# Câu hỏi ngắn và sát ý người dùng hơn câu trả lời -> tf của QuestionText nhân hệ số này
+QUESTION_BOOST = 2
+
+# QALogCD là IDENTITY toàn bảng: dòng có id nhỏ hơn watermark vẫn có thể commit
+# muộn (worker khác), nên mỗi lần sync đọc lùi lại một đoạn id (dòng đã có bị bỏ qua)
+SYNC_OVERLAP_IDS = 1000
+
+
+class QueryTooShort(ValueError):
+    """Query không có term nào index được (ví dụ chỉ gồm 1 ký tự kanji / kana)"""
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x3040 <= code <= 0x30FF      # hiragana, katakana
+        or 0x31F0 <= code <= 0x31FF   # katakana phonetic extensions
+        or 0x3400 <= code <= 0x4DBF   # CJK extension A
+        or 0x4E00 <= code <= 0x9FFF   # CJK unified ideographs
+        or 0xF900 <= code <= 0xFAFF   # CJK compatibility ideographs
+        or 0xAC00 <= code <= 0xD7AF   # hangul
+        or ch == "々"
+    )
+
+
+def normalize(text: Optional[str]) -> str:
+    """NFKC (full-width -> half-width ASCII, half-width kana -> full-width) + lowercase"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def _runs(text: str) -> List[Tuple[bool, str]]:
+    """Tách text đã normalize thành các đoạn liên tục (is_cjk, run); ký tự khác là dấu phân cách"""
+    runs = []
+    current, current_cjk = [], False
+    for ch in text:
+        cjk = _is_cjk(ch)
+        if not cjk and not ch.isalnum():
+            if current:
+                runs.append((current_cjk, "".join(current)))
+                current = []
+            continue
+        if current and cjk != current_cjk:
+            runs.append((current_cjk, "".join(current)))
+            current = []
+        current_cjk = cjk
+        current.append(ch)
+    if current:
+        runs.append((current_cjk, "".join(current)))
+    return runs
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Tokenizer cho tiếng Nhật + chữ Latin
+
+    - Đoạn CJK (kanji / kana): bigram chồng nhau ("保証期間" -> 保証, 証期, 期間);
+      đoạn chỉ 1 ký tự giữ nguyên
+    - Đoạn chữ / số Latin: nguyên từ
+    """
+    tokens = []
+    for cjk, run in _runs(normalize(text)):
+        if cjk and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(query: str) -> Tuple[List[str], List[str]]:
+    """
+    Query -> (tokens dùng để tìm, terms dùng để highlight)
+
+    Term CJK 1 ký tự không có trong index (chỉ có bigram) nên bị bỏ qua.
+    """
+    tokens, terms = [], []
+    for cjk, run in _runs(normalize(query)):
+        if cjk and len(run) == 1:
+            continue
+        terms.append(run)
+        for token in (tokenize(run) if cjk else [run]):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens, terms
+
+
+def _match_spans(lowered: str, terms: List[str]) -> List[Tuple[int, int]]:
+    spans = []
+    for term in terms:
+        start = lowered.find(term)
+        while start != -1:
+            spans.append((start, start + len(term)))
+            start = lowered.find(term, start + 1)
+    spans.sort()
+    merged = []
+    for s, e in spans:
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def snippet(text: Optional[str], terms: List[str], tokens: List[str], width: int = SEARCH_SNIPPET_CHARS) -> Dict[str, Any]:
+    """
+    Đoạn trích quanh lần khớp đầu tiên + vị trí highlight [start, end) trong đoạn trích
+
+    Highlight trả dạng offset (không chèn HTML) để frontend tự escape / render.
+    Không có term nguyên vẹn trong text thì highlight theo bigram.
+    """
+    display = unicodedata.normalize("NFKC", text or "")
+    lowered = display.lower()
+    if len(lowered) != len(display):
+        display = lowered
+
+    spans = _match_spans(lowered, terms) or _match_spans(lowered, tokens)
+    if spans:
+        start = max(0, min(spans[0][0] - width // 4, len(display) - width))
+    else:
+        start = 0
+    end = min(len(display), start + width)
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(display) else ""
+    highlights = [
+        [max(s, start) - start + len(prefix), min(e, end) - start + len(prefix)]
+        for s, e in spans
+        if s < end and e > start
+    ]
+    return {"text": prefix + display[start:end] + suffix, "highlights": highlights}
+
+
+class _UserIndex:
+    """Inverted index Q&A log của một user: token -> {QALogCD: tf}"""
+
+    __slots__ = ("lock", "postings", "lengths", "sessions", "total_length", "watermark", "synced_at")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        # QALogCD -> SessionId: log đã bị archive khỏi T_QA_Log vẫn đọc lại được snippet
+        self.sessions: Dict[int, str] = {}
+        self.total_length = 0
+        self.watermark = 0
+        self.synced_at = 0.0
+
+    def add(self, qa_log_cd: int, session_id: str, question: Optional[str], answer: Optional[str]) -> bool:
+        # Gọi khi đang giữ self.lock
+        if qa_log_cd in self.lengths:
+            return False
+        self.sessions[qa_log_cd] = session_id
+        question_tokens = tokenize(question)
+        answer_tokens = tokenize(answer)
+        tf = Counter(answer_tokens)
+        for token in question_tokens:
+            tf[token] += QUESTION_BOOST
+        for token, count in tf.items():
+            self.postings.setdefault(token, {})[qa_log_cd] = count
+        length = QUESTION_BOOST * len(question_tokens) + len(answer_tokens)
+        self.lengths[qa_log_cd] = length
+        self.total_length += length
+        return True
+
+    def rank(self, tokens: List[str]) -> List[Tuple[float, int]]:
+        """BM25, mọi token của query phải có mặt (AND); sắp xếp score giảm dần"""
+        # Gọi khi đang giữ self.lock
+        lists = [self.postings.get(token) for token in tokens]
+        if not lists or any(p is None for p in lists):
+            return []
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+
+        n = len(self.lengths)
+        avg_length = self.total_length / n if n else 1.0
+        idf = [math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for p in lists]
+        ranked = []
+        for qa_log_cd in candidates:
+            norm = K1 * (1 - B + B * self.lengths[qa_log_cd] / (avg_length or 1.0))
+            score = 0.0
+            for weight, postings in zip(idf, lists):
+                tf = postings[qa_log_cd]
+                score += weight * tf * (K1 + 1) / (tf + norm)
+            ranked.append((score, qa_log_cd))
+        ranked.sort(key=lambda r: (-r[0], -r[1]))
+        return ranked
+
+
+class ConversationSearchIndex:
+    """
+    Full-text search trên lịch sử Q&A của từng user (/api/conversations/search)
+
+    Thay cho LIKE '%...%' trên nvarchar(max): mỗi user có inverted index
+    bigram trong process, build lazy ở lần search đầu rồi cập nhật
+    incremental:
+    - qa_log_writer đẩy từng log vừa ghi vào index (nếu index của user đã load)
+    - trước mỗi search (tối đa một lần mỗi `sync_seconds`) đọc các dòng có
+      QALogCD > watermark - dòng do worker khác ghi cũng được index
+    Index chỉ giữ postings + độ dài document; snippet được dựng từ text đọc
+    lại từ DB cho các kết quả của trang hiện tại. Số user giữ index giới hạn
+    theo LRU (`max_users`).
+
+    Các method đều blocking - gọi trên DB executor thread.
+    """
+
+    def __init__(self, max_users: int = SEARCH_INDEX_MAX_USERS, sync_seconds: float = SEARCH_INDEX_SYNC_SECONDS):
+        self.max_users = max_users
+        self.sync_seconds = sync_seconds
+        self._users: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "builds": 0, "syncs": 0, "synced_rows": 0, "archived_rows": 0, "pushed": 0, "evictions": 0}
+
+    def _get(self, user_cd: int, create: bool) -> Optional[_UserIndex]:
+        with self._lock:
+            index = self._users.get(user_cd)
+            if index is None:
+                if not create:
+                    return None
+                index = self._users[user_cd] = _UserIndex()
+                self._stats["builds"] += 1
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self._stats["evictions"] += 1
+            self._users.move_to_end(user_cd)
+            return index
+
+    def _sync(self, user_cd: int, index: _UserIndex, force: bool = False):
+        # Gọi khi đang giữ index.lock
+        if not force and time.monotonic() - index.synced_at < self.sync_seconds:
+            return
+        self._stats["syncs"] += 1
+        if not index.synced_at:
+            # Lần build đầu: các turn đã archive không còn trong T_QA_Log
+            for logs in qa_log_archive.iter_user_turns(user_cd):
+                for log in logs:
+                    if index.add(log["QALogCD"], log["SessionId"], log["QuestionText"], log["AnswerText"]):
+                        self._stats["archived_rows"] += 1
+        after = max(0, index.watermark - SYNC_OVERLAP_IDS)
+        for chunk in chat_db_service.iter_user_logs_since(user_cd, after):
+            for log in chunk:
+                if index.add(log["QALogCD"], log["SessionId"], log["QuestionText"], log["AnswerText"]):
+                    self._stats["synced_rows"] += 1
+            # Tiến watermark theo từng chunk: sync bị timeout giữa chừng vẫn giữ phần đã đọc
+            index.watermark = max(index.watermark, chunk[-1]["QALogCD"])
+        index.synced_at = time.monotonic()
+
+    def add(self, user_cd: int, qa_log_cd: int, session_id: str, question: Optional[str], answer: Optional[str]):
+        """Index log vừa ghi (bỏ qua nếu index của user chưa load - sẽ đọc từ DB khi build)"""
+        index = self._get(user_cd, create=False)
+        if index is None:
+            return
+        with index.lock:
+            if index.add(qa_log_cd, session_id, question, answer):
+                self._stats["pushed"] += 1
+
+    def search(self, user_cd: int, query: str, offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        """
+        Tìm trong các Q&A của user, xếp hạng BM25
+
+        Returns:
+            Dict chứa results (kèm snippet question / answer), total, has_more
+
+        Raises:
+            QueryTooShort khi query không có term nào tìm được
+        """
+        tokens, terms = query_terms(query)
+        if not tokens:
+            raise QueryTooShort("Query must contain at least 2 characters")
+
+        self._stats["searches"] += 1
+        index = self._get(user_cd, create=True)
+        with index.lock:
+            self._sync(user_cd, index)
+            ranked = index.rank(tokens)
+            page = ranked[offset:offset + limit]
+            sessions = {qa_log_cd: index.sessions.get(qa_log_cd) for _, qa_log_cd in page}
+
+        logs = chat_db_service.get_logs_by_ids(user_cd, list(sessions))
+        # Log không còn trong T_QA_Log (đã archive) -> đọc lại từ blob theo session
+        for session_id in {sessions[qa_log_cd] for qa_log_cd in sessions if qa_log_cd not in logs}:
+            if session_id is None:
+                continue
+            for log in qa_log_archive.load_turns(session_id):
+                if log["QALogCD"] in sessions and log["UserCD"] == user_cd:
+                    logs[log["QALogCD"]] = log
+        results = []
+        for score, qa_log_cd in page:
+            log = logs.get(qa_log_cd)
+            if log is None:
+                continue
+            results.append({
+                "qa_log_cd": qa_log_cd,
+                "session_id": log["SessionId"],
+                "turn_no": log["TurnNo"],
+                "timestamp": log["RegisteredAt"].isoformat() if log["RegisteredAt"] else None,
+                "score": round(score, 4),
+                "question": snippet(log["QuestionText"], terms, tokens),
+                "answer": snippet(log["AnswerText"], terms, tokens),
+            })
+
+        return {
+            "results": results,
+            "total": len(ranked),
+            "has_more": offset + limit < len(ranked),
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            indexes = list(self._users.values())
+        return {
+            **self._stats,
+            "users": len(indexes),
+            "documents": sum(len(i.lengths) for i in indexes),
+            "terms": sum(len(i.postings) for i in indexes),
+        }
+
+
+# Create singleton instance
+search_index = ConversationSearchIndex()
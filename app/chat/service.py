@@ -2,7 +2,20 @@ import json
 from typing import Dict, Any, List, Optional
 import logging
 import uuid
-from app.chat.chat_db_service import chat_db_service
+from datetime import datetime
+from app.chat.chat_db_service import chat_db_service, async_chat_db_service
+from app.chat.turn_allocator import turn_allocator
+from app.chat.pagination import InvalidCursor, clamp_limit, decode_cursor, encode_cursor
+from app.chat.search_index import search_index
+from app.chat.archive import qa_log_archive
+from app.config import (
+    CONVERSATIONS_PAGE_SIZE,
+    CONVERSATIONS_MAX_PAGE_SIZE,
+    HISTORY_MAX_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
+)
+from app.db.executor import db_executor
 
 logger = logging.getLogger(__name__)
 
@@ -10,22 +23,9 @@ logger = logging.getLogger(__name__)
 class ChatService:
     """Service xử lý chat và AI responses với database integration"""
 
-    def __init__(self):
-        # Track current turn number per session (in-memory cache)
-        self.session_turns: Dict[str, int] = {}
-
     def get_next_turn_no(self, session_id: str) -> int:
-        """Lấy turn number tiếp theo cho session"""
-        if session_id not in self.session_turns:
-            # Load from database
-            logs = chat_db_service.get_session_logs(session_id)
-            if logs:
-                self.session_turns[session_id] = max(log['TurnNo'] for log in logs)
-            else:
-                self.session_turns[session_id] = 0
-        
-        self.session_turns[session_id] += 1
-        return self.session_turns[session_id]
+        """Lấy turn number tiếp theo (đề xuất) cho session - xem TurnAllocator"""
+        return turn_allocator.allocate(session_id)
 
     async def process_chat_message(
         self,
@@ -47,9 +47,9 @@ class ChatService:
         try:
             if not session_id:
                 session_id = str(uuid.uuid4())
-                self.session_turns[session_id] = 0
+                turn_allocator.start_session(session_id)
             
-            turn_no = self.get_next_turn_no(session_id)
+            turn_no = await db_executor.run(self.get_next_turn_no, session_id)
             
             answer_text, pdf_details = self._generate_ai_response_with_pdf(question_text)
             
@@ -58,7 +58,7 @@ class ChatService:
                 "pdf_details": pdf_details
             }
             
-            result = chat_db_service.register_qa_log(
+            result = await async_chat_db_service.register_qa_log(
                 session_id=session_id,
                 turn_no=turn_no,
                 user_cd=user_cd,
@@ -74,6 +74,10 @@ class ChatService:
                     "session_id": session_id
                 }
             
+            # DB có thể đã cấp TurnNo khác (worker khác ghi trước)
+            turn_allocator.observe(session_id, turn_no, result["turn_no"])
+            turn_no = result["turn_no"]
+            
             # Format PDF info đơn giản
             has_pdf = len(pdf_details) > 0
             pdf_infos = []
@@ -164,7 +168,7 @@ class ChatService:
         
         return answer, pdf_details
 
-    def mark_session_resolved(self, qa_log_cd: int) -> Dict[str, Any]:
+    async def mark_session_resolved(self, qa_log_cd: int) -> Dict[str, Any]:
         """
         Đánh dấu session đã được giải quyết
         
@@ -175,7 +179,7 @@ class ChatService:
             Dict chứa success status
         """
         try:
-            result = chat_db_service.mark_resolved_qa(qa_log_cd)
+            result = await async_chat_db_service.mark_resolved_qa(qa_log_cd)
             return result
         except Exception as e:
             logger.error(f"Error marking session as resolved: {str(e)}")
@@ -184,23 +188,102 @@ class ChatService:
                 "error": str(e)
             }
 
-    def get_session_history(self, session_id: str) -> Dict[str, Any]:
+    async def _archived_turns(
+        self, session_id: str, user_cd: int, after_turn: Optional[int], before_turn: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        """Các turn đã archive của user (after_turn < TurnNo < before_turn, tăng dần)"""
+        logs = await qa_log_archive.load_turns_async(session_id, after_turn, before_turn)
+        return [log for log in logs if log["UserCD"] == user_cd]
+
+    async def get_session_history(
+        self,
+        session_id: str,
+        user_cd: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        since: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
         Lấy lịch sử chat của một session
         
         Args:
             session_id: UUID của session
+            user_cd: Chỉ trả các turn của user này
+            limit: Số turns mỗi trang (None + không có cursor/since = toàn bộ)
+            cursor: next_cursor trang trước -> các turn cũ hơn
+            since: sync_token lần trước -> chỉ các turn mới hơn; session được
+                   resolve lại (ResolvedTurnNo đổi) sau token -> mọi turn
+
+        Turn đã chuyển sang archive (app/chat/archive.py) được ghép vào khi
+        T_QA_Log không đủ để trả lời.
             
         Returns:
-            Dict chứa session logs
+            Dict chứa session logs (TurnNo tăng dần), next_cursor, sync_token
+
+        Raises:
+            InvalidCursor khi cursor / since sai format
         """
+        before = decode_cursor(cursor, "turn")
+        after = decode_cursor(since, "turn")
         try:
-            logs = chat_db_service.get_session_logs(session_id)
+            # ResolvedTurnNo đọc TRƯỚC turns: resolve xảy ra trong lúc đọc sẽ
+            # được trả lại ở lần sync sau
+            resolved = None
+            if before is None:
+                resolved = await async_chat_db_service.get_session_resolved_turn(session_id)
+            if after is not None and after.get("resolved", resolved) != resolved:
+                # Mark_Resolved_QA cập nhật ResolvedTurnNo của mọi turn trong session
+                after = {"turn": 0}
+
+            if limit is None and before is None and after is None:
+                logs = await async_chat_db_service.get_session_logs(session_id, user_cd)
+                logs = await self._archived_turns(
+                    session_id, user_cd, None, logs[0]["TurnNo"] if logs else None
+                ) + logs
+                has_more = False
+            else:
+                page_size = clamp_limit(limit, HISTORY_MAX_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+                logs = await async_chat_db_service.get_session_turns(
+                    session_id,
+                    page_size + 1,
+                    before_turn=before["turn"] if before else None,
+                    after_turn=after["turn"] if after else None,
+                    user_cd=user_cd,
+                )
+                # Hot table hết trước khi đủ trang: các turn cũ hơn có thể đã archive
+                if len(logs) <= page_size:
+                    lowest = min((log["TurnNo"] for log in logs), default=None)
+                    if after is not None:
+                        logs = await self._archived_turns(session_id, user_cd, after["turn"], lowest) + logs
+                    else:
+                        bound = lowest if lowest is not None else (before["turn"] if before else None)
+                        archived = await self._archived_turns(session_id, user_cd, None, bound)
+                        logs = logs + archived[::-1]
+                has_more = len(logs) > page_size
+                logs = logs[:page_size]
+                if after is None:
+                    logs.reverse()
+
+            # sync_token = TurnNo mới nhất client đang có (trang cũ hơn thì không có)
+            if after is not None:
+                last_turn = logs[-1]["TurnNo"] if logs else after["turn"]
+            elif before is None:
+                last_turn = logs[-1]["TurnNo"] if logs else 0
+            else:
+                last_turn = None
+
             return {
                 "success": True,
                 "session_id": session_id,
                 "logs": logs,
-                "total_turns": len(logs)
+                "total_turns": len(logs),
+                "has_more": has_more,
+                "next_cursor": (
+                    encode_cursor({"turn": logs[0]["TurnNo"]}) if has_more and after is None else None
+                ),
+                "sync_token": (
+                    encode_cursor({"turn": last_turn, "resolved": resolved}) if last_turn is not None else None
+                ),
             }
         except Exception as e:
             logger.error(f"Error getting session history: {str(e)}")
@@ -210,24 +293,76 @@ class ChatService:
                 "logs": []
             }
 
-    def get_user_sessions(self, user_cd: int, limit: int = 50) -> Dict[str, Any]:
+    async def get_user_sessions(
+        self,
+        user_cd: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        since: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
-        Lấy danh sách sessions của user
+        Lấy danh sách sessions của user (mới nhất trước)
         
         Args:
             user_cd: Mã người dùng
-            limit: Số lượng sessions tối đa
+            limit: Số lượng sessions mỗi trang
+            cursor: next_cursor trang trước -> các session cũ hơn
+            since: sync_token lần trước -> chỉ các session đã thay đổi
             
         Returns:
-            Dict chứa danh sách sessions
+            Dict chứa danh sách sessions, next_cursor, sync_token
+
+        Raises:
+            InvalidCursor khi cursor / since sai format
         """
+        before = decode_cursor(cursor, "t", "id")
+        after = decode_cursor(since, "v")
+        page_size = clamp_limit(limit, CONVERSATIONS_PAGE_SIZE, CONVERSATIONS_MAX_PAGE_SIZE)
         try:
-            sessions = chat_db_service.get_user_sessions(user_cd, limit)
+            keyset = None
+            if before is not None:
+                try:
+                    keyset = (datetime.fromisoformat(before["t"]), before["id"])
+                except (TypeError, ValueError) as e:
+                    raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+            sessions = await async_chat_db_service.get_user_sessions(
+                user_cd,
+                page_size + 1,
+                before=keyset,
+                since=after["v"] if after else None,
+            )
+            has_more = len(sessions) > page_size
+            sessions = sessions[:page_size]
+
+            next_cursor = None
+            if has_more and after is None:
+                last = sessions[-1]
+                next_cursor = encode_cursor({"t": last["LastMessageAt"].isoformat(), "id": last["SessionId"]})
+
+            # Delta còn trang sau: sync tiếp từ RowVer cuối; hết: từ SyncVersion của lần đọc
+            if after is not None:
+                if not sessions:
+                    version = after["v"]
+                elif has_more:
+                    version = sessions[-1]["RowVer"]
+                else:
+                    version = sessions[-1]["SyncVersion"]
+            elif before is None:
+                version = sessions[0]["SyncVersion"] if sessions else 0
+            else:
+                version = None
+
             return {
                 "success": True,
                 "sessions": sessions,
-                "total": len(sessions)
+                "total": len(sessions),
+                "has_more": has_more,
+                "next_cursor": next_cursor,
+                "sync_token": encode_cursor({"v": version}) if version is not None else None,
             }
+        except InvalidCursor:
+            raise
         except Exception as e:
             logger.error(f"Error getting user sessions: {str(e)}")
             return {
@@ -236,6 +371,42 @@ class ChatService:
                 "sessions": []
             }
 
+    async def search_conversations(
+        self,
+        user_cd: int,
+        query: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Tìm trong lịch sử Q&A của user (search_index), kết quả xếp hạng theo độ liên quan
+
+        Args:
+            user_cd: Mã người dùng
+            query: Chuỗi tìm kiếm
+            limit: Số kết quả mỗi trang
+            cursor: next_cursor trang trước
+
+        Returns:
+            Dict chứa results, total, has_more, next_cursor
+
+        Raises:
+            InvalidCursor khi cursor sai format
+            QueryTooShort khi query không có term nào tìm được
+        """
+        page = decode_cursor(cursor, "o")
+        offset = page["o"] if page else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+        page_size = clamp_limit(limit, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+
+        result = await db_executor.run(search_index.search, user_cd, query, offset, page_size)
+        return {
+            "success": True,
+            **result,
+            "next_cursor": encode_cursor({"o": offset + page_size}) if result["has_more"] else None,
+        }
+
     def _generate_ai_response(self, question: str) -> str:
         """Mock AI response - thay thế bằng actual AI call"""
         question_lower = question.lower()
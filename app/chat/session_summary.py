@@ -0,0 +1,300 @@
+"""
+T_QA_Session: bảng summary một dòng / session cho sidebar (/api/conversations)
+
+Được cập nhật trong cùng transaction với Register_QA_Log / Mark_Resolved_QA
+(ChatDBService), nên đọc danh sách session không cần GROUP BY trên T_QA_Log.
+
+Tạo bảng + backfill từ T_QA_Log:
+
+    python -m app.chat.session_summary --create-table
+    python -m app.chat.session_summary --user-cd 123
+"""
+
+import argparse
+import logging
+from typing import List, Optional
+
+from app.db.connection import db_connection
+
+logger = logging.getLogger(__name__)
+
+CREATE_SESSION_TABLE_SQL = """
+    IF OBJECT_ID(N'dbo.T_QA_Session', N'U') IS NULL
+    BEGIN
+        CREATE TABLE dbo.T_QA_Session (
+            SessionId       VARCHAR(36)    NOT NULL PRIMARY KEY,
+            UserCD          BIGINT         NOT NULL,
+            FirstTurnNo     INT            NOT NULL,
+            FirstQuestion   NVARCHAR(200)  NULL,
+            FirstMessageAt  DATETIME       NOT NULL,
+            LastMessageAt   DATETIME       NOT NULL,
+            TurnCount       INT            NOT NULL,
+            LastTurnNo      INT            NOT NULL,
+            ResolvedTurnNo  INT            NULL,
+            RowVer          ROWVERSION     NOT NULL
+        );
+
+        CREATE INDEX IX_T_QA_Session_UserCD_LastMessageAt
+            ON dbo.T_QA_Session (UserCD, LastMessageAt DESC)
+            INCLUDE (FirstQuestion, FirstMessageAt, TurnCount, LastTurnNo, ResolvedTurnNo);
+    END
+
+    -- RowVer: marker cho delta sync (?since=), thêm vào bảng đã tạo trước đó
+    IF COL_LENGTH(N'dbo.T_QA_Session', N'RowVer') IS NULL
+        EXEC (N'ALTER TABLE dbo.T_QA_Session ADD RowVer ROWVERSION NOT NULL');
+
+    IF NOT EXISTS (
+        SELECT 1 FROM sys.indexes
+        WHERE name = N'IX_T_QA_Session_UserCD_RowVer' AND object_id = OBJECT_ID(N'dbo.T_QA_Session')
+    )
+        EXEC (N'CREATE INDEX IX_T_QA_Session_UserCD_RowVer ON dbo.T_QA_Session (UserCD, RowVer)');
+"""
+
+# Chạy ngay sau Register_QA_Log thành công, cùng transaction
+SESSION_ON_REGISTER_SQL = """
+    DECLARE @SessionId VARCHAR(36) = ?;
+    DECLARE @UserCD BIGINT = ?;
+    DECLARE @TurnNo INT = ?;
+    DECLARE @Question NVARCHAR(200) = LEFT(?, 200);
+
+    UPDATE dbo.T_QA_Session WITH (UPDLOCK, SERIALIZABLE)
+    SET
+        LastMessageAt = GETDATE(),
+        TurnCount = TurnCount + 1,
+        LastTurnNo = CASE WHEN @TurnNo > LastTurnNo THEN @TurnNo ELSE LastTurnNo END,
+        FirstQuestion = CASE WHEN @TurnNo < FirstTurnNo THEN @Question ELSE FirstQuestion END,
+        FirstTurnNo = CASE WHEN @TurnNo < FirstTurnNo THEN @TurnNo ELSE FirstTurnNo END
+    WHERE SessionId = @SessionId;
+
+    IF @@ROWCOUNT = 0
+        INSERT INTO dbo.T_QA_Session
+            (SessionId, UserCD, FirstTurnNo, FirstQuestion, FirstMessageAt, LastMessageAt, TurnCount, LastTurnNo)
+        VALUES
+            (@SessionId, @UserCD, @TurnNo, @Question, GETDATE(), GETDATE(), 1, @TurnNo);
+"""
+
+# Bản set-based của SESSION_ON_REGISTER_SQL cho bulk ingestion: cập nhật
+# summary từ các dòng ErrCD = 0 trong #QA_Log_Bulk (ChatDBService.register_qa_log_bulk)
+SESSION_ON_BULK_REGISTER_SQL = """
+    WITH ok AS (
+        SELECT
+            SessionId, UserCD, TurnNo, QuestionText,
+            ROW_NUMBER() OVER (PARTITION BY SessionId ORDER BY TurnNo ASC) AS rn,
+            COUNT(*) OVER (PARTITION BY SessionId) AS Cnt,
+            MAX(TurnNo) OVER (PARTITION BY SessionId) AS MaxTurnNo
+        FROM #QA_Log_Bulk
+        WHERE ErrCD = 0
+    )
+    MERGE dbo.T_QA_Session WITH (HOLDLOCK) AS s
+    USING (
+        SELECT SessionId, UserCD, TurnNo AS FirstTurnNo, LEFT(QuestionText, 200) AS FirstQuestion, Cnt, MaxTurnNo
+        FROM ok
+        WHERE rn = 1
+    ) AS src
+    ON s.SessionId = src.SessionId
+    WHEN MATCHED THEN UPDATE SET
+        LastMessageAt = GETDATE(),
+        TurnCount = s.TurnCount + src.Cnt,
+        LastTurnNo = CASE WHEN src.MaxTurnNo > s.LastTurnNo THEN src.MaxTurnNo ELSE s.LastTurnNo END,
+        FirstQuestion = CASE WHEN src.FirstTurnNo < s.FirstTurnNo THEN src.FirstQuestion ELSE s.FirstQuestion END,
+        FirstTurnNo = CASE WHEN src.FirstTurnNo < s.FirstTurnNo THEN src.FirstTurnNo ELSE s.FirstTurnNo END
+    WHEN NOT MATCHED THEN INSERT
+        (SessionId, UserCD, FirstTurnNo, FirstQuestion, FirstMessageAt, LastMessageAt, TurnCount, LastTurnNo)
+        VALUES
+        (src.SessionId, src.UserCD, src.FirstTurnNo, src.FirstQuestion, GETDATE(), GETDATE(), src.Cnt, src.MaxTurnNo);
+"""
+
+# Chạy ngay sau Mark_Resolved_QA thành công, cùng transaction
+SESSION_ON_RESOLVED_SQL = """
+    UPDATE s
+    SET s.ResolvedTurnNo = l.TurnNo
+    OUTPUT inserted.SessionId, inserted.UserCD
+    FROM dbo.T_QA_Session s
+    JOIN dbo.T_QA_Log l ON l.SessionId = s.SessionId
+    WHERE l.QALogCD = ?;
+"""
+
+# Danh sách session theo keyset (LastMessageAt DESC, SessionId DESC).
+# SyncVersion chụp trước khi đọc: mọi thay đổi sau đó có RowVer > SyncVersion.
+_SESSION_COLUMNS = """
+        SessionId,
+        FirstMessageAt,
+        LastMessageAt,
+        TurnCount AS MessageCount,
+        LastTurnNo,
+        ResolvedTurnNo,
+        FirstQuestion,
+        CAST(RowVer AS BIGINT) AS RowVer,
+        @SyncVersion AS SyncVersion
+"""
+
+USER_SESSIONS_SQL = f"""
+    DECLARE @SyncVersion BIGINT = CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1;
+    DECLARE @Limit INT = ?;
+    DECLARE @UserCD BIGINT = ?;
+
+    SELECT TOP (@Limit) {_SESSION_COLUMNS}
+    FROM dbo.T_QA_Session
+    WHERE UserCD = @UserCD
+    ORDER BY LastMessageAt DESC, SessionId DESC
+"""
+
+USER_SESSIONS_BEFORE_SQL = f"""
+    DECLARE @SyncVersion BIGINT = CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1;
+    DECLARE @Limit INT = ?;
+    DECLARE @UserCD BIGINT = ?;
+    -- Ép về DATETIME để so sánh bằng đúng với giá trị đã lưu
+    DECLARE @BeforeAt DATETIME = ?;
+    DECLARE @BeforeId VARCHAR(36) = ?;
+
+    SELECT TOP (@Limit) {_SESSION_COLUMNS}
+    FROM dbo.T_QA_Session
+    WHERE UserCD = @UserCD
+      AND (LastMessageAt < @BeforeAt OR (LastMessageAt = @BeforeAt AND SessionId < @BeforeId))
+    ORDER BY LastMessageAt DESC, SessionId DESC
+"""
+
+# Delta sync: session thay đổi sau RowVer `since`, theo thứ tự RowVer.
+# Chỉ trả RowVer < MIN_ACTIVE_ROWVERSION() để không bỏ sót transaction chưa commit.
+USER_SESSIONS_SINCE_SQL = f"""
+    DECLARE @SyncVersion BIGINT = CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1;
+    DECLARE @Limit INT = ?;
+    DECLARE @UserCD BIGINT = ?;
+    DECLARE @Since BIGINT = ?;
+
+    SELECT TOP (@Limit) {_SESSION_COLUMNS}
+    FROM dbo.T_QA_Session
+    WHERE UserCD = @UserCD
+      AND RowVer > CAST(@Since AS BINARY(8))
+      AND CAST(RowVer AS BIGINT) <= @SyncVersion
+    ORDER BY RowVer ASC
+"""
+
+# Version stamp cho ETag (response_cache): RowVer lớn nhất của user / RowVer của session
+USER_SESSIONS_VERSION_SQL = """
+    SELECT CAST(MAX(RowVer) AS BIGINT) AS Version
+    FROM dbo.T_QA_Session
+    WHERE UserCD = ?
+"""
+
+SESSION_VERSION_SQL = """
+    SELECT CAST(RowVer AS BIGINT) AS Version
+    FROM dbo.T_QA_Session
+    WHERE SessionId = ? AND UserCD = ?
+"""
+
+# ResolvedTurnNo hiện tại của session cho delta sync history (sync_token).
+# Session chưa backfill (không có dòng summary) -> lấy từ T_QA_Log.
+SESSION_RESOLVED_TURN_SQL = """
+    DECLARE @SessionId VARCHAR(36) = ?;
+
+    SELECT COALESCE(
+        (SELECT ResolvedTurnNo FROM dbo.T_QA_Session WHERE SessionId = @SessionId),
+        (SELECT MAX(ResolvedTurnNo) FROM dbo.T_QA_Log WHERE SessionId = @SessionId)
+    ) AS ResolvedTurnNo
+"""
+
+# Dựng lại summary của một user từ T_QA_Log (idempotent)
+BACKFILL_USER_SQL = """
+    DECLARE @UserCD BIGINT = ?;
+
+    WITH ranked AS (
+        SELECT
+            SessionId, UserCD, TurnNo, QuestionText, RegisteredAt, ResolvedTurnNo,
+            ROW_NUMBER() OVER (PARTITION BY SessionId ORDER BY TurnNo ASC) AS rn
+        FROM dbo.T_QA_Log
+        WHERE UserCD = @UserCD
+    ),
+    agg AS (
+        SELECT
+            SessionId,
+            MIN(RegisteredAt) AS FirstMessageAt,
+            MAX(RegisteredAt) AS LastMessageAt,
+            COUNT(*) AS TurnCount,
+            MAX(TurnNo) AS LastTurnNo,
+            MAX(ResolvedTurnNo) AS ResolvedTurnNo
+        FROM ranked
+        GROUP BY SessionId
+    )
+    MERGE dbo.T_QA_Session WITH (HOLDLOCK) AS s
+    USING (
+        SELECT
+            a.SessionId, f.UserCD, f.TurnNo AS FirstTurnNo,
+            LEFT(f.QuestionText, 200) AS FirstQuestion,
+            a.FirstMessageAt, a.LastMessageAt, a.TurnCount, a.LastTurnNo, a.ResolvedTurnNo
+        FROM agg a
+        JOIN ranked f ON f.SessionId = a.SessionId AND f.rn = 1
+    ) AS src
+    ON s.SessionId = src.SessionId
+    WHEN MATCHED THEN UPDATE SET
+        UserCD = src.UserCD,
+        FirstTurnNo = src.FirstTurnNo,
+        FirstQuestion = src.FirstQuestion,
+        FirstMessageAt = src.FirstMessageAt,
+        LastMessageAt = src.LastMessageAt,
+        TurnCount = src.TurnCount,
+        LastTurnNo = src.LastTurnNo,
+        ResolvedTurnNo = src.ResolvedTurnNo
+    WHEN NOT MATCHED THEN INSERT
+        (SessionId, UserCD, FirstTurnNo, FirstQuestion, FirstMessageAt, LastMessageAt, TurnCount, LastTurnNo, ResolvedTurnNo)
+        VALUES
+        (src.SessionId, src.UserCD, src.FirstTurnNo, src.FirstQuestion, src.FirstMessageAt,
+         src.LastMessageAt, src.TurnCount, src.LastTurnNo, src.ResolvedTurnNo);
+
+    SELECT @@ROWCOUNT AS Affected;
+"""
+
+
+def create_table():
+    with db_connection() as conn:
+        conn.cursor().execute(CREATE_SESSION_TABLE_SQL)
+        conn.commit()
+    logger.info("T_QA_Session is ready")
+
+
+def backfill(user_cds: Optional[List[int]] = None) -> int:
+    """
+    Backfill T_QA_Session từ T_QA_Log, mỗi user một transaction
+
+    Args:
+        user_cds: chỉ backfill các user này (None = mọi user có trong T_QA_Log)
+
+    Returns:
+        Số session đã ghi
+    """
+    if user_cds is None:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT UserCD FROM dbo.T_QA_Log")
+            user_cds = [row[0] for row in cursor.fetchall()]
+
+    total = 0
+    for i, user_cd in enumerate(user_cds, 1):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            row = cursor.execute(BACKFILL_USER_SQL, (user_cd,)).fetchone()
+            conn.commit()
+        affected = row.Affected if row else 0
+        total += affected
+        logger.info(f"Backfilled T_QA_Session: user_cd={user_cd}, sessions={affected} ({i}/{len(user_cds)})")
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create / backfill T_QA_Session from T_QA_Log")
+    parser.add_argument("--create-table", action="store_true", help="create T_QA_Session if missing")
+    parser.add_argument("--user-cd", type=int, action="append", help="only backfill this user (repeatable)")
+    parser.add_argument("--skip-backfill", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    if args.create_table:
+        create_table()
+    if not args.skip_backfill:
+        total = backfill(args.user_cd)
+        logger.info(f"Backfill done: sessions={total}")
+
+
+if __name__ == "__main__":
+    main()
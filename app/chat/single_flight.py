@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from app.chat.replay import ReplayBuffer
+from app.config import CHAT_SINGLE_FLIGHT_ENABLED
+
+logger = logging.getLogger(__name__)
+
+
+class InflightStream:
+    """
+    Một upstream stream đang chạy, fan-out cho nhiều subscriber
+
+    Producer task đọc `source` và append event vào ReplayBuffer; mỗi subscriber
+    đọc lại từ đầu rồi chờ event mới. Khi subscriber cuối cùng detach trước
+    khi stream xong thì upstream bị cancel.
+    """
+
+    def __init__(self, key: str, source: AsyncIterator[Dict[str, Any]]):
+        self.key = key
+        self.buffer = ReplayBuffer()
+
+        self._subscribers = 0
+        self._done_callbacks: List[Callable[[], None]] = []
+        self._task = asyncio.create_task(self._pump(source))
+        # Dùng done callback thay vì finally: task bị cancel trước khi chạy
+        # thì coroutine không bao giờ vào finally
+        self._task.add_done_callback(self._on_task_done)
+
+    @property
+    def done(self) -> bool:
+        return self.buffer.done
+
+    async def _pump(self, source: AsyncIterator[Dict[str, Any]]):
+        async for event in source:
+            # Heartbeat do reader phía client tự phát
+            if event.get("type") == "heartbeat":
+                continue
+            self.buffer.append(event)
+
+    def _on_task_done(self, task: asyncio.Task):
+        if task.cancelled():
+            error = asyncio.CancelledError()
+        else:
+            error = task.exception()
+            if error is not None:
+                logger.error(f"Upstream stream failed: {str(error)}")
+        self.buffer.close(error)
+        for callback in self._done_callbacks:
+            callback()
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        if self.done:
+            callback()
+        else:
+            self._done_callbacks.append(callback)
+
+    def attach(self) -> "Subscription":
+        self._subscribers += 1
+        return Subscription(self)
+
+    def detach(self):
+        self._subscribers -= 1
+        if self._subscribers <= 0 and not self.done:
+            logger.info("No subscribers left, cancelling upstream stream")
+            self._task.cancel()
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+
+class Subscription:
+    """Một subscriber của InflightStream; stop() / close() idempotent"""
+
+    def __init__(self, inflight: InflightStream):
+        self.inflight = inflight
+        self.stopped = asyncio.Event()
+        self.stop_reason: Optional[str] = None
+        self._closed = False
+
+    def events(self, offset: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        return self.inflight.buffer.read(offset, stop=self.stopped)
+
+    def stop(self, reason: str):
+        """Dừng nhận event (stop endpoint / client disconnect) và detach ngay"""
+        if self.stop_reason is None:
+            self.stop_reason = reason
+        self.stopped.set()
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.inflight.detach()
+
+
+class SingleFlight:
+    """Registry các InflightStream theo key (câu hỏi normalize + history hash)"""
+
+    def __init__(self, enabled: bool = CHAT_SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._inflight: Dict[str, InflightStream] = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def join(self, key: str) -> Optional[InflightStream]:
+        """Trả stream đang chạy cho key (nếu có) để attach vào"""
+        if not self.enabled:
+            return None
+        inflight = self._inflight.get(key)
+        if inflight is None or inflight.done:
+            return None
+        self._stats["followers"] += 1
+        return inflight
+
+    def start(self, key: str, source: AsyncIterator[Dict[str, Any]]) -> InflightStream:
+        inflight = InflightStream(key, source)
+        self._stats["leaders"] += 1
+        if self.enabled:
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda: self._forget(key, inflight))
+        return inflight
+
+    def _forget(self, key: str, inflight: InflightStream):
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "inflight": len(self._inflight)}
+
+
+# Create singleton instance
+single_flight = SingleFlight()
@@ -0,0 +1,23 @@
+from typing import Callable, List
+
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class ChatStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse chạy các callback `on_close` khi response kết thúc,
+    kể cả khi client ngắt kết nối trước khi body generator được bắt đầu
+    (trường hợp đó `finally` trong generator không bao giờ chạy)
+    """
+
+    def __init__(self, *args, on_close: List[Callable[[], None]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close or []
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            for callback in self.on_close:
+                callback()
@@ -0,0 +1,137 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+from app.config import ARCHIVE_ENABLED, TURN_HINT_CACHE_SIZE
+from app.db.connection import db_connection
+
+logger = logging.getLogger(__name__)
+
+MAX_TURN_NO_SQL = """
+    SELECT ISNULL(MAX(TurnNo), 0) AS MaxTurnNo
+    FROM T_QA_Log
+    WHERE SessionId = ?
+"""
+
+# Bật archive (app/chat/archive.py): turn của session có thể đã chuyển sang T_QA_Archive
+MAX_TURN_NO_WITH_ARCHIVE_SQL = """
+    SELECT ISNULL(MAX(TurnNo), 0) AS MaxTurnNo
+    FROM (
+        SELECT MAX(TurnNo) AS TurnNo FROM T_QA_Log WHERE SessionId = ?
+        UNION ALL
+        SELECT MAX(LastTurnNo) FROM T_QA_Archive WHERE SessionId = ?
+    ) t
+"""
+
+
+class _SessionLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class TurnAllocator:
+    """
+    Cấp TurnNo cho turn mới của một conversation
+
+    TurnNo cấp ở đây chỉ là đề xuất: REGISTER_QA_LOG_SQL kiểm tra lại trong
+    transaction (UPDLOCK, HOLDLOCK trên các TurnNo >= đề xuất) và cấp
+    MAX(TurnNo) + 1 nếu số này đã bị worker khác dùng, nên không thể trùng
+    TurnNo kể cả khi chạy nhiều uvicorn worker.
+
+    - Hint cache: LRU có giới hạn session_id -> TurnNo lớn nhất đã biết; miss
+      thì chỉ đọc MAX(TurnNo) (index seek, không đọc nvarchar(max))
+    - Các lần cấp trong cùng conversation được serialize bằng lock riêng
+      của session (chỉ tồn tại khi có người đang dùng)
+    """
+
+    def __init__(self, max_entries: int = TURN_HINT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._hints: "OrderedDict[str, int]" = OrderedDict()
+        self._session_locks: Dict[str, _SessionLock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"allocated": 0, "hint_hits": 0, "db_loads": 0, "corrections": 0}
+
+    def _remember(self, session_id: str, turn_no: int):
+        # Gọi khi đang giữ self._lock
+        if turn_no >= self._hints.get(session_id, 0):
+            self._hints[session_id] = turn_no
+        self._hints.move_to_end(session_id)
+        while len(self._hints) > self.max_entries:
+            self._hints.popitem(last=False)
+
+    def _acquire_session(self, session_id: str) -> _SessionLock:
+        with self._lock:
+            entry = self._session_locks.get(session_id)
+            if entry is None:
+                entry = self._session_locks[session_id] = _SessionLock()
+            entry.users += 1
+        entry.lock.acquire()
+        return entry
+
+    def _release_session(self, session_id: str, entry: _SessionLock):
+        entry.lock.release()
+        with self._lock:
+            entry.users -= 1
+            if entry.users == 0:
+                self._session_locks.pop(session_id, None)
+
+    @staticmethod
+    def _load_max_turn_no(session_id: str) -> int:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            if ARCHIVE_ENABLED:
+                row = cursor.execute(MAX_TURN_NO_WITH_ARCHIVE_SQL, (session_id, session_id)).fetchone()
+            else:
+                row = cursor.execute(MAX_TURN_NO_SQL, (session_id,)).fetchone()
+            return row.MaxTurnNo if row else 0
+
+    def start_session(self, session_id: str):
+        """Conversation mới tạo: chưa có turn nào, không cần đọc DB"""
+        with self._lock:
+            self._remember(session_id, 0)
+
+    def allocate(self, session_id: str) -> int:
+        """
+        Đề xuất TurnNo tiếp theo (blocking - gọi trên DB executor thread)
+        """
+        entry = self._acquire_session(session_id)
+        try:
+            with self._lock:
+                last = self._hints.get(session_id)
+            if last is None:
+                last = self._load_max_turn_no(session_id)
+                self._stats["db_loads"] += 1
+            else:
+                self._stats["hint_hits"] += 1
+
+            turn_no = last + 1
+            with self._lock:
+                self._remember(session_id, turn_no)
+            self._stats["allocated"] += 1
+            return turn_no
+        finally:
+            self._release_session(session_id, entry)
+
+    def observe(self, session_id: str, proposed: int, actual: int):
+        """Cập nhật hint theo TurnNo thực sự đã ghi (DB có thể đã cấp lại)"""
+        if proposed is not None and actual != proposed:
+            self._stats["corrections"] += 1
+            logger.info(f"TurnNo reallocated by DB: session={session_id}, proposed={proposed}, actual={actual}")
+        with self._lock:
+            self._remember(session_id, actual)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "hints": len(self._hints),
+                "locked_sessions": len(self._session_locks),
+            }
+
+
+# Create singleton instance
+turn_allocator = TurnAllocator()
@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from app import codec
+from app.config import (
+    CHAT_API_URL,
+    CHAT_API_URLS,
+    CHAT_API_VERIFY_SSL,
+    CHAT_API_HTTP2,
+    CHAT_API_MAX_CONNECTIONS,
+    CHAT_API_MAX_KEEPALIVE,
+    CHAT_API_KEEPALIVE_EXPIRY,
+    CHAT_API_CONNECT_TIMEOUT,
+    CHAT_API_READ_TIMEOUT,
+    CHAT_API_WRITE_TIMEOUT,
+    CHAT_API_POOL_TIMEOUT,
+    CHAT_API_PREWARM,
+    CHAT_API_MAX_ATTEMPTS,
+    CHAT_API_FIRST_TOKEN_TIMEOUT,
+    CHAT_API_SLOW_FIRST_TOKEN_SECONDS,
+    CHAT_API_HEALTH_INTERVAL,
+    CHAT_API_HEALTH_TIMEOUT,
+    CHAT_BREAKER_FAILURE_THRESHOLD,
+    CHAT_BREAKER_OPEN_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_endpoints(spec: str, default_url: Optional[str] = None) -> List["UpstreamEndpoint"]:
+    """
+    Parse CHAT_API_URLS dạng "url|weight,url|weight" (weight mặc định 1)
+
+    Không cấu hình thì dùng `default_url` (CHAT_API_URL) với weight 1.
+    """
+    endpoints = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        try:
+            w = float(weight) if weight.strip() else 1.0
+        except ValueError:
+            logger.warning(f"Invalid upstream weight, using 1: {item}")
+            w = 1.0
+        if w > 0:
+            endpoints.append(UpstreamEndpoint(url.strip(), w))
+
+    if not endpoints and default_url:
+        endpoints.append(UpstreamEndpoint(default_url, 1.0))
+    return endpoints
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho một endpoint: closed -> open -> half_open -> closed
+
+    - closed: cho qua; `failure_threshold` lỗi liên tiếp thì open
+    - open: chặn trong `open_seconds`, sau đó half_open
+    - half_open: cho đúng một request thử; thành công -> closed, lỗi -> open lại
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CHAT_BREAKER_FAILURE_THRESHOLD,
+        open_seconds: float = CHAT_BREAKER_OPEN_SECONDS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def _refresh(self):
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+    def can_pass(self) -> bool:
+        self._refresh()
+        if self.state == self.CLOSED:
+            return True
+        return self.state == self.HALF_OPEN and not self._trial_in_flight
+
+    def on_acquire(self):
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+
+    def on_release(self):
+        # Request thử bị cancel (client stop) mà chưa có kết quả -> cho thử lại
+        self._trial_in_flight = False
+
+    def on_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def on_failure(self) -> bool:
+        """Ghi nhận lỗi; trả True nếu breaker vừa chuyển sang open"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            tripped = self.state != self.OPEN
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+            return tripped
+        return False
+
+
+class UpstreamEndpoint:
+    """Một upstream chat API: weight, số stream đang chạy, health và breaker"""
+
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.in_flight = 0
+        self.healthy = True
+        self.breaker = CircuitBreaker()
+        self.first_token_ms: Optional[float] = None
+        self._stats = {"requests": 0, "failures": 0, "slow": 0}
+
+    @property
+    def load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+    def acquire(self):
+        self.breaker.on_acquire()
+        self.in_flight += 1
+        self._stats["requests"] += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.breaker.on_release()
+
+    def record_success(self, first_token_s: float):
+        self.breaker.on_success()
+        ms = first_token_s * 1000
+        # EWMA latency tới token đầu (chỉ để quan sát)
+        self.first_token_ms = ms if self.first_token_ms is None else 0.8 * self.first_token_ms + 0.2 * ms
+
+    def record_slow(self, first_token_s: float):
+        self._stats["slow"] += 1
+        self.record_failure(f"slow first token {first_token_s:.1f}s")
+
+    def record_failure(self, reason: str):
+        self._stats["failures"] += 1
+        if self.breaker.on_failure():
+            logger.warning(f"Upstream circuit opened: url={self.url}, reason={reason}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "first_token_ms": round(self.first_token_ms, 1) if self.first_token_ms is not None else None,
+            **self._stats,
+        }
+
+
+class UpstreamClientPool:
+    """
+    App-scoped httpx client pool + router cho các upstream chat API
+
+    Mỗi request chọn endpoint có load (in_flight / weight) thấp nhất trong số
+    endpoint healthy và breaker cho qua. Lỗi trước token đầu tiên (connect,
+    5xx, quá CHAT_API_FIRST_TOKEN_TIMEOUT) được retry trên endpoint khác;
+    sau token đầu thì không retry vì client đã nhận một phần câu trả lời.
+    """
+
+    def __init__(self, endpoints: Optional[List[UpstreamEndpoint]] = None):
+        self.endpoints = endpoints if endpoints is not None else parse_endpoints(CHAT_API_URLS, CHAT_API_URL)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._stats = {"retries": 0, "unavailable": 0}
+
+    def _http2_available(self) -> bool:
+        if not CHAT_API_HTTP2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("CHAT_API_HTTP2=1 but package 'h2' is not installed, using HTTP/1.1")
+            return False
+        return True
+
+    async def startup(self):
+        """Tạo client khi app start, pre-warm connections và chạy health check"""
+        if self._client is not None:
+            return
+
+        http2 = self._http2_available()
+        self._client = httpx.AsyncClient(
+            # read = khoảng lặng tối đa giữa hai chunk, không phải tổng thời gian stream
+            timeout=httpx.Timeout(
+                connect=CHAT_API_CONNECT_TIMEOUT,
+                read=CHAT_API_READ_TIMEOUT,
+                write=CHAT_API_WRITE_TIMEOUT,
+                pool=CHAT_API_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=CHAT_API_MAX_CONNECTIONS,
+                max_keepalive_connections=CHAT_API_MAX_KEEPALIVE,
+                keepalive_expiry=CHAT_API_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+            verify=CHAT_API_VERIFY_SSL,
+        )
+        logger.info(
+            f"Upstream client pool started: endpoints={[e.url for e in self.endpoints]}, "
+            f"max_connections={CHAT_API_MAX_CONNECTIONS}, keepalive={CHAT_API_MAX_KEEPALIVE}, http2={http2}"
+        )
+
+        await self.prewarm(CHAT_API_PREWARM)
+        if CHAT_API_HEALTH_INTERVAL > 0 and self.endpoints:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def prewarm(self, count: int):
+        """Mở trước `count` connections (TCP + TLS) tới mỗi endpoint"""
+        if count <= 0 or self._client is None:
+            return
+
+        async def _touch(endpoint: UpstreamEndpoint):
+            try:
+                await self._client.head(endpoint.url)
+            except Exception as e:
+                logger.warning(f"Upstream pre-warm failed: url={endpoint.url}, {str(e)}")
+
+        await asyncio.gather(*(_touch(e) for e in self.endpoints for _ in range(count)))
+
+    async def _check(self, endpoint: UpstreamEndpoint):
+        try:
+            res = await self._client.head(endpoint.url, timeout=CHAT_API_HEALTH_TIMEOUT)
+            # HEAD lên endpoint POST có thể trả 405 -> server vẫn sống
+            healthy = res.status_code < 500
+        except Exception:
+            healthy = False
+
+        if healthy != endpoint.healthy:
+            logger.warning(f"Upstream health changed: url={endpoint.url}, healthy={healthy}")
+        endpoint.healthy = healthy
+
+    async def _health_loop(self):
+        """Active health check định kỳ cho mọi endpoint"""
+        while True:
+            await asyncio.sleep(CHAT_API_HEALTH_INTERVAL)
+            await asyncio.gather(*(self._check(e) for e in self.endpoints))
+
+    async def shutdown(self):
+        """Dừng health check và đóng client khi app shutdown"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logger.info("Upstream client pool closed")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Upstream client pool is not started")
+        return self._client
+
+    def pick(self, exclude: Optional[List[UpstreamEndpoint]] = None) -> Optional[UpstreamEndpoint]:
+        """Endpoint load thấp nhất (weighted least-loaded), bỏ qua `exclude`"""
+        exclude = exclude or []
+        candidates = [e for e in self.endpoints if e not in exclude and e.breaker.can_pass()]
+        healthy = [e for e in candidates if e.healthy]
+        # Health check có thể sai (HEAD bị chặn...) -> vẫn thử nếu breaker cho qua
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.load, random.random()))
+
+    async def stream_events(
+        self, body: Dict[str, Any], headers: Dict[str, str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        POST `body` lên upstream và yield event JSONL đã parse
+
+        Hết endpoint trước khi có token đầu, hoặc upstream lỗi giữa chừng, thì
+        yield một event error thay vì raise, để client nhận frame error như lỗi
+        upstream thông thường.
+        """
+        tried: List[UpstreamEndpoint] = []
+        last_error = "No upstream endpoint configured"
+
+        for attempt in range(max(1, CHAT_API_MAX_ATTEMPTS)):
+            endpoint = self.pick(tried)
+            if endpoint is None:
+                break
+            if attempt > 0:
+                self._stats["retries"] += 1
+                logger.warning(f"Retrying chat request on another upstream: url={endpoint.url}")
+            tried.append(endpoint)
+
+            endpoint.acquire()
+            started = time.monotonic()
+            first_token = False
+            try:
+                async with self.client.stream("POST", endpoint.url, json=body, headers=headers) as res:
+                    if res.status_code >= 500:
+                        raise httpx.HTTPStatusError(
+                            f"Upstream returned {res.status_code}", request=res.request, response=res
+                        )
+
+                    lines = res.aiter_lines()
+                    while True:
+                        try:
+                            if first_token:
+                                line = await lines.__anext__()
+                            else:
+                                line = await asyncio.wait_for(
+                                    lines.__anext__(), CHAT_API_FIRST_TOKEN_TIMEOUT
+                                )
+                        except StopAsyncIteration:
+                            break
+
+                        if not line:
+                            continue
+                        try:
+                            event = codec.loads(line)
+                        except Exception as e:
+                            logger.warning(f"Upstream JSON parse error: {str(e)}")
+                            continue
+
+                        if not first_token:
+                            first_token = True
+                            elapsed = time.monotonic() - started
+                            if elapsed >= CHAT_API_SLOW_FIRST_TOKEN_SECONDS:
+                                endpoint.record_slow(elapsed)
+                            else:
+                                endpoint.record_success(elapsed)
+
+                        yield event
+                        if event.get("type") == "error":
+                            return
+
+                if not first_token:
+                    # Stream rỗng -> cũng coi như thành công (upstream trả lời, không có nội dung)
+                    endpoint.record_success(time.monotonic() - started)
+                return
+
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                reason = "first token timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+                endpoint.record_failure(reason)
+                if first_token:
+                    # Client đã nhận một phần câu trả lời -> không retry; kết thúc
+                    # bằng event error để client nhận frame error và phần đã có được lưu
+                    logger.error(f"Upstream failed mid-stream: url={endpoint.url}, {reason}")
+                    yield {"type": "error", "data": {"message": "Upstream stream interrupted"}}
+                    return
+                last_error = reason
+                logger.warning(f"Upstream failed before first token: url={endpoint.url}, {reason}")
+            finally:
+                endpoint.release()
+
+        self._stats["unavailable"] += 1
+        logger.error(f"No upstream available for chat request: {last_error}")
+        yield {"type": "error", "data": {"message": "Upstream unavailable"}}
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "endpoints": [e.metrics() for e in self.endpoints]}
+
+
+# Create singleton instance
+upstream_pool = UpstreamClientPool()
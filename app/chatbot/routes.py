@@ -1,9 +1,10 @@
 from fastapi import FastAPI, HTTPException, APIRouter
 from fastapi.responses import StreamingResponse
-import json
 import time
 from pathlib import Path
 
+from app import codec
+
 router = APIRouter()
 
 
@@ -38,12 +39,11 @@ def stream_jsonl_text_file(file_path: str):
 
 def stream_jsonl_from_text(file_path: str):
     for text in stream_jsonl_text_file(file_path):
-        # yield json.dumps({"type": "text", "data": text}, ensure_ascii=False) + "\n"
         if "[[META]]" in text:
-            data = json.loads(text.replace("[[META]]", ""))
-            yield f"{json.dumps({'type': 'metadata', 'data': data}, ensure_ascii=False)}\n"
+            data = codec.loads(text.replace("[[META]]", ""))
+            yield codec.ndjson_line({"type": "metadata", "data": data})
         else:
-            yield f"{json.dumps({'type':'text','data': text}, ensure_ascii=False)}\n"
+            yield codec.ndjson_line({"type": "text", "data": text})
         # time.sleep(0.01)
 
 
@@ -0,0 +1,47 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse as _StarletteJSONResponse
+
+# JSON codec dùng chung cho streaming hot path và các JSON API:
+# orjson nếu được cài (pip install orjson), fallback về stdlib json.
+# Output luôn là UTF-8 compact (không escape ký tự tiếng Nhật).
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+if orjson:
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+else:
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+def ndjson_line(obj: Any) -> bytes:
+    """Một dòng NDJSON đã encode sẵn"""
+    return dumps(obj) + b"\n"
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """JSONResponse render bằng codec (thay cho fastapi.responses.JSONResponse)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -22,3 +22,169 @@ def inject_globals():
         "HEADER_TITLE": os.getenv("HEADER_TITLE"),
         "WELCOME_MESSAGE": os.getenv("WELCOME_MESSAGE"),
     }
+
+# SQL Server connection pool (app/db/connection.py)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_VALIDATE_AFTER = float(os.getenv("DB_POOL_VALIDATE_AFTER", "30"))
+DB_POOL_REAP_INTERVAL = float(os.getenv("DB_POOL_REAP_INTERVAL", "60"))
+
+# Read / write split (app/db/connection.py: DBRouter)
+# Bật khi có DB_READ_SERVER hoặc DB_READ_NAME; các giá trị thiếu lấy theo DB_* của primary
+DB_ODBC_DRIVER = os.getenv("DB_ODBC_DRIVER", "ODBC Driver 17 for SQL Server")
+DB_READ_SERVER = os.getenv("DB_READ_SERVER")
+DB_READ_NAME = os.getenv("DB_READ_NAME")
+DB_READ_ENABLED = bool(DB_READ_SERVER or DB_READ_NAME)
+DB_READ_APPLICATION_INTENT_READONLY = os.getenv("DB_READ_APPLICATION_INTENT_READONLY", "1") == "1"
+DB_READ_POOL_MIN_SIZE = int(os.getenv("DB_READ_POOL_MIN_SIZE", str(DB_POOL_MIN_SIZE)))
+DB_READ_POOL_MAX_SIZE = int(os.getenv("DB_READ_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+# Sau khi ghi, user / conversation đó đọc từ primary trong khoảng này (read-your-writes)
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+DB_READ_YOUR_WRITES_MAX_KEYS = int(os.getenv("DB_READ_YOUR_WRITES_MAX_KEYS", "50000"))
+
+# DB executor cho async routes (app/db/executor.py)
+DB_EXECUTOR_WORKERS = int(
+    os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE + (DB_READ_POOL_MAX_SIZE if DB_READ_ENABLED else 0)))
+)
+DB_EXECUTOR_QUEUE_LIMIT = int(os.getenv("DB_EXECUTOR_QUEUE_LIMIT", "200"))
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "15"))
+DB_TIMEOUT_GRACE_SECONDS = float(os.getenv("DB_TIMEOUT_GRACE_SECONDS", "1"))
+
+# Upstream chat API connection pool
+CHAT_API_VERIFY_SSL = os.getenv("CHAT_API_VERIFY_SSL", "0") == "1"
+CHAT_API_HTTP2 = os.getenv("CHAT_API_HTTP2", "0") == "1"
+CHAT_API_MAX_CONNECTIONS = int(os.getenv("CHAT_API_MAX_CONNECTIONS", "100"))
+CHAT_API_MAX_KEEPALIVE = int(os.getenv("CHAT_API_MAX_KEEPALIVE", "20"))
+CHAT_API_KEEPALIVE_EXPIRY = float(os.getenv("CHAT_API_KEEPALIVE_EXPIRY", "60"))
+CHAT_API_CONNECT_TIMEOUT = float(os.getenv("CHAT_API_CONNECT_TIMEOUT", "10"))
+CHAT_API_PREWARM = int(os.getenv("CHAT_API_PREWARM", "2"))
+CHAT_API_READ_TIMEOUT = float(os.getenv("CHAT_API_READ_TIMEOUT", "120"))
+CHAT_API_WRITE_TIMEOUT = float(os.getenv("CHAT_API_WRITE_TIMEOUT", "30"))
+CHAT_API_POOL_TIMEOUT = float(os.getenv("CHAT_API_POOL_TIMEOUT", "10"))
+
+# Multi-upstream routing: "url|weight,url|weight" (mặc định = CHAT_API_URL, weight 1)
+CHAT_API_URLS = os.getenv("CHAT_API_URLS", "")
+CHAT_API_MAX_ATTEMPTS = int(os.getenv("CHAT_API_MAX_ATTEMPTS", "2"))
+CHAT_API_FIRST_TOKEN_TIMEOUT = float(os.getenv("CHAT_API_FIRST_TOKEN_TIMEOUT", "60"))
+CHAT_API_SLOW_FIRST_TOKEN_SECONDS = float(os.getenv("CHAT_API_SLOW_FIRST_TOKEN_SECONDS", "20"))
+CHAT_API_HEALTH_INTERVAL = float(os.getenv("CHAT_API_HEALTH_INTERVAL", "10"))
+CHAT_API_HEALTH_TIMEOUT = float(os.getenv("CHAT_API_HEALTH_TIMEOUT", "3"))
+CHAT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CHAT_BREAKER_FAILURE_THRESHOLD", "3"))
+CHAT_BREAKER_OPEN_SECONDS = float(os.getenv("CHAT_BREAKER_OPEN_SECONDS", "30"))
+
+# Chat stream flush engine
+CHAT_FLUSH_WINDOW_MS = int(os.getenv("CHAT_FLUSH_WINDOW_MS", "50"))
+CHAT_FLUSH_MAX_BYTES = int(os.getenv("CHAT_FLUSH_MAX_BYTES", "512"))
+CHAT_HEARTBEAT_SECONDS = float(os.getenv("CHAT_HEARTBEAT_SECONDS", "15"))
+
+# QA log write-behind queue
+QA_LOG_QUEUE_SIZE = int(os.getenv("QA_LOG_QUEUE_SIZE", "1000"))
+QA_LOG_BATCH_SIZE = int(os.getenv("QA_LOG_BATCH_SIZE", "50"))
+QA_LOG_FLUSH_INTERVAL_MS = int(os.getenv("QA_LOG_FLUSH_INTERVAL_MS", "200"))
+QA_LOG_RETRY_SECONDS = float(os.getenv("QA_LOG_RETRY_SECONDS", "5"))
+QA_LOG_ACK_TIMEOUT = float(os.getenv("QA_LOG_ACK_TIMEOUT", "5"))
+QA_LOG_SPOOL_PATH = os.getenv("QA_LOG_SPOOL_PATH", os.path.join("logs", "qa_log_spool.jsonl"))
+QA_LOG_SPOOL_FSYNC = os.getenv("QA_LOG_SPOOL_FSYNC", "1") == "1"
+# Spool ghi trên thread riêng: gom các entry trong cửa sổ này rồi fsync một lần
+QA_LOG_SPOOL_SYNC_INTERVAL_MS = int(os.getenv("QA_LOG_SPOOL_SYNC_INTERVAL_MS", "10"))
+# Batch từ số dòng này trở lên ghi bằng bulk ingestion (temp table + fast_executemany)
+QA_LOG_BULK_MIN_ROWS = int(os.getenv("QA_LOG_BULK_MIN_ROWS", "20"))
+
+# Turn allocator: số session giữ hint TurnNo (LRU)
+TURN_HINT_CACHE_SIZE = int(os.getenv("TURN_HINT_CACHE_SIZE", "10000"))
+
+# Admission control cho /api/chat
+CHAT_MAX_CONCURRENT_STREAMS = int(os.getenv("CHAT_MAX_CONCURRENT_STREAMS", "32"))
+CHAT_QUEUE_LIMIT = int(os.getenv("CHAT_QUEUE_LIMIT", "100"))
+CHAT_MAX_QUEUE_WAIT = float(os.getenv("CHAT_MAX_QUEUE_WAIT", "30"))
+CHAT_USER_RATE_PER_MIN = float(os.getenv("CHAT_USER_RATE_PER_MIN", "20"))
+CHAT_USER_BURST = int(os.getenv("CHAT_USER_BURST", "5"))
+
+# Answer cache (exact match trên câu hỏi đã normalize)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ADMIN_EMAILS = [
+    e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()
+]
+
+# Identity cache (email -> UserCD) cho API auth dependency
+IDENTITY_CACHE_TTL_SECONDS = float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "300"))
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "10000"))
+
+# Debounce ghi LastLoginAt: login lặp lại (cùng profile) trong khoảng này không ghi M_User
+LOGIN_DEBOUNCE_SECONDS = float(os.getenv("LOGIN_DEBOUNCE_SECONDS", "300"))
+LOGIN_DEBOUNCE_MAX_ENTRIES = int(os.getenv("LOGIN_DEBOUNCE_MAX_ENTRIES", "10000"))
+
+# Single-flight: gộp các upstream request giống hệt đang chạy song song
+CHAT_SINGLE_FLIGHT_ENABLED = os.getenv("CHAT_SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Stop generation / client disconnect
+# Rule lưu câu trả lời dở dang: "never" | "always" | "min_chars:<N>"
+CHAT_PARTIAL_PERSIST_ON_STOP = os.getenv("CHAT_PARTIAL_PERSIST_ON_STOP", "always")
+CHAT_PARTIAL_PERSIST_ON_DISCONNECT = os.getenv("CHAT_PARTIAL_PERSIST_ON_DISCONNECT", "min_chars:100")
+CHAT_PARTIAL_PERSIST_ON_ERROR = os.getenv("CHAT_PARTIAL_PERSIST_ON_ERROR", "always")
+CHAT_DISCONNECT_POLL_SECONDS = float(os.getenv("CHAT_DISCONNECT_POLL_SECONDS", "1"))
+
+# Resumable chat stream (replay buffer theo turn)
+CHAT_REPLAY_MAX_EVENTS = int(os.getenv("CHAT_REPLAY_MAX_EVENTS", "2000"))
+CHAT_REPLAY_TTL_SECONDS = float(os.getenv("CHAT_REPLAY_TTL_SECONDS", "120"))
+CHAT_RESUME_GRACE_SECONDS = float(os.getenv("CHAT_RESUME_GRACE_SECONDS", "15"))
+
+# Server-side chat history cho upstream
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "5"))
+CHAT_HISTORY_BUDGET_CHARS = int(os.getenv("CHAT_HISTORY_BUDGET_CHARS", "8000"))
+CHAT_HISTORY_FULL_TURNS = int(os.getenv("CHAT_HISTORY_FULL_TURNS", "2"))
+CHAT_HISTORY_COMPACT_CHARS = int(os.getenv("CHAT_HISTORY_COMPACT_CHARS", "300"))
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "1000"))
+CHAT_HISTORY_CACHE_TTL_SECONDS = float(os.getenv("CHAT_HISTORY_CACHE_TTL_SECONDS", "600"))
+
+# Response compression (gzip; br / zstd nếu cài brotli / zstandard)
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_EXCLUDED_TYPES = [
+    t.strip().lower()
+    for t in os.getenv(
+        "COMPRESSION_EXCLUDED_TYPES",
+        "application/pdf,application/zip,application/gzip,application/x-7z-compressed,"
+        "application/octet-stream,image/,audio/,video/,font/woff",
+    ).split(",")
+    if t.strip()
+]
+
+# Keyset pagination cho /api/conversations và /api/conversation/{id}/history
+CONVERSATIONS_PAGE_SIZE = int(os.getenv("CONVERSATIONS_PAGE_SIZE", "50"))
+CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv("CONVERSATIONS_MAX_PAGE_SIZE", "200"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# ETag / 304 + response cache theo user cho conversation list / history
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_USERS = int(os.getenv("RESPONSE_CACHE_MAX_USERS", "1000"))
+RESPONSE_CACHE_PER_USER = int(os.getenv("RESPONSE_CACHE_PER_USER", "8"))
+
+# Streamed history (/api/conversation/{id}/history/stream)
+HISTORY_FETCH_BATCH_SIZE = int(os.getenv("HISTORY_FETCH_BATCH_SIZE", "50"))
+HISTORY_PREVIEW_CHARS = int(os.getenv("HISTORY_PREVIEW_CHARS", "100"))
+
+# Full-text search (/api/conversations/search): inverted index bigram theo user, trong process
+SEARCH_INDEX_MAX_USERS = int(os.getenv("SEARCH_INDEX_MAX_USERS", "200"))
+SEARCH_INDEX_SYNC_SECONDS = float(os.getenv("SEARCH_INDEX_SYNC_SECONDS", "2"))
+SEARCH_INDEX_FETCH_BATCH_SIZE = int(os.getenv("SEARCH_INDEX_FETCH_BATCH_SIZE", "500"))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "120"))
+
+# Archive T_QA_Log -> segment gzip append-only theo user trên Azure Blob (app/chat/archive.py)
+# ARCHIVE_LOCAL_DIR: dùng thư mục local thay cho Azure (dev / test)
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_INACTIVE_DAYS = int(os.getenv("ARCHIVE_INACTIVE_DAYS", "180"))
+ARCHIVE_BATCH_SESSIONS = int(os.getenv("ARCHIVE_BATCH_SESSIONS", "500"))
+ARCHIVE_BLOB_PREFIX = os.getenv("ARCHIVE_BLOB_PREFIX", "qa-archive")
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv("ARCHIVE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_LOCAL_DIR = os.getenv("ARCHIVE_LOCAL_DIR")
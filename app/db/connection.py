@@ -1,14 +1,503 @@
-import pyodbc
+import logging
+import math
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
-def get_conn():
+import pyodbc
+
+from app.db.executor import DBJob, current_job
+from app.config import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_CHECKOUT_TIMEOUT,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_IDLE_TIMEOUT,
+    DB_POOL_VALIDATE_AFTER,
+    DB_POOL_REAP_INTERVAL,
+    DB_ODBC_DRIVER,
+    DB_READ_SERVER,
+    DB_READ_NAME,
+    DB_READ_ENABLED,
+    DB_READ_APPLICATION_INTENT_READONLY,
+    DB_READ_POOL_MIN_SIZE,
+    DB_READ_POOL_MAX_SIZE,
+    DB_READ_YOUR_WRITES_SECONDS,
+    DB_READ_YOUR_WRITES_MAX_KEYS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+READ = "read"
+WRITE = "write"
+
+
+def _connect(server, name, user, password, read_only: bool = False):
+    intent = "ApplicationIntent=ReadOnly;" if read_only else ""
     return pyodbc.connect(
         f"""
-        DRIVER={{ODBC Driver 17 for SQL Server}};
-        SERVER={os.getenv('DB_SERVER')};
-        DATABASE={os.getenv('DB_NAME')};
-        UID={os.getenv('DB_USER')};
-        PWD={os.getenv('DB_PASSWORD')};
+        DRIVER={{{DB_ODBC_DRIVER}}};
+        SERVER={server};
+        DATABASE={name};
+        UID={user};
+        PWD={password};
         TrustServerCertificate=yes;
+        {intent}
         """
     )
+
+
+def get_conn():
+    """Mở một pyodbc connection mới tới primary (không qua pool)"""
+    return _connect(
+        os.getenv('DB_SERVER'), os.getenv('DB_NAME'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD')
+    )
+
+
+def get_read_conn():
+    """Mở một pyodbc connection mới tới read target (readable secondary)"""
+    return _connect(
+        DB_READ_SERVER or os.getenv('DB_SERVER'),
+        DB_READ_NAME or os.getenv('DB_NAME'),
+        os.getenv('DB_READ_USER') or os.getenv('DB_USER'),
+        os.getenv('DB_READ_PASSWORD') or os.getenv('DB_PASSWORD'),
+        read_only=DB_READ_APPLICATION_INTENT_READONLY,
+    )
+
+
+class PoolTimeout(Exception):
+    """Không lấy được connection trong checkout timeout (pool đã đầy)"""
+
+
+class _JobConnection:
+    """Proxy connection ghi lại cursor vào DBJob để có thể cancel từ event loop"""
+
+    def __init__(self, conn, job: DBJob):
+        self._conn = conn
+        self._job = job
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        self._job.track(cursor)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class ConnectionPool:
+    """
+    Pool pyodbc connection thread-safe (route sync chạy trong threadpool)
+
+    - giữ tối thiểu `min_size`, tối đa `max_size` connection
+    - connection idle quá `validate_after` giây được `SELECT 1` trước khi trả ra
+    - connection sống quá `max_lifetime` bị đóng khi trả về / lấy ra
+    - reaper thread đóng connection idle quá `idle_timeout` (vẫn giữ `min_size`)
+
+    Dùng qua context manager để connection luôn được trả về pool::
+
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            ...
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any] = get_conn,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        checkout_timeout: float = DB_POOL_CHECKOUT_TIMEOUT,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        idle_timeout: float = DB_POOL_IDLE_TIMEOUT,
+        validate_after: float = DB_POOL_VALIDATE_AFTER,
+        reap_interval: float = DB_POOL_REAP_INTERVAL,
+    ):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.checkout_timeout = checkout_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.validate_after = validate_after
+        self.reap_interval = reap_interval
+
+        self._idle: List[_PooledConnection] = []
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._opening = 0
+        self._cond = threading.Condition()
+        self._reaper: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "validation_failures": 0,
+            "discarded": 0,
+        }
+
+    # ------------------------------------------------------------------ #
+    # Lifecycle
+    # ------------------------------------------------------------------ #
+
+    def start(self):
+        """Mở sẵn `min_size` connection và chạy reaper thread"""
+        self._closed.clear()
+        self._fill_min()
+        if self._reaper is None and self.reap_interval > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+            self._reaper.start()
+        logger.info(f"DB pool started: min={self.min_size}, max={self.max_size}")
+
+    def close(self):
+        """Đóng toàn bộ connection idle; connection đang dùng bị đóng khi trả về"""
+        self._closed.set()
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pc in idle:
+            self._close(pc)
+        self._reaper = None
+        logger.info("DB pool closed")
+
+    # ------------------------------------------------------------------ #
+    # Checkout / return
+    # ------------------------------------------------------------------ #
+
+    def _size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _expired(self, pc: _PooledConnection, now: float) -> bool:
+        return self.max_lifetime > 0 and now - pc.created_at >= self.max_lifetime
+
+    def _open(self) -> _PooledConnection:
+        try:
+            pc = _PooledConnection(self.factory())
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._stats["created"] += 1
+        return pc
+
+    def _close(self, pc: _PooledConnection):
+        try:
+            pc.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["closed"] += 1
+
+    def _validate(self, pc: _PooledConnection) -> bool:
+        try:
+            cursor = pc.conn.cursor()
+            cursor.execute("SELECT 1").fetchone()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.warning(f"DB pool connection failed validation: {str(e)}")
+            with self._cond:
+                self._stats["validation_failures"] += 1
+            return False
+
+    def acquire(self):
+        """
+        Lấy một connection (ưu tiên connection idle mới dùng gần nhất)
+
+        Raises:
+            PoolTimeout khi pool đầy quá `checkout_timeout`
+            pyodbc.Error khi không mở được connection mới
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            pc = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        pc = self._idle.pop()
+                        self._in_use[id(pc.conn)] = pc
+                        break
+                    if self._size() < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No DB connection available within {self.checkout_timeout}s")
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                self._stats["checkouts"] += 1
+
+            if pc is None:
+                pc = self._open()
+                with self._cond:
+                    self._in_use[id(pc.conn)] = pc
+                return pc.conn
+
+            now = time.monotonic()
+            stale = self._expired(pc, now) or (
+                now - pc.last_used_at >= self.validate_after and not self._validate(pc)
+            )
+            if not stale:
+                return pc.conn
+
+            # Connection hỏng / hết hạn -> bỏ và thử lại
+            with self._cond:
+                self._in_use.pop(id(pc.conn), None)
+                self._cond.notify()
+            self._close(pc)
+
+    def release(self, conn, discard: bool = False):
+        """Trả connection về pool; rollback transaction dở, bỏ connection hỏng"""
+        with self._cond:
+            pc = self._in_use.pop(id(conn), None)
+        if pc is None:
+            return
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        if discard or self._closed.is_set() or self._expired(pc, now):
+            if discard:
+                with self._cond:
+                    self._stats["discarded"] += 1
+            self._close(pc)
+            with self._cond:
+                self._cond.notify()
+            return
+
+        pc.last_used_at = now
+        with self._cond:
+            self._idle.append(pc)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """
+        Context manager: connection luôn được trả về pool, kể cả khi exception
+
+        Trong DB executor (app.db.executor), query timeout của job được áp
+        vào connection và cursor được theo dõi để cancel.
+        """
+        conn = self.acquire()
+        job = current_job()
+        try:
+            if job is None:
+                yield conn
+            else:
+                if job.timeout and job.timeout > 0:
+                    conn.timeout = max(1, math.ceil(job.timeout))
+                yield _JobConnection(conn, job)
+        finally:
+            if job is not None:
+                try:
+                    conn.timeout = 0
+                except Exception:
+                    pass
+            self.release(conn)
+
+    # ------------------------------------------------------------------ #
+    # Maintenance
+    # ------------------------------------------------------------------ #
+
+    def _fill_min(self):
+        while True:
+            with self._cond:
+                if self._size() >= self.min_size:
+                    return
+                self._opening += 1
+            try:
+                pc = self._open()
+            except Exception as e:
+                logger.warning(f"DB pool could not open connection: {str(e)}")
+                return
+            with self._cond:
+                self._idle.insert(0, pc)
+                self._cond.notify()
+
+    def reap(self):
+        """Đóng connection idle quá lâu / hết lifetime, rồi bù lại `min_size`"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = []
+            # _idle: cũ nhất ở đầu list
+            for pc in self._idle:
+                idle_too_long = self.idle_timeout > 0 and now - pc.last_used_at >= self.idle_timeout
+                surplus = len(self._idle) - len(expired) + len(self._in_use) > self.min_size
+                if self._expired(pc, now) or (idle_too_long and surplus):
+                    expired.append(pc)
+                else:
+                    keep.append(pc)
+            self._idle = keep
+
+        for pc in expired:
+            self._close(pc)
+        if not self._closed.is_set():
+            self._fill_min()
+
+    def _reap_loop(self):
+        while not self._closed.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"DB pool reaper error: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "max_size": self.max_size,
+            }
+
+
+def user_key(user_cd: Any) -> str:
+    return f"user:{user_cd}"
+
+
+def conversation_key(session_id: str) -> str:
+    return f"conv:{session_id}"
+
+
+class DBRouter:
+    """
+    Chọn pool theo intent: READ -> read target (nếu có), WRITE -> primary
+
+    Read-your-writes: sau khi ghi, các key liên quan (user_key / conversation_key)
+    được đánh dấu; trong `window` giây, READ với key đó đi primary để không
+    thấy dữ liệu cũ do replica trễ. Đánh dấu là per-process (worker khác có
+    thể đọc replica trong window - chấp nhận được cho history / sidebar).
+
+    Read target lỗi (không mở được connection / pool đầy) -> fallback primary.
+    """
+
+    def __init__(
+        self,
+        write_pool: ConnectionPool,
+        read_pool: Optional[ConnectionPool] = None,
+        window: float = DB_READ_YOUR_WRITES_SECONDS,
+        max_keys: int = DB_READ_YOUR_WRITES_MAX_KEYS,
+    ):
+        self.write_pool = write_pool
+        self.read_pool = read_pool or write_pool
+        self.window = window
+        self.max_keys = max_keys
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"reads": 0, "primary_reads": 0, "pinned_reads": 0, "read_fallbacks": 0, "writes": 0}
+
+    @property
+    def split(self) -> bool:
+        return self.read_pool is not self.write_pool
+
+    def mark_write(self, *keys: str):
+        """Gọi sau khi commit: các key này đọc từ primary trong `window` giây"""
+        if not self.split or self.window <= 0:
+            return
+        expires = time.monotonic() + self.window
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                self._recent[key] = expires
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_keys:
+                self._recent.popitem(last=False)
+
+    def _pinned(self, key: Optional[str]) -> bool:
+        if key is None:
+            return False
+        with self._lock:
+            expires = self._recent.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._recent[key]
+                return False
+            return True
+
+    def pool_for(self, intent: str = WRITE, key: Optional[str] = None) -> ConnectionPool:
+        if intent != READ:
+            self._stats["writes"] += 1
+            return self.write_pool
+        self._stats["reads"] += 1
+        if not self.split:
+            self._stats["primary_reads"] += 1
+            return self.write_pool
+        if self._pinned(key):
+            self._stats["pinned_reads"] += 1
+            return self.write_pool
+        return self.read_pool
+
+    @contextmanager
+    def connection(self, intent: str = WRITE, key: Optional[str] = None) -> Iterator[Any]:
+        pool = self.pool_for(intent, key)
+        with ExitStack() as stack:
+            try:
+                conn = stack.enter_context(pool.connection())
+            except (PoolTimeout, pyodbc.Error) as e:
+                if pool is self.write_pool:
+                    raise
+                self._stats["read_fallbacks"] += 1
+                logger.warning(f"Read target unavailable, falling back to primary: {str(e)}")
+                conn = stack.enter_context(self.write_pool.connection())
+            yield conn
+
+    def start(self):
+        self.write_pool.start()
+        if self.split:
+            self.read_pool.start()
+
+    def close(self):
+        self.write_pool.close()
+        if self.split:
+            self.read_pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pinned = len(self._recent)
+        return {**self._stats, "split": self.split, "pinned_keys": pinned}
+
+
+# Create singleton instance
+db_pool = ConnectionPool()
+db_read_pool = (
+    ConnectionPool(factory=get_read_conn, min_size=DB_READ_POOL_MIN_SIZE, max_size=DB_READ_POOL_MAX_SIZE)
+    if DB_READ_ENABLED
+    else db_pool
+)
+db_router = DBRouter(db_pool, db_read_pool)
+
+
+def db_connection(intent: str = WRITE, key: Optional[str] = None):
+    """
+    `with db_connection() as conn:` - connection từ pool dùng chung
+
+    intent=READ cho query chỉ đọc (có thể đi replica); `key` (user_key /
+    conversation_key) để áp read-your-writes.
+    """
+    return db_router.connection(intent, key)
@@ -0,0 +1,254 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from app.config import (
+    DB_EXECUTOR_WORKERS,
+    DB_EXECUTOR_QUEUE_LIMIT,
+    DB_QUERY_TIMEOUT,
+    DB_TIMEOUT_GRACE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class QueryTimeout(Exception):
+    """Query không xong trong timeout (đã gửi cancel tới SQL Server)"""
+
+
+class DBExecutorBusy(Exception):
+    """Quá nhiều DB job đang chờ executor"""
+
+
+class _Failure:
+    __slots__ = ("exc",)
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+_END = object()
+
+
+class DBJob:
+    """
+    Một lời gọi DB chạy trên executor thread
+
+    db_connection() đọc job hiện tại của thread để đặt query timeout cho
+    connection (pyodbc `conn.timeout`) và ghi lại cursor, nhờ đó phía async
+    có thể cancel query đang chạy (SQLCancel) khi timeout / request bị hủy.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.cancelled = False
+        self._cursors: List[Any] = []
+        self._lock = threading.Lock()
+
+    def track(self, cursor):
+        with self._lock:
+            self._cursors.append(cursor)
+            cancelled = self.cancelled
+        if cancelled:
+            self._cancel_cursor(cursor)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cursors = list(self._cursors)
+        for cursor in cursors:
+            self._cancel_cursor(cursor)
+
+    @staticmethod
+    def _cancel_cursor(cursor):
+        try:
+            cursor.cancel()
+        except Exception as e:
+            logger.debug(f"Cursor cancel failed: {str(e)}")
+
+
+def current_job() -> Optional[DBJob]:
+    """DBJob của executor thread hiện tại (None khi gọi ngoài executor)"""
+    return getattr(_local, "job", None)
+
+
+class DBExecutor:
+    """
+    Thread pool riêng, giới hạn cho blocking pyodbc code
+
+    Event loop chỉ await kết quả nên một query chậm không chặn các stream
+    khác. Mỗi job có timeout: SQL Server tự hủy statement khi quá
+    `conn.timeout`, phía async chờ thêm `DB_TIMEOUT_GRACE_SECONDS` rồi cancel
+    cursor và raise QueryTimeout.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DB_EXECUTOR_WORKERS,
+        queue_limit: int = DB_EXECUTOR_QUEUE_LIMIT,
+        default_timeout: float = DB_QUERY_TIMEOUT,
+    ):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.default_timeout = default_timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._stats = {"jobs": 0, "timeouts": 0, "cancelled": 0, "rejected": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        return self._executor
+
+    @staticmethod
+    def _call(job: DBJob, fn: Callable, args, kwargs):
+        if job.cancelled:
+            raise asyncio.CancelledError()
+        _local.job = job
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.job = None
+
+    def _done(self, future):
+        self._pending -= 1
+        # Job đã timeout / bị hủy phía async: đánh dấu exception đã được đọc
+        if not future.cancelled():
+            future.exception()
+
+    def _submit(self, job: DBJob, fn: Callable, args, kwargs) -> asyncio.Future:
+        if self._pending >= self.max_workers + self.queue_limit:
+            self._stats["rejected"] += 1
+            raise DBExecutorBusy(f"DB executor busy: {self._pending} pending jobs")
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._get_executor(), functools.partial(self._call, job, fn, args, kwargs)
+        )
+        self._pending += 1
+        self._stats["jobs"] += 1
+        future.add_done_callback(self._done)
+        return future
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Chạy `fn(*args, **kwargs)` trên DB executor
+
+        Raises:
+            QueryTimeout khi quá `timeout` (mặc định DB_QUERY_TIMEOUT, 0 = không giới hạn)
+            DBExecutorBusy khi hàng đợi đầy
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        job = DBJob(timeout)
+        future = self._submit(job, fn, args, kwargs)
+
+        try:
+            if timeout and timeout > 0:
+                return await asyncio.wait_for(asyncio.shield(future), timeout + DB_TIMEOUT_GRACE_SECONDS)
+            return await asyncio.shield(future)
+        except asyncio.TimeoutError:
+            job.cancel()
+            self._stats["timeouts"] += 1
+            name = getattr(fn, "__qualname__", repr(fn))
+            logger.warning(f"DB query timed out after {timeout}s: {name}")
+            raise QueryTimeout(f"{name} timed out after {timeout}s")
+        except asyncio.CancelledError:
+            # Request bị hủy (client disconnect) -> hủy luôn query
+            job.cancel()
+            self._stats["cancelled"] += 1
+            raise
+
+    async def stream(
+        self,
+        fn: Callable[..., Iterator[Any]],
+        *args,
+        timeout: Optional[float] = None,
+        buffer: int = 2,
+        **kwargs,
+    ) -> AsyncIterator[Any]:
+        """
+        Chạy sync generator `fn(*args, **kwargs)` trên DB executor, yield từng item
+
+        Cả generator (execute + fetchmany) chạy trong một DB job; item đi sang
+        event loop qua queue giới hạn `buffer`, nên thread DB chờ khi client
+        đọc chậm thay vì materialize toàn bộ kết quả. `timeout` là query timeout
+        của statement (không giới hạn tổng thời gian stream). Consumer dừng
+        giữa chừng (client disconnect) -> cursor bị cancel, generator bị đóng.
+
+        Raises:
+            DBExecutorBusy khi hàng đợi đầy; exception của generator được raise lại
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(buffer, 1))
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        def produce():
+            try:
+                gen = fn(*args, **kwargs)
+                try:
+                    for item in gen:
+                        if not put(item):
+                            return
+                finally:
+                    gen.close()
+            except BaseException as e:
+                put(_Failure(e))
+                return
+            put(_END)
+
+        job = DBJob(self.default_timeout if timeout is None else timeout)
+        future = self._submit(job, produce, (), {})
+        getter = None
+        try:
+            while True:
+                if future.done() and queue.empty():
+                    # Job kết thúc mà không gửi _END (bị hủy trước khi chạy / executor shutdown)
+                    exc = None if future.cancelled() else future.exception()
+                    raise exc or asyncio.CancelledError()
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                item = getter.result()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            stop.set()
+            if not future.done():
+                job.cancel()
+                self._stats["cancelled"] += 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self._stats, "pending": self._pending, "max_workers": self.max_workers}
+
+
+# Create singleton instance
+db_executor = DBExecutor()
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI, Request, Response
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -6,13 +7,20 @@ import os
 from dotenv import load_dotenv
 
 from app.auth.oauth import init_oauth
-from app.auth.routes import router as auth_router
+from app.auth.principal import AuthError, auth_error_handler
+from app.auth.routes import router as auth_router, resolve_system_user
 from app.chat.routes import router as chat_router
 from app.azure.routes import router as azure_router
 from app.chatbot.routes import router as chatbot_router
+from app.chat.upstream import upstream_pool
+from app.db.connection import db_router
+from app.db.executor import db_executor
+from app.chat.qa_log_writer import qa_log_writer
 from app.middlewares.force_localhost import force_localhost
+from app.middlewares.compression import CompressionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from app.logger import setup_logger
+from app.config import COMPRESSION_ENABLED, LOGIN_MODE
 
 load_dotenv()
 
@@ -51,10 +59,28 @@ logger = setup_logger("ai_chatbot")
 
 
 @app.on_event("startup")
-def startup():
+async def startup():
+    await asyncio.to_thread(db_router.start)
+    await upstream_pool.startup()
+    await qa_log_writer.start()
+    if LOGIN_MODE == 1:
+        try:
+            await resolve_system_user()
+        except Exception as e:
+            # Không chặn startup: check_login_mode sẽ resolve lại ở request đầu
+            logger.error(f"Failed to resolve system user: {str(e)}")
     logger.info("AI chatbot started")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await qa_log_writer.stop()
+    await upstream_pool.shutdown()
+    db_executor.shutdown()
+    db_router.close()
+    logger.info("AI chatbot stopped")
+
+
 @app.middleware("http")
 async def prefix_middleware(request: Request, call_next):
     load_dotenv(override=True)
@@ -101,12 +127,20 @@ app.add_middleware(
 )
 
 app.middleware("http")(force_localhost)
+
+# Outermost: nén sau khi mọi middleware khác đã xử lý response
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 app.state.CLIENT_ID = os.getenv("MICROSOFT_CLIENT_ID")
 app.state.CLIENT_SECRET = os.getenv("MICROSOFT_CLIENT_SECRET")
 app.state.TENANT_ID = os.getenv("MICROSOFT_TENANT_ID")
 
 init_oauth(app)
 
+# 401 / 403 / 404 từ auth dependency, giữ format JSON cũ của login_required
+app.add_exception_handler(AuthError, auth_error_handler)
+
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(azure_router)
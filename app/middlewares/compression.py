@@ -0,0 +1,193 @@
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import (
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_ZSTD_LEVEL,
+    COMPRESSION_EXCLUDED_TYPES,
+)
+
+# brotli / zstandard là optional dependency, thiếu thì chỉ dùng gzip
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._c = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._c = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._c = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+# Thứ tự ưu tiên phía server khi client chấp nhận nhiều encoding
+ENCODERS: List[Tuple[str, Callable[[], object]]] = [
+    (name, factory)
+    for name, factory, available in (
+        ("zstd", _ZstdEncoder, zstandard is not None),
+        ("br", _BrotliEncoder, brotli is not None),
+        ("gzip", _GzipEncoder, True),
+    )
+    if available
+]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Chọn encoding từ header Accept-Encoding (bỏ qua q=0)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    best, best_q = None, 0.0
+    for name, _ in ENCODERS:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if not media_type:
+        return False
+    return not any(media_type.startswith(t) for t in COMPRESSION_EXCLUDED_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    Nén response (zstd / br / gzip) theo Accept-Encoding, an toàn cho streaming
+
+    Mỗi body message (= một frame NDJSON của chat stream) được nén rồi flush
+    ngay (Z_SYNC_FLUSH), nên client nhận token không bị trễ vì buffer của
+    compressor. Bỏ qua media type đã nén sẵn (PDF, ảnh, zip...), response đã
+    có Content-Encoding, partial content (Range) và Cache-Control: no-transform.
+    Body không streaming nhỏ hơn `minimum_size` được gửi nguyên.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self._factories = dict(ENCODERS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None or "range" in request_headers:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self._factories[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send: Send, encoding: str, factory: Callable[[], object], minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.factory = factory
+        self.minimum_size = minimum_size
+        self._start: Optional[Message] = None
+        self._encoder = None
+        self._passthrough = False
+
+    def _should_compress(self, headers: Headers, status: int) -> bool:
+        if status < 200 or status in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+        if "no-transform" in headers.get("cache-control", "").lower():
+            return False
+        return is_compressible(headers.get("content-type", ""))
+
+    async def send(self, message: Message):
+        t = message["type"]
+
+        if t == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if not self._should_compress(headers, message["status"]):
+                self._passthrough = True
+                await self._send(message)
+                return
+            # Giữ lại start message tới khi biết body có đáng nén không
+            self._start = message
+            return
+
+        if t != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._start is not None:
+            start, self._start = self._start, None
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+
+            if not more_body and len(body) < self.minimum_size:
+                self._passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+
+            del headers["content-length"]
+            headers["content-encoding"] = self.encoding
+            self._encoder = self.factory()
+            await self._send(start)
+
+        data = self._encoder.compress(body) if body else b""
+        if not more_body:
+            data += self._encoder.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -369,10 +369,7 @@ class ChatManager {
     document.getElementById('send-btn').disabled = true;
 
     try {
-      // Get recent chat history (last 5 Q&A pairs)
-      const chatHistory = this.getRecentChatHistory(5);
-      // console.log('Chat History for context:', chatHistory);
-
+      // chat_history được server dựng từ T_QA_Log, chỉ cần gửi câu hỏi mới
       const response = await fetch(BASE_PATH + '/api/chat', {
         method: 'POST',
         headers: {
@@ -383,7 +380,6 @@ class ChatManager {
         body: JSON.stringify({
           conversation_id: this.currentConversationId,
           question: question,
-          chat_history: chatHistory,
         }),
       });
 
@@ -396,63 +392,91 @@ class ChatManager {
       // Create AI message bubble for streaming
       const { messageDiv, contentDiv } = this.createAIMessageBubble();
       const wrapper = messageDiv.querySelector('.message-content-wrapper');
-      const reader = response.body.getReader();
       const decoder = new TextDecoder('utf-8');
+      const turnId = response.headers.get('X-Chat-Turn-Id');
 
       let fullText = '';
       let pdfMetadata = null;
       let qaLogCd = null;
       let buffer = '';
-
-      while (true) {
-        const { value, done } = await reader.read();
-        if (done) break;
-
-        buffer += decoder.decode(value, { stream: true });
-
-        let lines = buffer.split('\n');
-        buffer = lines.pop(); // giữ lại phần chưa đủ line
-
-        for (const line of lines) {
-          // console.log('Processing line:', line);
-          if (!line.trim()) continue;
-
-          // console.log('Received chunk:', chunk);
-          if (line.trim() === '') continue;
-          let jsonChunk = '';
-          try {
-            jsonChunk = JSON.parse(line);
-          } catch (e) {}
-
-          // Handle error
-          if (line.startsWith('[ERROR]')) {
-            fullText += '\n❌ ' + line.replace('[ERROR]', '');
-            this.renderMarkdown(contentDiv, fullText);
-            break;
-          }
-
-          // Handle PDF metadata
-          if (line.includes('[[META]]')) {
-            try {
-              // console.log('Parsing metadata jsonChunk:', jsonChunk);
-              var chunks = jsonChunk.data.split('[[META]]');
-              // fullText += chunks[0];
-              pdfMetadata = JSON.parse(chunks[1]);
-            } catch (e) {
-              console.error('Failed to parse metadata:', e);
-            }
-            continue;
-          }
-          if (line.includes('[[QA_LOG_CD]]')) {
-            qaLogCd = line.replace('[[QA_LOG_CD]]', '');
-            if (wrapper) {
-              wrapper.dataset.qaLogCd = qaLogCd;
+      let offset = 0;
+      let resumeAttempts = 0;
+      let currentResponse = response;
+
+      while (currentResponse) {
+        const reader = currentResponse.body.getReader();
+        currentResponse = null;
+        buffer = '';
+
+        try {
+          while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+
+            let lines = buffer.split('\n');
+            buffer = lines.pop(); // giữ lại phần chưa đủ line
+
+            for (const line of lines) {
+              // console.log('Processing line:', line);
+              if (!line.trim()) continue;
+              offset++; // mỗi event là đúng một dòng không rỗng
+
+              // console.log('Received chunk:', chunk);
+              if (line.trim() === '') continue;
+              let jsonChunk = '';
+              try {
+                jsonChunk = JSON.parse(line);
+              } catch (e) {}
+
+              // Handle error
+              if (jsonChunk && jsonChunk.type === 'error') {
+                fullText += '\n❌ ' + ((jsonChunk.data && jsonChunk.data.message) || 'Stream error');
+                this.renderMarkdown(contentDiv, fullText);
+                break;
+              }
+
+              // Handle PDF metadata
+              if (jsonChunk && jsonChunk.type === 'metadata') {
+                pdfMetadata = jsonChunk.data;
+                continue;
+              }
+              // Legacy format: [[META]] lồng trong text chunk
+              if (line.includes('[[META]]')) {
+                try {
+                  // console.log('Parsing metadata jsonChunk:', jsonChunk);
+                  var chunks = jsonChunk.data.split('[[META]]');
+                  // fullText += chunks[0];
+                  pdfMetadata = JSON.parse(chunks[1]);
+                } catch (e) {
+                  console.error('Failed to parse metadata:', e);
+                }
+                continue;
+              }
+              if (line.includes('[[QA_LOG_CD]]')) {
+                qaLogCd = line.replace('[[QA_LOG_CD]]', '');
+                if (wrapper) {
+                  wrapper.dataset.qaLogCd = qaLogCd;
+                }
+                continue;
+              }
+              // console.log('Appending data chunk:', jsonChunk.data);
+              fullText += jsonChunk.data || '';
+              this.renderMarkdown(contentDiv, fullText);
             }
-            continue;
           }
-          // console.log('Appending data chunk:', jsonChunk.data);
-          fullText += jsonChunk.data || '';
-          this.renderMarkdown(contentDiv, fullText);
+        } catch (streamError) {
+          // Rớt kết nối giữa chừng -> resume turn từ offset đã nhận
+          if (!turnId || resumeAttempts >= 3) throw streamError;
+          resumeAttempts++;
+          await new Promise((resolve) => setTimeout(resolve, 1000 * resumeAttempts));
+
+          const resumed = await fetch(
+            `${BASE_PATH}/api/chat/${this.currentConversationId}/resume?turn_id=${turnId}&offset=${offset}`
+          );
+          if (!resumed.ok) throw streamError;
+          currentResponse = resumed;
         }
       }
 
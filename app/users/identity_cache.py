@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.config import IDENTITY_CACHE_TTL_SECONDS, IDENTITY_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+class Principal:
+    """User đã xác thực của request (dựng từ M_User)"""
+
+    __slots__ = ("user_cd", "email", "display_name")
+
+    def __init__(self, user_cd: int, email: str, display_name: Optional[str] = None):
+        self.user_cd = user_cd
+        self.email = email
+        self.display_name = display_name
+
+    def __repr__(self) -> str:
+        return f"Principal(user_cd={self.user_cd}, email={self.email!r})"
+
+
+def _key(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+class IdentityCache:
+    """
+    TTL + LRU cache email -> Principal để không query M_User mỗi API request
+
+    Bị invalidate khi upsert_user / soft_delete_user chạy (từ DB executor
+    thread, nên có lock). TTL giới hạn độ trễ khi M_User bị sửa ngoài app.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = IDENTITY_CACHE_TTL_SECONDS,
+        max_entries: int = IDENTITY_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, email: str) -> Optional[Principal]:
+        key = _key(email)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, principal: Principal):
+        if self.ttl_seconds <= 0:
+            return
+        key = _key(principal.email)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: Optional[str] = None):
+        """Xóa một user (theo email) hoặc toàn bộ cache"""
+        with self._lock:
+            if email is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(_key(email), None)
+            self._stats["invalidations"] += 1
+        logger.info(f"Identity cache invalidated: email={email!r}")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+
+# Create singleton instance
+identity_cache = IdentityCache()
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import LOGIN_DEBOUNCE_SECONDS, LOGIN_DEBOUNCE_MAX_ENTRIES
+
+
+def _key(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+class LoginDebouncer:
+    """
+    Debounce ghi M_User lúc login (LastLoginAt)
+
+    upsert_user nhớ user đã ghi theo email; login lặp lại trong `window_seconds`
+    với cùng profile (MicrosoftId, DisplayName, Provider) trả lại user đã nhớ,
+    không ghi DB. Profile đổi hoặc soft_delete_user -> ghi lại ngay.
+    LastLoginAt vì vậy trễ tối đa `window_seconds`.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = LOGIN_DEBOUNCE_SECONDS,
+        max_entries: int = LOGIN_DEBOUNCE_MAX_ENTRIES,
+    ):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, tuple, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"debounced": 0, "writes": 0}
+
+    def get(self, email: str, profile: tuple) -> Optional[Dict[str, Any]]:
+        key = _key(email)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != profile:
+                return None
+            self._stats["debounced"] += 1
+            return entry[2]
+
+    def put(self, email: str, profile: tuple, user: Dict[str, Any]):
+        self._stats["writes"] += 1
+        if self.window_seconds <= 0:
+            return
+        key = _key(email)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.window_seconds, profile, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._entries.pop(_key(email), None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries)}
+
+
+# Create singleton instance
+login_debouncer = LoginDebouncer()
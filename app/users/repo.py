@@ -1,75 +1,107 @@
 import uuid
-from app.db.connection import get_conn
+from typing import Optional
+from app.db.connection import READ, db_connection, db_router
+from app.db.executor import db_executor
+from app.users.identity_cache import identity_cache
+from app.users.login_debounce import login_debouncer
+
+def _email_key(email: str) -> str:
+    """Key read-your-writes (db_router) cho M_User theo email"""
+    return f"email:{(email or '').strip().lower()}"
+
 
 def get_user_by_email(email: str):
-    conn = get_conn()
-    cur = conn.cursor()
+    with db_connection(READ, _email_key(email)) as conn:
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT TOP 1 *
+            FROM M_User
+            WHERE EmailAddress = ?
+              AND DeleteFlg = 0
+        """, email)
+
+        return cur.fetchone()
 
-    cur.execute("""
-        SELECT TOP 1 *
-        FROM M_User
-        WHERE EmailAddress = ?
-          AND DeleteFlg = 0
-    """, email)
 
-    row = cur.fetchone()
-    conn.close()
+# Một round trip: MERGE + OUTPUT trả luôn dòng M_User sau khi ghi
+UPSERT_USER_SQL = """
+    MERGE M_User WITH (HOLDLOCK) AS t
+    USING (
+        SELECT ? AS EmailAddress, ? AS MicrosoftId, ? AS DisplayName, ? AS Provider
+    ) AS s
+    ON t.EmailAddress = s.EmailAddress
+    WHEN MATCHED THEN
+        UPDATE SET
+            MicrosoftId = s.MicrosoftId,
+            DisplayName = s.DisplayName,
+            LastLoginAt = GETDATE(),
+            Provider = s.Provider
+    WHEN NOT MATCHED THEN
+        INSERT ( MicrosoftId, LoginName, DisplayName, EmailAddress, Provider, LastLoginAt, CreatedAt)
+        VALUES (s.MicrosoftId, s.EmailAddress, s.DisplayName, s.EmailAddress, s.Provider, GETDATE(), GETDATE())
+    OUTPUT inserted.*;
+"""
 
-    return row
 
 def upsert_user(email, microsoft_id, display_name, provider):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        IF EXISTS (
-            SELECT 1 FROM M_User WHERE EmailAddress = ?
-        )
-        BEGIN
+    profile = (microsoft_id, display_name, provider)
+    user = login_debouncer.get(email, profile)
+    if user is not None:
+        return user
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute(UPSERT_USER_SQL, email, microsoft_id, display_name, provider)
+        columns = [col[0] for col in cur.description]
+        rows = cur.fetchall()
+
+        conn.commit()
+        db_router.mark_write(_email_key(email))
+        identity_cache.invalidate(email)
+
+    # Giống SELECT cũ: user đã bị xóa (DeleteFlg = 1) -> None
+    users = [dict(zip(columns, row)) for row in rows]
+    user = next((u for u in users if not u.get("DeleteFlg")), None)
+    if user is None:
+        return None
+
+    login_debouncer.put(email, profile, user)
+    return user
+
+
+def soft_delete_user(email: str) -> bool:
+    """Đánh dấu DeleteFlg = 1; trả True nếu có user bị xóa"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute("""
             UPDATE M_User
-            SET
-                MicrosoftId = ?,
-                DisplayName = ?,
-                LastLoginAt = GETDATE(),
-                Provider = ?
+            SET DeleteFlg = 1
             WHERE EmailAddress = ?
-        END
-        ELSE
-        BEGIN
-            INSERT INTO M_User
-            ( MicrosoftId, LoginName, DisplayName, EmailAddress, Provider, LastLoginAt, CreatedAt)
-            VALUES
-            (?, ?, ?, ?, ?, GETDATE(),GETDATE())
-        END
-    """,
-    email,
-    microsoft_id,
-    display_name,
-    provider,
-    email,    
-    microsoft_id,
-    email,
-    display_name,
-    email,
-    provider
-    )
+              AND DeleteFlg = 0
+        """, email)
 
-    conn.commit()
+        deleted = cur.rowcount > 0
+        conn.commit()
+        db_router.mark_write(_email_key(email))
 
-    # lấy lại user
-    cur.execute("""
-        SELECT TOP 1 *
-        FROM M_User
-        WHERE EmailAddress = ?
-            AND DeleteFlg = 0
-    """, email)
+    identity_cache.invalidate(email)
+    login_debouncer.invalidate(email)
+    return deleted
 
-    row = cur.fetchone()
-    if row is None:
-        return None
 
-    columns = [col[0] for col in cur.description]
-    user = dict(zip(columns, row))
+# Async facade cho async routes: chạy trên DB executor, không block event loop
+async def get_user_by_email_async(email: str, timeout: Optional[float] = None):
+    return await db_executor.run(get_user_by_email, email, timeout=timeout)
+
+
+async def upsert_user_async(email, microsoft_id, display_name, provider, timeout: Optional[float] = None):
+    return await db_executor.run(
+        upsert_user, email, microsoft_id, display_name, provider, timeout=timeout
+    )
+
 
-    conn.close()
-    return user
\ No newline at end of file
+async def soft_delete_user_async(email: str, timeout: Optional[float] = None) -> bool:
+    return await db_executor.run(soft_delete_user, email, timeout=timeout)
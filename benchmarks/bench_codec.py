@@ -0,0 +1,74 @@
+"""
+Microbenchmark chi phí CPU mỗi token trên streaming hot path
+
+Cũ : json.loads mỗi dòng upstream + json.dumps (str) mỗi frame, metadata
+     double-encode trong [[META]], Starlette encode str -> bytes
+Mới: codec.loads + frame bytes encode sẵn một lần (app.chat.generations.encode_frame)
+
+Chạy: python -m benchmarks.bench_codec [--tokens N] [--repeat R]
+"""
+
+import argparse
+import json
+import time
+
+from app import codec
+from app.chat.generations import encode_frame
+
+TOKEN = "検索結果によると、"
+METADATA = {"pdf_details": [{"file": "manual.pdf", "page": i, "score": 0.9} for i in range(5)]}
+
+
+def upstream_lines(n: int):
+    lines = [json.dumps({"type": "text", "data": TOKEN}, ensure_ascii=False) for _ in range(n)]
+    lines.append(json.dumps({"type": "metadata", "data": METADATA}, ensure_ascii=False))
+    return lines
+
+
+def old_path(lines):
+    out = 0
+    for line in lines:
+        event = json.loads(line)
+        if event["type"] == "text":
+            frame = json.dumps(event, ensure_ascii=False) + "\n"
+        else:
+            frame = f"{json.dumps({'type':'text','data': '[[META]]' + json.dumps(event['data'])}, ensure_ascii=False)}\n"
+        out += len(frame.encode("utf-8"))
+    return out
+
+
+def new_path(lines):
+    out = 0
+    for line in lines:
+        out += len(encode_frame(codec.loads(line)))
+    return out
+
+
+def bench(fn, lines, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(lines)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = upstream_lines(args.tokens)
+    old = bench(old_path, lines, args.repeat)
+    new = bench(new_path, lines, args.repeat)
+
+    print(f"codec backend : {codec.BACKEND}")
+    print(f"tokens        : {args.tokens}")
+    print(f"old           : {old / args.tokens * 1e9:8.0f} ns/token")
+    print(f"new           : {new / args.tokens * 1e9:8.0f} ns/token")
+    print(f"speedup       : {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
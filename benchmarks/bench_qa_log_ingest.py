@@ -0,0 +1,87 @@
+"""
+Throughput ghi T_QA_Log: per-row vs batch vs bulk ingestion
+
+per-row: ChatDBService.register_qa_log (1 round trip + 1 commit / dòng)
+batch  : ChatDBService.register_qa_log_batch (1 round trip / dòng, 1 commit)
+bulk   : ChatDBService.register_qa_log_bulk (fast_executemany + loop phía server, 1 commit)
+
+Cần DB thật (biến môi trường DB_* như app). Các dòng benchmark dùng
+SessionId bắt đầu bằng "bench-" và bị xóa sau mỗi lần đo.
+
+Chạy: python -m benchmarks.bench_qa_log_ingest --user-cd 1 [--rows N] [--sessions S]
+"""
+
+import argparse
+import time
+import uuid
+
+from app.chat.chat_db_service import chat_db_service
+from app.db.connection import db_connection, db_pool
+
+QUESTION = "製品マニュアルの保証期間について教えてください。"
+ANSWER = "検索結果によると、保証期間はご購入日から1年間です。" * 20
+
+
+def make_rows(n: int, sessions: int, user_cd: int):
+    session_ids = [f"bench-{uuid.uuid4()}"[:36] for _ in range(sessions)]
+    return [
+        {
+            "session_id": session_ids[i % sessions],
+            "turn_no": None,
+            "user_cd": user_cd,
+            "question_text": QUESTION,
+            "answer_text": ANSWER,
+        }
+        for i in range(n)
+    ]
+
+
+def cleanup():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM T_QA_Session WHERE SessionId LIKE 'bench-%'")
+        cursor.execute("DELETE FROM T_QA_Log WHERE SessionId LIKE 'bench-%'")
+        conn.commit()
+
+
+def per_row(rows):
+    return [
+        chat_db_service.register_qa_log(
+            r["session_id"], r["turn_no"], r["user_cd"], r["question_text"], r["answer_text"]
+        )
+        for r in rows
+    ]
+
+
+def run(name, fn, rows):
+    cleanup()
+    start = time.perf_counter()
+    results = fn(rows)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if not r["success"])
+    print(f"{name:8}: {len(rows) / elapsed:9.1f} rows/s  ({elapsed * 1000:8.1f} ms, failed={failed})")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-cd", type=int, required=True, help="UserCD có trong M_User")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    db_pool.start()
+    try:
+        rows = make_rows(args.rows, args.sessions, args.user_cd)
+        print(f"rows          : {args.rows} ({args.sessions} sessions)")
+        base = run("per-row", per_row, rows)
+        batch = run("batch", chat_db_service.register_qa_log_batch, rows)
+        bulk = run("bulk", chat_db_service.register_qa_log_bulk, rows)
+        print(f"bulk speedup  : {base / bulk:8.2f}x vs per-row, {batch / bulk:8.2f}x vs batch")
+    finally:
+        cleanup()
+        db_pool.close()
+
+
+if __name__ == "__main__":
+    main()
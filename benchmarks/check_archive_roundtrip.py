@@ -0,0 +1,146 @@
+"""
+Kiểm tra round trip archive T_QA_Log với blob local (LocalAppendBlobStore)
+
+Ghi một session "bench-" (N turn), archive toàn bộ vào thư mục tạm rồi đọc
+lại qua từng reader - mọi turn phải còn nguyên:
+- ChatService.get_session_history (toàn bộ + phân trang)
+- ConversationHistory.build (chat_history gửi upstream)
+- GET /api/conversation/{id}/history/stream (full + summary)
+- GET /api/conversation/{id}/turn/{n}
+- ConversationSearchIndex.search (kết quả + snippet)
+
+Cần DB thật (biến môi trường DB_* như app) và bảng T_QA_Archive
+(python -m app.chat.archive --create-table). Blob ghi vào thư mục tạm, không
+cần Azure. Các dòng "bench-" và manifest bị xóa sau khi chạy.
+
+Chạy: python -m benchmarks.check_archive_roundtrip --user-cd 1 [--turns N]
+"""
+
+import argparse
+import asyncio
+import tempfile
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import codec
+from app.auth.principal import current_principal
+from app.azure.append_blob import LocalAppendBlobStore
+from app.chat.archive import qa_log_archive
+from app.chat.chat_db_service import chat_db_service
+from app.chat.history import conversation_history
+from app.chat.routes import router
+from app.chat.search_index import search_index
+from app.chat.service import chat_service
+from app.db.connection import db_connection, db_pool
+from app.users.identity_cache import Principal
+
+KEYWORD = "archivecheck"
+
+
+def make_rows(session_id: str, turns: int, user_cd: int):
+    return [
+        {
+            "session_id": session_id,
+            "turn_no": None,
+            "user_cd": user_cd,
+            "question_text": f"質問 {i} {KEYWORD}{i}",
+            "answer_text": f"回答 {i} {KEYWORD}{i}",
+        }
+        for i in range(1, turns + 1)
+    ]
+
+
+def cleanup():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM T_QA_Archive WHERE SessionId LIKE 'bench-%'")
+        cursor.execute("DELETE FROM T_QA_Session WHERE SessionId LIKE 'bench-%'")
+        cursor.execute("DELETE FROM T_QA_Log WHERE SessionId LIKE 'bench-%'")
+        conn.commit()
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name}{': ' + detail if detail and not ok else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-cd", type=int, required=True, help="UserCD có trong M_User")
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    db_pool.start()
+    root = tempfile.mkdtemp(prefix="qa-archive-")
+    qa_log_archive.enabled = True
+    qa_log_archive._store = LocalAppendBlobStore(root)
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[current_principal] = lambda: Principal(
+        user_cd=args.user_cd, email="bench@example.com", display_name="bench"
+    )
+    client = TestClient(app)
+
+    session_id = f"bench-{uuid.uuid4()}"[:36]
+    rows = make_rows(session_id, args.turns, args.user_cd)
+    expected = [r["question_text"] for r in rows]
+    results = []
+    try:
+        chat_db_service.register_qa_log_batch(rows)
+        archived = qa_log_archive.archive_session(session_id, args.user_cd)
+        print(f"blob root     : {root}")
+        results.append(check("archive_session", archived == args.turns, f"archived={archived}"))
+        results.append(check(
+            "hot rows removed", not chat_db_service.get_session_logs(session_id)
+        ))
+
+        history = asyncio.run(chat_service.get_session_history(session_id, args.user_cd))
+        got = [log["QuestionText"] for log in history["logs"]]
+        results.append(check("get_session_history", got == expected, f"got={got}"))
+
+        page = asyncio.run(chat_service.get_session_history(session_id, args.user_cd, limit=2))
+        got = [log["QuestionText"] for log in page["logs"]]
+        results.append(check("get_session_history(limit=2)", got == expected[-2:], f"got={got}"))
+
+        built = asyncio.run(conversation_history.build(session_id, args.user_cd))
+        got = [h["question"] for h in built]
+        results.append(check("ConversationHistory.build", bool(got) and got == expected[-len(got):], f"got={got}"))
+
+        for view in ("full", "summary"):
+            response = client.get(f"/api/conversation/{session_id}/history/stream", params={"view": view})
+            lines = [codec.loads(line) for line in response.text.splitlines() if line]
+            turns = [line for line in lines if line.get("type") == "turn"]
+            results.append(check(
+                f"history/stream?view={view}",
+                response.status_code == 200 and len(turns) == args.turns,
+                f"status={response.status_code}, turns={len(turns)}",
+            ))
+
+        response = client.get(f"/api/conversation/{session_id}/turn/1")
+        body = response.json()
+        results.append(check(
+            "turn/1",
+            response.status_code == 200 and body["message"]["question"] == expected[0],
+            f"status={response.status_code}, body={body}",
+        ))
+
+        result = search_index.search(args.user_cd, f"{KEYWORD}{args.turns}")
+        hits = [r for r in result["results"] if r["session_id"] == session_id]
+        results.append(check(
+            "search_index.search",
+            len(hits) == 1 and hits[0]["turn_no"] == args.turns,
+            f"results={result['results']}",
+        ))
+    finally:
+        cleanup()
+        db_pool.close()
+
+    print(f"result        : {sum(results)}/{len(results)} passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Kiểm tra DBRouter (read replica + read-your-writes) với hai DB stand-in
+
+Primary = DB_NAME, read target = DB_READ_NAME (hai database khác nhau trên
+cùng SQL Server local, không cần replication). Mỗi connection được nhận
+diện bằng SELECT DB_NAME():
+- READ với key chưa ghi -> read target
+- mark_write(key) -> READ key đó đi primary trong `window` giây, key khác vẫn
+  đi read target; hết window -> lại read target
+- WRITE luôn đi primary
+- Read target lỗi -> fallback primary
+
+Sau đó chạy qua ChatDBService: ghi một QA log "bench-" lên primary rồi đọc
+lại ngay (get_session_logs / get_session_version) - phải thấy dòng vừa ghi
+dù read target là DB rỗng cùng schema (chưa được replicate).
+
+Cần: DB_* như app, DB_READ_NAME=<DB thứ hai cùng schema>, DB_READ_APPLICATION_INTENT_READONLY=0.
+
+Chạy: python -m benchmarks.check_read_routing --user-cd 1 [--window 1.0]
+"""
+
+import argparse
+import os
+import time
+import uuid
+
+from app.chat.chat_db_service import chat_db_service
+from app.config import DB_READ_ENABLED, DB_READ_NAME
+from app.db.connection import (
+    READ,
+    WRITE,
+    DBRouter,
+    PoolTimeout,
+    conversation_key,
+    db_connection,
+    db_pool,
+    db_read_pool,
+    db_router,
+)
+
+
+def db_name(router: DBRouter, intent: str, key=None) -> str:
+    with router.connection(intent, key) as conn:
+        return conn.cursor().execute("SELECT DB_NAME() AS Name").fetchone().Name
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    print(f"{'OK  ' if ok else 'FAIL'} {name}{': ' + detail if detail and not ok else ''}")
+    return ok
+
+
+class _DownPool:
+    """Read target không mở được connection"""
+
+    def connection(self):
+        raise PoolTimeout("read target down")
+
+
+def cleanup():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM T_QA_Session WHERE SessionId LIKE 'bench-%'")
+        cursor.execute("DELETE FROM T_QA_Log WHERE SessionId LIKE 'bench-%'")
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-cd", type=int, required=True, help="UserCD có trong M_User")
+    parser.add_argument("--window", type=float, default=1.0, help="read-your-writes window (giây)")
+    args = parser.parse_args()
+
+    if not DB_READ_ENABLED:
+        raise SystemExit("DB_READ_NAME / DB_READ_SERVER is not set")
+    primary, replica = os.getenv("DB_NAME"), DB_READ_NAME
+    if primary == replica:
+        raise SystemExit("DB_READ_NAME must be a different database than DB_NAME")
+
+    db_router.start()
+    router = DBRouter(db_pool, db_read_pool, window=args.window)
+    results = []
+    try:
+        key = conversation_key(f"bench-{uuid.uuid4()}")
+        other = conversation_key(f"bench-{uuid.uuid4()}")
+
+        got = db_name(router, READ, key)
+        results.append(check("read before write -> read target", got == replica, got))
+        router.mark_write(key)
+        got = db_name(router, READ, key)
+        results.append(check("read after mark_write -> primary", got == primary, got))
+        got = db_name(router, READ, other)
+        results.append(check("other key -> read target", got == replica, got))
+        got = db_name(router, WRITE)
+        results.append(check("write -> primary", got == primary, got))
+        time.sleep(args.window + 0.1)
+        got = db_name(router, READ, key)
+        results.append(check("after window -> read target", got == replica, got))
+
+        down = DBRouter(db_pool, _DownPool(), window=args.window)
+        got = db_name(down, READ, key)
+        results.append(check("read target down -> primary", got == primary, got))
+        print(f"router stats  : {router.stats()}")
+
+        # End-to-end qua ChatDBService + router dùng chung của app
+        session_id = f"bench-{uuid.uuid4()}"[:36]
+        result = chat_db_service.register_qa_log(session_id, None, args.user_cd, "bench question", "bench answer")
+        results.append(check("register_qa_log", result["success"], str(result)))
+        pinned = db_router.stats()["pinned_reads"]
+        logs = chat_db_service.get_session_logs(session_id)
+        version = chat_db_service.get_session_version(session_id, args.user_cd)
+        results.append(check("get_session_logs sees own write", len(logs) == 1, f"logs={len(logs)}"))
+        results.append(check("get_session_version sees own write", version is not None, f"version={version}"))
+        results.append(check(
+            "reads pinned to primary", db_router.stats()["pinned_reads"] - pinned == 2, str(db_router.stats())
+        ))
+    finally:
+        cleanup()
+        db_router.close()
+
+    print(f"result        : {sum(results)}/{len(results)} passed")
+    raise SystemExit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()